@@ -0,0 +1,77 @@
+#
+# This file has support for handing loaded artifacts (road graphs, tables, distance stores) from
+# one eero stage to the next without going through the disk.
+#
+# Normally each stage runs in its own Python process and re-reads what the previous stage just
+# wrote. When the stages are run in a single process (see "e_run.py"), the writer of an artifact
+# can "remember" the object it wrote, and a later reader of the same file gets that object back
+# instead of parsing the file again. The files are still written as usual, so the disk always
+# has the complete set of outputs.
+#
+# An object is only handed back if the file is unchanged since it was remembered (same size and
+# modification time), so anything that rewrites the file behind our back just causes a normal
+# read. Remembered objects are shared between stages, so readers must treat them as read-only,
+# just like the memory-mapped tables from "e_table_support".
+#
+
+
+import os
+
+
+# Nothing is kept unless this is switched on; in a one-stage process, holding on to the objects
+# that a stage wrote would just waste memory.
+keep_artifacts = False
+
+artifact_cache = {}
+
+
+def file_signature(fname):
+    """
+    Gets the (size, modification time) of a file, or None if it doesn't exist.
+    """
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime)
+
+
+def remember(fname, obj):
+    """
+    Keeps an object that was just written to (or read from) a file, so that later reads of the
+    file in this process can use it.
+
+    :param fname: name of the file
+    :param obj: the loaded form of the file
+    """
+    if not keep_artifacts:
+        return
+    signature = file_signature(fname)
+    if signature is not None:
+        artifact_cache[os.path.abspath(fname)] = (signature, obj)
+
+
+def recall(fname):
+    """
+    Gets the object remembered for a file, if there is one and the file hasn't changed since.
+
+    :param fname: name of the file
+    :return: the remembered object, or None
+    """
+    if not keep_artifacts:
+        return None
+    key = os.path.abspath(fname)
+    if key not in artifact_cache:
+        return None
+    (signature, obj) = artifact_cache[key]
+    if signature != file_signature(fname):
+        del artifact_cache[key]
+        return None
+    return obj
+
+
+def forget_all():
+    """
+    Drops all remembered objects.
+    """
+    artifact_cache.clear()
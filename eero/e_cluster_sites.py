@@ -6,10 +6,12 @@
 import csv
 from e_smpc import smpc
 import os
-import fiona
+from e_utils import psvarray
+from e_metrics_support import StageMetrics
 
 
 print('# Creating business area clusters from business site locations')
+metrics = StageMetrics('cluster_sites')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -23,20 +25,18 @@ biz_dir = '%s/biz' % msa_dir
 # Read the list of all sites to be used for business area definition.
 print('## Reading list of sites')
 site_loc_list = {}  # site locations
-site_id_list = []  # site IDs
-with open(area_dir + '/ba_site_list.psv') as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid = rec['siteId']
-        lon = float(rec['lon'])
-        lat = float(rec['lat'])
-        site_id_list.append(sid)
-        site_loc_list[sid] = {'xx': float(rec['xx']), 'yy': float(rec['yy']), 'lon': lon, 'lat': lat}
+metrics.input(area_dir + '/ba_site_list.psv')
+ba_sites = psvarray(area_dir + '/ba_site_list.psv')
+site_id_list = ba_sites['siteId'].tolist()  # site IDs
+for (sid, lon, lat, xx, yy) in zip(site_id_list, ba_sites['lon'].tolist(), ba_sites['lat'].tolist(),
+                                   ba_sites['xx'].tolist(), ba_sites['yy'].tolist()):
+    site_loc_list[sid] = {'xx': xx, 'yy': yy, 'lon': lon, 'lat': lat}
 
 
 # Get a list of distances to use for the clustering.
 fname = area_dir + '/ba_site_distances.psv'
 print('## Reading inter-site distances from "%s"' % fname)
+metrics.input(fname)
 site_distance_list = {}  # Inter-site distances.
 with open(fname) as infile:
     reader = csv.DictReader(infile, delimiter='|')
@@ -54,6 +54,7 @@ with open(fname) as infile:
 # attribute values. We save them and then read only those columns from the file.
 fname = area_dir + '/ba_site_attributes.psv'
 print('## Reading site attributes from "%s"' % fname)
+metrics.input(fname)
 attr_tag_list = []
 with open(fname) as infile:
     reader = csv.reader(infile, delimiter='|')
@@ -110,37 +111,24 @@ with open(area_dir + '/ba_test_points.psv', 'w') as outfile:
 
 # Make shapefiles with triangulation results.
 print('## Making shapefiles with triangulation results')
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
+from e_export_support import PointArray
+from e_export_support import segment_array
+from e_export_support import layer_name
+from e_export_support import write_layer
+
 schema = {'geometry': 'LineString', 'properties': {'d': 'float'}}
-with fiona.open(area_dir + '/s_tri_edges.shp', 'w', crs=crs, driver=driver, schema=schema) as dest:
-    for e in tri_graph.edges():
-        lon0 = site_loc_list[e[0]]['lon']
-        lat0 = site_loc_list[e[0]]['lat']
-        lon1 = site_loc_list[e[1]]['lon']
-        lat1 = site_loc_list[e[1]]['lat']
-        coords = [(lon0, lat0), (lon1, lat1)]
-        if e[0] < e[1]:
-            d = site_distance_list[(e[0], e[1])]
-        else:
-            d = site_distance_list[(e[1], e[0])]
-        feature = {'type': 'Feature',
-                   'id': '1',
-                   'geometry': {'coordinates': coords, 'type': 'LineString'},
-                   'properties': {'d': d}}
-        dest.write(feature)
+edge_list = list(tri_graph.edges())
+lon0 = [site_loc_list[e[0]]['lon'] for e in edge_list]
+lat0 = [site_loc_list[e[0]]['lat'] for e in edge_list]
+lon1 = [site_loc_list[e[1]]['lon'] for e in edge_list]
+lat1 = [site_loc_list[e[1]]['lat'] for e in edge_list]
+dd = [site_distance_list[(e[0], e[1]) if e[0] < e[1] else (e[1], e[0])] for e in edge_list]
+write_layer(layer_name(area_dir + '/s_tri_edges'), segment_array(lon0, lat0, lon1, lat1), {'d': dd}, schema)
 
 schema = {'geometry': 'Point', 'properties': {'id': 'str'}}
-with fiona.open(area_dir + '/s_tri_nodes.shp', 'w', crs=crs, driver=driver, schema=schema) as dest:
-    for nd in tri_graph.nodes():
-        lon0 = site_loc_list[nd]['lon']
-        lat0 = site_loc_list[nd]['lat']
-        coords = (lon0, lat0)
-        feature = {'type': 'Feature',
-                   'id': nd,
-                   'geometry': {'coordinates': coords, 'type': 'Point'},
-                   'properties': {'id': nd}}
-        dest.write(feature)
+node_list = list(tri_graph.nodes())
+points = PointArray([site_loc_list[nd]['lon'] for nd in node_list], [site_loc_list[nd]['lat'] for nd in node_list])
+write_layer(layer_name(area_dir + '/s_tri_nodes'), points, {'id': node_list}, schema)
 
 
 # Write out a file containing the cluster label for each site.
@@ -148,6 +136,7 @@ with open(area_dir + '/ba_site_list.psv') as infile:
     reader = csv.DictReader(infile, delimiter='|')
     ofname = '%s/ba_clusters.psv' % area_dir
     print('## Writing file with business area cluster labels: "%s"' % ofname)
+    metrics.output(ofname)
     with open(ofname, 'w') as outfile:
         fieldnames = ['siteId', 'lon', 'lat', 'label']
         writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
@@ -159,4 +148,7 @@ with open(area_dir + '/ba_site_list.psv') as infile:
                              'label': labels[rec['siteId']]})
 
 
+metrics.finish()
+
+
 print
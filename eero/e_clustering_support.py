@@ -7,19 +7,14 @@
 # from matplotlib.pyplot import *
 #
 #
+
+# The sklearn and matplotlib imports are done inside the functions that use them, since they are slow
+# to load and plots are only made when "show" is set.
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
-from sklearn.cluster import ward_tree
-from sklearn.cluster import DBSCAN
-from sklearn.neighbors import kneighbors_graph
 from scipy.sparse import coo_matrix
 from scipy.sparse import csc_matrix
 from scipy.sparse import find
 from scipy.spatial import Delaunay
-from scipy.cluster.hierarchy import dendrogram
-import matplotlib.pyplot as pyplot
-import matplotlib.colors as colors
-import matplotlib.cm as cm
 
 
 def cluster_all(site_list, attr_list, distance_list, param):
@@ -144,6 +139,8 @@ def subdivide(attr, connectivity, minClusterSize=5, maxClusterSize=100, mergeThr
 
     """
 
+    from sklearn.cluster import ward_tree
+
     # Get the number of samples -- i.e. the number entities being clustered.
     nSamples = attr.shape[0]
 
@@ -152,6 +149,9 @@ def subdivide(attr, connectivity, minClusterSize=5, maxClusterSize=100, mergeThr
         ward_tree(attr, connectivity=connectivity, return_distance=True)
 
     if show:
+        import matplotlib.pyplot as pyplot
+        from scipy.cluster.hierarchy import dendrogram
+
         # Initialize clusters.
         clusters = {}
         for i in range(nSamples):
@@ -249,6 +249,7 @@ def get_site_connectivity(loc, distanceThresh=None, show=False):
     use_knn = False
     if use_knn:
         # Create a connectivity matrix using a nearest-neighbors graph.
+        from sklearn.neighbors import kneighbors_graph
         connectivity = kneighbors_graph(loc, 4, include_self=False)
 
     else:
@@ -306,6 +307,7 @@ def get_site_connectivity(loc, distanceThresh=None, show=False):
         connectivity = coo_matrix((val, (row_index, col_index)), shape=(pointCount, pointCount))
 
     if show:
+        import matplotlib.pyplot as pyplot
         (rr, cc, vv) = find(connectivity)
         pyplot.figure(12)
         pyplot.clf()
@@ -353,6 +355,7 @@ def site_clusters_1(site_id_list, distance_lookup, epsilon=100.0, samples=3):
     x = csc_matrix((distance_values, (distance_row_index, distance_col_index)), shape=(site_count, site_count))
 
     # Find the clusters.
+    from sklearn.cluster import DBSCAN
     model = DBSCAN(eps=epsilon, min_samples=int(samples), metric='precomputed')
     labels = model.fit_predict(x)
 
@@ -0,0 +1,424 @@
+#
+# This file has support for computing site-to-site road network distances with the compiled
+# shortest path searches in "scipy.sparse.csgraph".
+#
+# The road graph is made into a CSR matrix of edge times once. Bounded Dijkstra searches ("dijkstra"
+# with "limit") are then run for a batch of source vertices at a time ("indices"), and the times to
+# the ends of every edge with sites on it are picked out of the results, so that the site pairs and
+# their distances are put together with array operations, rather than by looping over dictionaries.
+# Each vertex is only searched from once, however many sites start their searches there.
+#
+# "site_vertex_distances" instead adds a vertex for each site on its edge, and does a single search
+# from each site, which needs no special case for sites on the same edge.
+#
+# "dijkstra" gives back a full row of the distance matrix for each source, however small the limit,
+# so rather than searching the whole graph, the sources are split into square tiles, and each
+# tile's searches are done on just the part of the graph that could be reached from the tile: no
+# road is faster than the fastest edge, so nothing further away in a straight line than that speed
+# times the cutoff can be reached in time.
+#
+
+
+import numpy as np
+
+
+# Number of distances (sources times vertices) worked out by each call to "dijkstra"; this bounds
+# the memory used for its results.
+batch_cells = 1 << 24
+
+# Number of site pairs put together at a time; this bounds the memory used for them.
+batch_pairs = 1 << 22
+
+# Size of the tiles that the sources are split into [m].
+tile_size = 2000.0
+
+
+def min_csr(vertex_count, rows, cols, data):
+    """
+    Makes a "scipy.sparse" CSR matrix from a list of entries. Where the same entry is given more
+    than once, the lowest value is kept.
+
+    :param vertex_count: number of rows and columns
+    :param rows: array of row numbers
+    :param cols: array of column numbers
+    :param data: array of values
+    :return: csr_matrix
+    """
+    from scipy.sparse import csr_matrix
+
+    order = np.lexsort((data, cols, rows))
+    key = rows[order] * vertex_count + cols[order]
+    first = order[np.flatnonzero(np.diff(np.concatenate(([-1], key))) != 0)]
+    indptr = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[first], minlength=vertex_count), out=indptr[1:])
+    return csr_matrix((data[first], cols[first], indptr), shape=(vertex_count, vertex_count))
+
+
+def graph_entries(graph, edge_time):
+    """
+    Gets the entries of the adjacency matrix of a road graph, weighted by edge time.
+
+    :param graph: RoadGraph
+    :param edge_time: array giving the time for each edge
+    :return: (array of row numbers, array of column numbers, array of times)
+    """
+    rows = np.repeat(np.arange(graph.vertex_count, dtype=np.int64), np.diff(graph.indptr))
+    cols = np.asarray(graph.indices, dtype=np.int64)
+    data = np.asarray(edge_time, dtype=np.float64)[graph.entry_edge]
+    return (rows, cols, data)
+
+
+def time_graph(graph, edge_time):
+    """
+    Gets a road graph as a "scipy.sparse" CSR matrix of edge times. Where there are several edges
+    between the same two vertices, only the quickest is kept.
+
+    :param graph: RoadGraph
+    :param edge_time: array giving the time for each edge
+    :return: csr_matrix of shape (vertex_count, vertex_count), which is symmetric
+    """
+    (rows, cols, data) = graph_entries(graph, edge_time)
+    return min_csr(graph.vertex_count, rows, cols, data)
+
+
+def sub_graph(csgraph, vertices):
+    """
+    Gets the part of a graph made up of some of its vertices and the edges between them. (Indexing
+    the matrix would do, except that it drops edges with no weight.)
+
+    :param csgraph: csr_matrix
+    :param vertices: array of vertex numbers, in increasing order
+    :return: csr_matrix, with rows and columns numbered by position in "vertices"
+    """
+    from scipy.sparse import csr_matrix
+
+    local = np.full(csgraph.shape[0], -1, dtype=np.int64)
+    local[vertices] = np.arange(len(vertices))
+    n = csgraph.indptr[vertices + 1] - csgraph.indptr[vertices]
+    k = np.repeat(csgraph.indptr[vertices], n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    cols = local[csgraph.indices[k]]
+    keep = cols >= 0
+    indptr = np.zeros(len(vertices) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.repeat(np.arange(len(vertices)), n)[keep], minlength=len(vertices)), out=indptr[1:])
+    return csr_matrix((csgraph.data[k][keep], cols[keep], indptr), shape=(len(vertices), len(vertices)))
+
+
+def min_by_key(keys, values):
+    """
+    Gets the lowest value for each distinct key.
+
+    :return: (array of distinct keys, in increasing order, array of values)
+    """
+    order = np.argsort(keys)
+    keys = keys[order]
+    first = np.flatnonzero(np.diff(np.concatenate(([-1], keys))) != 0)
+    return (keys[first], np.minimum.reduceat(values[order], first))
+
+
+def same_edge_pairs(site_edge, site_along):
+    """
+    Gets the distance between every pair of sites on the same edge (including each site and
+    itself), which is just the difference of their distances along it.
+
+    :param site_edge: array giving the edge index of each site
+    :param site_along: array giving the distance along its edge of each site
+    :return: (array of site indices, array of other site indices, array of distances)
+    """
+    order = np.argsort(site_edge, kind='mergesort')
+    (group_first, group_size) = np.unique(site_edge[order], return_index=True, return_counts=True)[1:]
+
+    # Pair each site with itself and the sites after it in its group.
+    pos = np.arange(len(order))
+    group_end = np.repeat(group_first + group_size, group_size)
+    n = group_end - pos
+    first = np.repeat(pos, n)
+    second = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + first
+    (ix0, ix1) = (order[first], order[second])
+    return (ix0, ix1, np.abs(site_along[ix0] - site_along[ix1]))
+
+
+def split_tiles(xx, yy):
+    """
+    Splits a set of points into square tiles of size "tile_size".
+
+    :param xx: array of x coordinates
+    :param yy: array of y coordinates
+    :return: (array of point numbers, sorted by tile, array giving the position in it of the
+        first point of each tile, with the number of points tacked on the end)
+    """
+    tx = np.floor((xx - xx.min()) / tile_size).astype(np.int64)
+    ty = np.floor((yy - yy.min()) / tile_size).astype(np.int64)
+    tile_of_point = np.unique(tx * (ty.max() + 1) + ty, return_inverse=True)[1]
+    order = np.argsort(tile_of_point, kind='mergesort')
+    return (order, np.searchsorted(tile_of_point[order], np.arange(tile_of_point.max() + 2)))
+
+
+def site_pair_distances(graph, edge_time, site_v0, site_v1, site_edge, site_along, site_length, cutoff):
+    """
+    Gets the road network distances between nearby pairs of sites. This gives the same results
+    as the searches in "e_get_site_road_distances" (the 'networkx' engine): for each site, a
+    search is done from each end of its edge, and a site on another edge that has both its ends
+    within the cutoff gets the shorter distance via either end; the distance between two sites on
+    the same edge is the distance between them along it.
+
+    :param graph: RoadGraph
+    :param edge_time: array giving the time for each edge
+    :param site_v0: array giving the vertex number at the start of each site's edge
+    :param site_v1: array giving the vertex number at the end of each site's edge
+    :param site_edge: array giving the edge index of each site
+    :param site_along: array giving the distance along its edge of each site
+    :param site_length: array giving the length of each site's edge
+    :param cutoff: maximum time for the searches
+    :return: (site index 0, site index 1, distance) arrays, with one entry for each pair of sites,
+        and site index 0 <= site index 1
+    """
+    from scipy.sparse.csgraph import dijkstra
+
+    site_v0 = np.asarray(site_v0, dtype=np.int64)
+    site_v1 = np.asarray(site_v1, dtype=np.int64)
+    site_edge = np.asarray(site_edge, dtype=np.int64)
+    site_along = np.asarray(site_along, dtype=np.float64)
+    site_length = np.asarray(site_length, dtype=np.float64)
+    site_count = len(site_edge)
+    csgraph = time_graph(graph, edge_time)
+
+    # Group the sites by edge.
+    site_order = np.argsort(site_edge, kind='mergesort')
+    (group_first, group_size) = np.unique(site_edge[site_order], return_index=True, return_counts=True)[1:]
+    group_v0 = site_v0[site_order[group_first]]
+    group_v1 = site_v1[site_order[group_first]]
+
+    # Each site is a "source" at both ends of its edge, at the distance along the edge to that end.
+    src_vertex = np.concatenate((site_v0, site_v1))
+    src_offset = np.concatenate((site_along, site_length - site_along))
+    src_site = np.concatenate((np.arange(site_count), np.arange(site_count)))
+
+    # How far a search can get in a straight line.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.asarray(graph.edge_length, dtype=np.float64) / edge_time
+    reach = cutoff * np.nanmax(speed) + 1.0
+
+    # Split the sources into tiles.
+    (vx, vy) = (graph.x[src_vertex], graph.y[src_vertex])
+    (src_order, tile_start) = split_tiles(vx, vy)
+
+    local = np.full(graph.vertex_count, -1, dtype=np.int64)
+    key_list = []
+    dist_list = []
+    done = 0
+    for t in range(len(tile_start) - 1):
+        sources = src_order[tile_start[t]:tile_start[t + 1]]
+
+        # The part of the graph that can be reached from the tile, and the edges with sites on them
+        # that are in it.
+        sub_vertices = np.flatnonzero((graph.x >= vx[sources].min() - reach) & (graph.x <= vx[sources].max() + reach) &
+                                      (graph.y >= vy[sources].min() - reach) & (graph.y <= vy[sources].max() + reach))
+        local[sub_vertices] = np.arange(len(sub_vertices))
+        tile_graph = sub_graph(csgraph, sub_vertices)
+        groups = np.flatnonzero((local[group_v0] >= 0) & (local[group_v1] >= 0))
+        (g0, g1) = (local[group_v0[groups]], local[group_v1[groups]])
+
+        # Many sources start at the same vertex, so each vertex is searched from just once. The
+        # sources are sorted by the vertex (row of "vertices") that they start from.
+        (vertices, src_row) = np.unique(local[src_vertex[sources]], return_inverse=True)
+        by_row = np.argsort(src_row, kind='mergesort')
+        row_start = np.searchsorted(src_row[by_row], np.arange(len(vertices) + 1))
+
+        batch = max(1, batch_cells // len(sub_vertices))
+        for a in range(0, len(vertices), batch):
+            b = min(a + batch, len(vertices))
+            times = dijkstra(tile_graph, directed=True, indices=vertices[a:b], limit=cutoff)
+
+            # The edges that have both ends within the cutoff, the sites on them, and the distance
+            # from the vertex to each site, via the nearer end of its edge.
+            (t0, t1) = (times[:, g0], times[:, g1])
+            (row, col) = np.nonzero(np.isfinite(t0) & np.isfinite(t1))
+            n = group_size[groups[col]]
+            (row, col) = (np.repeat(row, n), np.repeat(col, n))
+            k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            dest = site_order[group_first[groups[col]] + k]
+            dd0 = t0[row, col] + site_along[dest]
+            dd1 = t1[row, col] + site_length[dest] - site_along[dest]
+            vertex_dist = np.minimum(dd0, dd1)
+            dest_start = np.searchsorted(row, np.arange(b - a + 1))
+
+            # Now the total distance from each source to each site, for a few sources at a time.
+            src = sources[by_row[row_start[a]:row_start[b]]]
+            src_rows = src_row[by_row[row_start[a]:row_start[b]]] - a
+            m = dest_start[src_rows + 1] - dest_start[src_rows]
+            split = np.searchsorted(np.cumsum(m), np.arange(batch_pairs, m.sum(), batch_pairs), side='right')
+            for (i0, i1) in zip(np.concatenate(([0], split)), np.concatenate((split, [len(src)]))):
+                mm = m[i0:i1]
+                if mm.sum() == 0:
+                    continue
+                pair_src = np.repeat(src[i0:i1], mm)
+                j = np.repeat(dest_start[src_rows[i0:i1]], mm) + np.arange(mm.sum()) - np.repeat(np.cumsum(mm) - mm, mm)
+                source = src_site[pair_src]
+                keys = np.minimum(source, dest[j]) * site_count + np.maximum(source, dest[j])
+                (keys, dist) = min_by_key(keys, src_offset[pair_src] + vertex_dist[j])
+                key_list.append(keys)
+                dist_list.append(dist)
+
+        local[sub_vertices] = -1
+        if (done + len(sources)) // 1000 > done // 1000 or done + len(sources) == len(src_vertex):
+            print('### Source %d / %d' % (done + len(sources), len(src_vertex)))
+        done += len(sources)
+
+    (keys, dist) = min_by_key(np.concatenate(key_list), np.concatenate(dist_list))
+
+    # Sites on the same edge get the distance along the edge, in place of what the searches found.
+    (ix0, ix1, same_dist) = same_edge_pairs(site_edge, site_along)
+    same_keys = np.minimum(ix0, ix1) * site_count + np.maximum(ix0, ix1)
+    pos = np.minimum(np.searchsorted(keys, same_keys), len(keys) - 1)
+    found = keys[pos] == same_keys
+    dist[pos[found]] = same_dist[found]
+    keys = np.concatenate((keys, same_keys[~found]))
+    dist = np.concatenate((dist, same_dist[~found]))
+    return (keys // site_count, keys % site_count, dist)
+
+
+def first_road_vertex(pred, is_road):
+    """
+    Gets the first road vertex on the shortest path to each vertex, from the predecessors given by
+    "dijkstra", by following them back (several steps at a time) until the vertex before is not a
+    road vertex.
+
+    :param pred: array of predecessors, one row for each search
+    :param is_road: array saying, for each vertex, whether it's a road vertex
+    :return: array of the same shape as "pred"; entries for vertices that aren't road vertices, or
+        that weren't reached, are the vertex itself
+    """
+    n = pred.shape[1]
+    back = np.where((pred >= 0) & is_road & is_road[np.maximum(pred, 0)], pred, np.arange(n, dtype=pred.dtype))
+    rows = np.arange(len(pred))[:, np.newaxis]
+    while True:
+        further = back[rows, back]
+        if np.array_equal(further, back):
+            return back
+        back = further
+
+
+def site_vertex_distances(graph, edge_time, site_edge, site_along, site_length, site_x, site_y, cutoff):
+    """
+    Gets the road network distances between nearby pairs of sites, treating each site as a vertex
+    on its edge, so that there is just one search for each site, rather than one from each end of
+    its edge, and sites on the same edge need no special handling.
+
+    The distances are measured as for "site_pair_distances": the time along the road network
+    between edge ends, plus the length of the part of the edge at each end. Each site's vertex has
+    edges to both ends of its edge, weighted by the length to them, and to the vertices of the
+    sites next to it on the edge, weighted by the length between them. Nothing from the road
+    network leads back to a site, so no path can go through one, and the edge lengths don't give
+    short cuts around the edge times.
+
+    The cutoff applies to the road network part of a path only, i.e. the time after the first
+    road vertex on it, as for the other engines, and a site on another edge is only in range if
+    both ends of its edge are. The results differ from those of "site_pair_distances" in two ways:
+    the time to each end is measured along the shortest path from the site, rather than from one
+    particular end of its edge; and two sites on the same edge get the shorter of the length
+    between them and the distance by any other way.
+
+    :param graph: RoadGraph
+    :param edge_time: array giving the time for each edge
+    :param site_edge: array giving the edge index of each site
+    :param site_along: array giving the distance along its edge of each site
+    :param site_length: array giving the length of each site's edge
+    :param site_x: array giving the x coordinate of each site's point on its edge
+    :param site_y: array giving the y coordinate of each site's point on its edge
+    :param cutoff: maximum time for the road network part of the searches
+    :return: (site index 0, site index 1, distance) arrays, with one entry for each pair of sites,
+        and site index 0 <= site index 1
+    """
+    from scipy.sparse.csgraph import dijkstra
+
+    site_edge = np.asarray(site_edge, dtype=np.int64)
+    site_along = np.asarray(site_along, dtype=np.float64)
+    site_length = np.asarray(site_length, dtype=np.float64)
+    site_x = np.asarray(site_x, dtype=np.float64)
+    site_y = np.asarray(site_y, dtype=np.float64)
+    site_count = len(site_edge)
+    vertex_count = graph.vertex_count
+
+    # The vertex of site i is vertex_count + i.
+    sites = np.arange(site_count, dtype=np.int64)
+    source = vertex_count + sites
+    edge_number = np.zeros(max(graph.edge_index.max(), site_edge.max()) + 1, dtype=np.int64)
+    edge_number[graph.edge_index] = np.arange(graph.edge_count)
+    v0 = graph.edge_v0[edge_number[site_edge]].astype(np.int64)
+    v1 = graph.edge_v1[edge_number[site_edge]].astype(np.int64)
+    to_v1 = site_length - site_along
+
+    # The sites next to each other on the same edge.
+    order = np.lexsort((sites, site_along, site_edge))
+    (a, b) = (order[:-1], order[1:])
+    same = site_edge[a] == site_edge[b]
+    (a, b) = (a[same], b[same])
+    between = site_along[b] - site_along[a]
+
+    (rows, cols, data) = graph_entries(graph, edge_time)
+    rows = np.concatenate((rows, source, source, source[a], source[b]))
+    cols = np.concatenate((cols, v0, v1, source[b], source[a]))
+    data = np.concatenate((data, site_along, to_v1, between, between))
+    csgraph = min_csr(vertex_count + site_count, rows, cols, data)
+
+    # The road network part of a path is worked out as the difference of two distances from the
+    # site, so it can come out a rounding error over the time it would have if it were added up
+    # from the first road vertex, as the other engines do; this allows for that.
+    road_cutoff = cutoff * (1 + 1e-9)
+
+    # How far a search can get in a straight line from the site's edge.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.asarray(graph.edge_length, dtype=np.float64) / edge_time
+    road_reach = cutoff * np.nanmax(speed) + 1.0
+
+    (site_order, tile_start) = split_tiles(site_x, site_y)
+    key_list = []
+    dist_list = []
+    for t in range(len(tile_start) - 1):
+
+        # The sites in the tile, shortest edge first, so that the searches from each batch of them
+        # can be bounded by the length of the longest edge in the batch plus the cutoff.
+        tile_sites = site_order[tile_start[t]:tile_start[t + 1]]
+        tile_sites = tile_sites[np.argsort(site_length[tile_sites], kind='mergesort')]
+
+        # The part of the graph that can be reached from the tile: the road vertices, the sites
+        # that might be on the same edge as one in the tile, and the sites that have both ends of
+        # their edge in it.
+        reach = road_reach + site_length[tile_sites].max()
+        (x0, x1) = (site_x[tile_sites].min() - reach, site_x[tile_sites].max() + reach)
+        (y0, y1) = (site_y[tile_sites].min() - reach, site_y[tile_sites].max() + reach)
+        road_in = (graph.x >= x0) & (graph.x <= x1) & (graph.y >= y0) & (graph.y <= y1)
+        site_in = (site_x >= x0) & (site_x <= x1) & (site_y >= y0) & (site_y <= y1)
+        sub_vertices = np.flatnonzero(np.concatenate((road_in, site_in)))
+        tile_graph = sub_graph(csgraph, sub_vertices)
+        is_road = sub_vertices < vertex_count
+        sub_sources = np.searchsorted(sub_vertices, source[tile_sites])
+        dest = np.flatnonzero(road_in[v0] & road_in[v1])
+        (d0, d1) = (np.searchsorted(sub_vertices, v0[dest]), np.searchsorted(sub_vertices, v1[dest]))
+        dv = np.searchsorted(sub_vertices, source[dest])
+        dv[~site_in[dest]] = -1
+
+        batch = max(1, batch_cells // len(sub_vertices))
+        for i in range(0, len(tile_sites), batch):
+            limit = (cutoff + site_length[tile_sites[i:i + batch]].max()) * (1 + 1e-9)
+            (times, pred) = dijkstra(tile_graph, directed=True, indices=sub_sources[i:i + batch], limit=limit,
+                                     return_predecessors=True)
+            road = times - times[np.arange(len(times))[:, np.newaxis], first_road_vertex(pred, is_road)]
+
+            # The sites that have both ends of their edge in range, and the distance to each one
+            # via either end, or along the edge from the site next to it.
+            (row, col) = np.nonzero((road[:, d0] <= road_cutoff) & (road[:, d1] <= road_cutoff))
+            dd0 = times[row, d0[col]] + site_along[dest[col]]
+            dd1 = times[row, d1[col]] + to_v1[dest[col]]
+            dd = np.where(dv[col] >= 0, times[row, np.maximum(dv[col], 0)], np.inf)
+            (s0, s1) = (tile_sites[i + row], dest[col])
+            keys = np.minimum(s0, s1) * site_count + np.maximum(s0, s1)
+            (keys, dist) = min_by_key(keys, np.minimum(np.minimum(dd0, dd1), dd))
+            key_list.append(keys)
+            dist_list.append(dist)
+
+        if tile_start[t + 1] // 1000 > tile_start[t] // 1000 or tile_start[t + 1] == site_count:
+            print('### Source site %d / %d' % (tile_start[t + 1], site_count))
+
+    (keys, dist) = min_by_key(np.concatenate(key_list), np.concatenate(dist_list))
+    return (keys // site_count, keys % site_count, dist)
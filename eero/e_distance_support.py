@@ -0,0 +1,222 @@
+#
+# This file has functions supporting the storage of site-to-site distances.
+#
+# The road network distance stages produce distances for tens of millions of site pairs. Rather
+# than writing them as "siteId0|siteId1|distance" text rows, they are kept in a compact binary
+# file holding a sparse matrix in CSR ("compressed sparse row") layout:
+#
+#   header   8-byte magic string, then the site count and the number of stored entries (int64)
+#   indptr   int64[site_count + 1]; the entries of row i are at positions indptr[i]:indptr[i+1]
+#   indices  int32[entry_count]; the column (other site) of each entry, ascending within a row
+#   data     float32[entry_count]; the distance for each entry
+#
+# Rows and columns are site indices, i.e. row numbers in the "site_list.psv" table. The matrix
+# is symmetric: each pair of sites appears in both of their rows, and a site's distance to itself
+# appears once, on the diagonal. The arrays can be memory-mapped, so opening a store is nearly
+# free and only the rows that are actually used get paged in.
+#
+
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from e_artifact_support import remember
+from e_artifact_support import recall
+
+
+csr_magic = b'EEROCSR1'
+csr_header_size = 32
+
+
+class PairDistances(object):
+    """
+    A symmetric sparse matrix of site-to-site distances, as read from (or about to be written
+    to) a CSR distance file.
+    """
+
+    def __init__(self, site_count, indptr, indices, data):
+        self.site_count = site_count
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def row(self, i):
+        """
+        Gets the sites that have a distance to site i, and the distances.
+
+        :param i: site index
+        :return: (array of site indices, array of distances)
+        """
+        a = self.indptr[i]
+        b = self.indptr[i + 1]
+        return self.indices[a:b], self.data[a:b]
+
+    def row_index(self):
+        """
+        Gets the row (site index) for every stored entry; i.e. the "expanded" form of indptr.
+        """
+        return np.repeat(np.arange(self.site_count, dtype=np.int32), np.diff(self.indptr))
+
+    def pairs(self):
+        """
+        Gets each pair of sites once, in the form (site index 0, site index 1, distance) with
+        site index 0 <= site index 1.
+
+        :return: tuple of three arrays
+        """
+        rows = self.row_index()
+        keep = rows <= self.indices
+        return rows[keep], np.asarray(self.indices[keep]), np.asarray(self.data[keep])
+
+    def matrix(self):
+        """
+        Gets the distances as a "scipy.sparse" CSR matrix. Note that zero distances are stored
+        explicitly, so for example every site's distance to itself is present.
+        """
+        return csr_matrix((self.data, self.indices, self.indptr), shape=(self.site_count, self.site_count))
+
+    def with_data(self, data):
+        """
+        Gets a new store with the same sparsity structure as this one but different values.
+        """
+        return PairDistances(self.site_count, self.indptr, self.indices, data)
+
+
+def make_pair_distances(site_count, index0, index1, distance):
+    """
+    Builds a distance store from a list of site pairs. Each pair need only be given once, in
+    either order; it is stored in both rows. If a pair is given more than once, the smallest
+    distance is kept.
+
+    :param site_count: number of sites (i.e. rows in the site table)
+    :param index0: array of site indices
+    :param index1: array of site indices
+    :param distance: array of distances
+    :return: PairDistances
+    """
+    index0 = np.asarray(index0, dtype=np.int32)
+    index1 = np.asarray(index1, dtype=np.int32)
+    distance = np.asarray(distance, dtype=np.float32)
+
+    # Add the mirror image of every off-diagonal pair.
+    off = index0 != index1
+    rows = np.concatenate((index0, index1[off]))
+    cols = np.concatenate((index1, index0[off]))
+    data = np.concatenate((distance, distance[off]))
+
+    # Sort by row, then column, then distance; the first of each run of duplicates is the
+    # one to keep.
+    order = np.lexsort((data, cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    data = data[order]
+    if len(rows) > 0:
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows = rows[first]
+        cols = cols[first]
+        data = data[first]
+
+    indptr = np.zeros(site_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=site_count), out=indptr[1:])
+    return PairDistances(site_count, indptr, cols, data)
+
+
+def round_distances(distance):
+    """
+    Rounds distances to the nearest 0.1, as formatting them with "%.1f" does; that is how they
+    were rounded when they were kept in text files. "np.round" multiplies by 10 and then rounds,
+    which can tip a value that is within a rounding error of a half-way point the other way, so
+    those few values are formatted instead.
+
+    :param distance: array of distances
+    :return: array of rounded distances
+    """
+    distance = np.asarray(distance, dtype=np.float64)
+    rounded = np.round(distance, 1)
+    tenths = distance * 10.0
+    near = np.flatnonzero(np.abs(tenths - np.floor(tenths) - 0.5) < 1e-6)
+    rounded[near] = [float('%.1f' % dd) for dd in distance[near].tolist()]
+    return rounded
+
+
+def write_pair_distances(fname, store):
+    """
+    Writes a distance store to a CSR distance file.
+
+    :param fname: name of the output file
+    :param store: PairDistances
+    """
+    header = np.zeros(3, dtype=np.int64)
+    header[0] = store.site_count
+    header[1] = len(store.data)
+    with open(fname, 'wb') as outfile:
+        outfile.write(csr_magic)
+        outfile.write(header.tobytes())
+        outfile.write(np.asarray(store.indptr, dtype=np.int64).tobytes())
+        outfile.write(np.asarray(store.indices, dtype=np.int32).tobytes())
+        outfile.write(np.asarray(store.data, dtype=np.float32).tobytes())
+
+    # Later stages in the same process can use the store as it is (see "e_artifact_support").
+    # Like a memory-mapped store, it is read-only from here on.
+    arrays = [np.asarray(a, dtype=t) for (a, t) in ((store.indptr, np.int64),
+                                                    (store.indices, np.int32),
+                                                    (store.data, np.float32))]
+    for a in arrays:
+        a.flags.writeable = False
+    remember(fname, PairDistances(store.site_count, arrays[0], arrays[1], arrays[2]))
+
+
+def read_pair_distances(fname, mmap=True):
+    """
+    Reads a CSR distance file.
+
+    :param fname: name of the input file
+    :param mmap: if True, memory-map the arrays rather than reading them into memory
+    :return: PairDistances
+    """
+    store = recall(fname)
+    if store is not None:
+        return store
+
+    with open(fname, 'rb') as infile:
+        magic = infile.read(len(csr_magic))
+        if magic != csr_magic:
+            raise ValueError('"%s" is not a CSR distance file' % fname)
+        header = np.frombuffer(infile.read(csr_header_size - len(csr_magic)), dtype=np.int64)
+    site_count = int(header[0])
+    entry_count = int(header[1])
+
+    offset = csr_header_size
+    sections = []
+    for (dtype, count) in ((np.int64, site_count + 1), (np.int32, entry_count), (np.float32, entry_count)):
+        if count == 0:
+            sections.append(np.zeros(0, dtype=dtype))
+        elif mmap:
+            sections.append(np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=(count,)))
+        else:
+            with open(fname, 'rb') as infile:
+                infile.seek(offset)
+                sections.append(np.fromfile(infile, dtype=dtype, count=count))
+        offset += count * np.dtype(dtype).itemsize
+
+    return PairDistances(site_count, sections[0], sections[1], sections[2])
+
+
+def write_pair_distances_psv(fname, store, site_id_list):
+    """
+    Writes a distance store in the old "siteId0|siteId1|distance" text format, with each
+    pair of sites appearing once. This is just for inspection and for tools outside the
+    pipeline; none of the eero stages read this file.
+
+    :param fname: name of the output file
+    :param store: PairDistances
+    :param site_id_list: site IDs, indexed by site index
+    """
+    (index0, index1, distance) = store.pairs()
+    with open(fname, 'w') as outfile:
+        outfile.write('siteId0|siteId1|distance\n')
+        for (i0, i1, dd) in zip(index0.tolist(), index1.tolist(), distance.tolist()):
+            outfile.write('%s|%s|%.1f\n' % (site_id_list[i0], site_id_list[i1], dd))
@@ -0,0 +1,214 @@
+#
+# This file has support for writing GIS layers: the shapefiles of roads, sites and business areas
+# that the eero stages make for debugging and display.
+#
+# Writing features one at a time with "fiona", after re-mapping each shape back to WGS84 on its
+# own, means a trip through PROJ and a trip through OGR for every feature. The functions here take
+# the geometry for a whole layer at once -- either as a list of shapely shapes, or as flat arrays
+# of coordinates ("PointArray" and "LineArray", which avoid building shapely objects at all) --
+# and write it in batches: the coordinates for each batch of features are re-mapped in a single
+# call, and the features are handed to OGR with a single "writerecords".
+#
+# Layers are written as shapefiles by default. Set EERO_EXPORT_FORMAT to "gpkg" (GeoPackage) or
+# "fgb" (FlatGeobuf) to write those instead; both get a spatial index. Stages that read a layer
+# back in use "layer_name" to find it.
+#
+
+
+import os
+import numpy as np
+from e_utils import gather_coords
+
+
+wgs84_crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
+
+# OGR drivers, and their layer creation options, for each output format.
+export_drivers = {'shp': ('ESRI Shapefile', {}),
+                  'gpkg': ('GPKG', {'SPATIAL_INDEX': 'YES'}),
+                  'fgb': ('FlatGeobuf', {'SPATIAL_INDEX': 'YES'})}
+
+export_format = os.environ.get('EERO_EXPORT_FORMAT', 'shp')
+
+# Number of features re-mapped and written at a time.
+batch_size = 10000
+
+
+class PointArray(object):
+    """
+    A set of points, stored as arrays of coordinates.
+    """
+
+    def __init__(self, xx, yy):
+        self.xx = np.asarray(xx, dtype=np.float64)
+        self.yy = np.asarray(yy, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.xx)
+
+    def mappings(self, start, stop, remap):
+        (xx, yy) = remap(self.xx[start:stop], self.yy[start:stop])
+        return [{'type': 'Point', 'coordinates': p} for p in zip(xx.tolist(), yy.tolist())]
+
+
+class LineArray(object):
+    """
+    A set of line strings, stored as flat arrays of coordinates. The coordinates of line i are
+    (xx[k], yy[k]) for k in offsets[i]:offsets[i+1].
+    """
+
+    def __init__(self, xx, yy, offsets):
+        self.xx = np.asarray(xx, dtype=np.float64)
+        self.yy = np.asarray(yy, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def mappings(self, start, stop, remap):
+        offsets = self.offsets[start:stop + 1]
+        (k0, k1) = (offsets[0], offsets[-1])
+        (xx, yy) = remap(self.xx[k0:k1], self.yy[k0:k1])
+        coords = list(zip(xx.tolist(), yy.tolist()))
+        offsets = (offsets - k0).tolist()
+        return [{'type': 'LineString', 'coordinates': coords[offsets[i]:offsets[i + 1]]}
+                for i in range(len(offsets) - 1)]
+
+
+def segment_array(x0, y0, x1, y1):
+    """
+    Makes a LineArray of straight line segments from (x0, y0) to (x1, y1).
+
+    :param x0: array of start x coordinates
+    :param y0: array of start y coordinates
+    :param x1: array of end x coordinates
+    :param y1: array of end y coordinates
+    :return: LineArray
+    """
+    xx = np.column_stack((x0, x1)).ravel()
+    yy = np.column_stack((y0, y1)).ravel()
+    return LineArray(xx, yy, np.arange(0, len(xx) + 1, 2))
+
+
+class ShapeList(object):
+    """
+    A list of shapely shapes.
+    """
+
+    def __init__(self, shapes):
+        self.shapes = list(shapes)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def mappings(self, start, stop, remap):
+        shapes = self.shapes[start:stop]
+        coord_list = []
+        for s in shapes:
+            gather_coords(s, coord_list)
+        if not coord_list:
+            return [shape_mapping(s, None) for s in shapes]
+
+        # Re-map the coordinates of all the shapes together, then hand them back out, in the same
+        # order that they were gathered.
+        coords = np.concatenate(coord_list)
+        (xx, yy) = remap(coords[:, 0], coords[:, 1])
+        coords = list(zip(xx.tolist(), yy.tolist()))
+        parts = []
+        k = 0
+        for cc in coord_list:
+            parts.append(coords[k:k + len(cc)])
+            k += len(cc)
+        parts = iter(parts)
+        return [shape_mapping(s, parts) for s in shapes]
+
+
+def shape_mapping(s, parts):
+    """
+    Makes the GeoJSON-like mapping for a shape, as "shapely.geometry.mapping" does, but using new
+    coordinates, taken in the order that "e_utils.gather_coords" produced them.
+    """
+    if s.is_empty:
+        import shapely.geometry
+        return shapely.geometry.mapping(s)
+    t = s.geom_type
+    if t == 'Point':
+        return {'type': t, 'coordinates': next(parts)[0]}
+    elif t in ('LineString', 'LinearRing'):
+        return {'type': t, 'coordinates': next(parts)}
+    elif t == 'Polygon':
+        return {'type': t, 'coordinates': [next(parts)] + [next(parts) for ring in s.interiors]}
+    elif t == 'GeometryCollection':
+        return {'type': t, 'geometries': [shape_mapping(part, parts) for part in s.geoms]}
+    else:
+        geoms = [part for part in s.geoms if not part.is_empty]
+        return {'type': t, 'coordinates': [shape_mapping(part, parts)['coordinates'] for part in geoms]}
+
+
+def layer_name(base):
+    """
+    Gets the file name for a GIS layer in the output format, e.g. ".../areas/s_ba_shapes.shp".
+
+    :param base: name of the layer file without the extension
+    """
+    return '%s.%s' % (base, export_format)
+
+
+def write_layer(fname, geometry, properties, schema, projector=None, crs=wgs84_crs):
+    """
+    Writes a GIS layer. The format is given by the extension of the file name (see "layer_name").
+
+    :param fname: name of the output file
+    :param geometry: PointArray, LineArray or ShapeList (or a list of shapely shapes)
+    :param properties: dictionary giving a list or array of values for each property
+    :param schema: fiona schema for the layer
+    :param projector: if given, the geometry is in the local CRS of the MSA, and is re-mapped to
+        WGS84 with this projector's "inverse" method
+    :param crs: CRS of the layer (only used if there is no projector)
+    """
+    import fiona
+
+    if isinstance(geometry, list):
+        geometry = ShapeList(geometry)
+    if projector is None:
+        remap = lambda xx, yy: (xx, yy)
+    else:
+        remap = projector.inverse
+        crs = wgs84_crs
+
+    ext = os.path.splitext(fname)[1][1:]
+    if ext not in export_drivers:
+        raise ValueError('Unknown GIS layer format "%s"' % fname)
+    (driver, options) = export_drivers[ext]
+    if driver not in fiona.supported_drivers:
+        raise ValueError('Writing "%s" needs the OGR "%s" driver' % (fname, driver))
+
+    if ext != 'shp':
+        # A GeoPackage can hold several layers, and writing one wouldn't replace the whole file.
+        if os.path.exists(fname):
+            os.remove(fname)
+
+        # Shapefiles don't tell single shapes from multi-part ones, but the other formats do, so
+        # e.g. a "Polygon" layer must be allowed to hold multipolygons too.
+        if schema['geometry'] in ('Point', 'LineString', 'Polygon'):
+            schema = dict(schema, geometry=(schema['geometry'], 'Multi' + schema['geometry']))
+
+    columns = [(name, values.tolist() if isinstance(values, np.ndarray) else list(values))
+               for (name, values) in properties.items()]
+
+    count = len(geometry)
+    skipped = 0
+    with fiona.open(fname, 'w', driver=driver, crs=crs, schema=schema, **options) as dest:
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            records = []
+            for (i, g) in zip(range(start, stop), geometry.mappings(start, stop, remap)):
+                if ext == 'fgb' and not (g.get('coordinates') or g.get('geometries')):
+                    # FlatGeobuf files with a spatial index can't hold empty shapes.
+                    skipped += 1
+                    continue
+                records.append({'type': 'Feature',
+                                'geometry': g,
+                                'properties': dict((name, values[i]) for (name, values) in columns)})
+            dest.writerecords(records)
+    if skipped:
+        print('!!! Left %d empty shapes out of "%s"' % (skipped, fname))
@@ -3,15 +3,18 @@
 #
 
 
-import shapely.geometry
-import fiona
 import numpy as np
 import csv
 import os
 from e_utils import psvin
+from e_utils import psvarray
+from e_distance_support import read_pair_distances
+from e_id_support import IdIndex
+from e_metrics_support import StageMetrics
 
 
 print('# Getting attributes for sites to be used for area definition')
+metrics = StageMetrics('get_ba_site_attributes')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -31,6 +34,7 @@ distance_cutoff = 500.0
 # Read the lookup table that maps business IDs into site IDs.
 ifname = biz_dir + '/biz_site_lookup.psv'
 print('## Reading business-to-site lookup table: "%s"' % ifname)
+metrics.input(ifname)
 biz_site_lookup = {}
 with open(ifname) as infile:
     reader = csv.DictReader(infile, delimiter='|')
@@ -44,6 +48,7 @@ with open(ifname) as infile:
 # bases the attributes of a site on the local business types.
 ifname = biz_dir + '/biz_list.psv'
 print('## Reading list of all businesses with category labels: "%s"' % ifname)
+metrics.input(ifname)
 biz_list = {}
 with open(ifname) as infile:
     reader = csv.DictReader(infile, delimiter='|')
@@ -56,44 +61,29 @@ with open(ifname) as infile:
 # Get the list of "ba" sites -- i.e. those being used for business area definition.
 print('## Initializing list of business area site attributes')
 ba_site_attrs = {}
-with open(area_dir + '/ba_site_list.psv') as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        site_id = rec['siteId']
-        ba_site_attrs[site_id] = {'siteId': site_id, 'lon': rec['lon'], 'lat': rec['lat']}
-
-
-# Read the list of site-to-site distances.
-fname = biz_dir + '/site_road_distances_scaled.psv'
-print('## Reading site-to-site distance lookup table: "%s"' % fname)
-distance_lookup = {}
-nearby_list = {}
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid0 = rec['siteId0']
-        sid1 = rec['siteId1']
-        road_distance = float(rec['distance'])
-        if road_distance < distance_cutoff:
+ba_sites = psvarray(area_dir + '/ba_site_list.psv')
+for (site_id, lon, lat) in zip(ba_sites['siteId'].tolist(), ba_sites['lon'].tolist(), ba_sites['lat'].tolist()):
+    ba_site_attrs[site_id] = {'siteId': site_id, 'lon': '%.6f' % lon, 'lat': '%.6f' % lat}
 
-            distance_lookup[(sid0, sid1)] = road_distance
 
-            if sid0 not in nearby_list:
-                nearby_list[sid0] = []
-            nearby_list[sid0].append(sid1)
+# Read the site-to-site distances. Rows and columns of the distance matrix are site indices, i.e.
+# row numbers in the site table. Only distances below the cutoff are of interest here.
+fname = biz_dir + '/site_list.psv'
+site_index = IdIndex(psvarray(fname)['siteId'].tolist())
+site_count = len(site_index)
 
-            if sid1 not in nearby_list:
-                nearby_list[sid1] = []
-            nearby_list[sid1].append(sid0)
+fname = biz_dir + '/site_road_distances_scaled.csr'
+print('## Reading site-to-site distance lookup table: "%s"' % fname)
+metrics.input(fname)
+distance_matrix = read_pair_distances(fname).matrix()
+distance_matrix.data = np.asarray(distance_matrix.data, dtype=np.float64)
+is_nearby = distance_matrix.data < distance_cutoff
 
 
 # Read the file defining local site density.
-site_density = {}
 fname = biz_dir + '/site_density.psv'
-with open(fname) as source:
-    reader = csv.DictReader(source, delimiter='|')
-    for rec in reader:
-        site_density[rec['siteId']] = float(rec['density'])
+density_table = psvarray(fname)
+site_density = dict(zip(density_table['siteId'].tolist(), density_table['density'].tolist()))
 
 
 # Read the lookup table defining business category semantics.
@@ -182,50 +172,35 @@ def add_attribute(attr_name, filter, kd_function, kd_param):
 
     print('## Computing attribute "%s"' % attr_name)
 
-    # Initialize this attribute for all BA sites.
-    for site_id in ba_site_attrs:
-        ba_site_attrs[site_id][attr_name] = 0.0
-
     # Here's what the block below does.
     # for each business:
     #     if this business has the property of interest:
     #         get the site id for this business
-    #         for all ba sites near this business:
+    #         for all sites near this business:
     #             get the distance between the two
-    #             increment the kernel density for the ba site, using that distance
+    #             increment the kernel density for the site, using that distance
+    #
+    # Summing over businesses is the same as counting the qualifying businesses at each site and then
+    # summing over sites, weighting by those counts. With the distances in a sparse matrix, that last
+    # step is just a matrix-vector product.
+    weights = np.zeros(site_count)
     for biz_id in biz_list:
 
         # This is where we apply the filter function.
         if filter(biz_list[biz_id]):
+            weights[site_index.index(biz_list[biz_id]['siteId'])] += 1.0
 
-            biz_site_id = biz_site_lookup[biz_id]
-
-            # The following condition happens for business sites that have nothing nearby. In those cases,
-            # the business site would not contribute to any other site's kernel density anyway, so we can safely
-            # skip the rest of the loop.
-            if biz_site_id not in nearby_list:
-                continue
+    # Apply the kernel density function to all the distances below the cutoff.
+    kernel = distance_matrix.copy()
+    kernel.data = np.where(is_nearby, kd_function(kernel.data, kd_param), 0.0)
 
-            for target_site_id in nearby_list[biz_site_id]:
-                if target_site_id in ba_site_attrs:
+    # Note that a site's own businesses are counted twice. That is how this worked when the distances
+    # came from a text file (a site's zero distance to itself showed up twice in its list of nearby sites),
+    # and it is kept so that the attribute values don't change.
+    values = kernel.dot(weights) + kernel.diagonal() * weights
 
-                    # Get the distance between that business site and this target site. Note that these distances
-                    # are indexed by a tuple in which the lexically smaller index comes first. Also note that the
-                    # distance lookup doesn't give the distance between a site and itself (i.e. zero), but we
-                    # need to include that case here.
-                    if biz_site_id == target_site_id:
-                        dd = 0.0
-                    else:
-                        if biz_site_id < target_site_id:
-                            index = (biz_site_id, target_site_id)
-                        else:
-                            index = (target_site_id, biz_site_id)
-                        dd = distance_lookup[index]
-
-                    # Increment the attribute value for this target site by the value of the given
-                    # kernel density function.
-                    v = kd_function(dd, kd_param)
-                    ba_site_attrs[target_site_id][attr_name] += v
+    for site_id in ba_site_attrs:
+        ba_site_attrs[site_id][attr_name] = values[site_index.index(site_id)]
 
 
 
@@ -267,6 +242,7 @@ for attr_name in attr_name_list:
 # Make the output file.
 ofname = area_dir + '/ba_site_attributes.psv'
 print('## Writing output file "%s"' % ofname)
+metrics.output(ofname)
 with open(ofname, 'w') as outfile:
     fieldnames = ['siteId', 'lon', 'lat'] + attr_name_list
     writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
@@ -276,27 +252,26 @@ with open(ofname, 'w') as outfile:
 
 
 # For debug / visualization purposes, make a shapefile that contains all the attribute values for each point.
-oname = '%s/s_ba_site_attributes.shp' % area_dir
+from e_export_support import PointArray
+from e_export_support import layer_name
+from e_export_support import write_layer
+oname = layer_name('%s/s_ba_site_attributes' % area_dir)
 print('## Making shapefile with attributes: "%s"' % oname)
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
+metrics.output(oname)
 schema = {'geometry': 'Point', 'properties': {}}
 for attr_name in attr_name_list:
     schema['properties'][attr_name] = 'float'
 
-with fiona.open(oname, 'w', crs=crs, driver=driver, schema=schema) as dest:
-    for site_id in sorted(ba_site_attrs.keys()):
-        props = {}
-        for attr_name in attr_name_list:
-            props[attr_name] = float(ba_site_attrs[site_id][attr_name])
-        lon = float(ba_site_attrs[site_id]['lon'])
-        lat = float(ba_site_attrs[site_id]['lat'])
-        feature = {'type': 'Feature',
-                   'id': site_id,
-                   'geometry': {'coordinates': (lon, lat), 'type': 'Point'},
-                   'properties': props}
-        dest.write(feature)
+site_id_list = sorted(ba_site_attrs.keys())
+points = PointArray([float(ba_site_attrs[site_id]['lon']) for site_id in site_id_list],
+                    [float(ba_site_attrs[site_id]['lat']) for site_id in site_id_list])
+props = {}
+for attr_name in attr_name_list:
+    props[attr_name] = [float(ba_site_attrs[site_id][attr_name]) for site_id in site_id_list]
+write_layer(oname, points, props, schema)
 
 
-print
+metrics.finish()
 
+
+print
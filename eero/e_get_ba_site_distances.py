@@ -4,12 +4,15 @@
 
 
 import csv
-from rtree import index
 import os
-from e_utils import get_remap_function
+import numpy as np
+from e_utils import psvarray
+from e_distance_support import read_pair_distances
+from e_metrics_support import StageMetrics
 
 
 print('# Compiling a collection of inter-site distance metrics for area definition')
+metrics = StageMetrics('get_ba_site_distances')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -21,81 +24,55 @@ biz_dir = '%s/biz' % msa_dir
 road_dir = '%s/roads' % msa_dir
 
 
-# A function for coordinate transformations.
-remap = get_remap_function()
-
-
 # Parameters used below.
 distance_cutoff = 400.0
 
 
-# First, get a list of all sites to be used for area definition.
-ba_site_list = {}
-fname = area_dir + '/ba_site_list.psv'
+# Get the list of all sites; the road network distances are indexed by row number in this table.
+fname = biz_dir + '/site_list.psv'
 print('## Reading list of sites from "%s"' % fname)
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid = rec['siteId']
-        xx = float(rec['xx'])
-        yy = float(rec['yy'])
-        ba_site_list[sid] = {'xx': xx, 'yy': yy}
-
-
-# Make a spatial index for sites.
-print('## Creating a spatial index for sites')
-site_rtree = index.Index()
-for site_id in ba_site_list:
-    xx = float(ba_site_list[site_id]['xx'])
-    yy = float(ba_site_list[site_id]['yy'])
-    site_rtree.insert(0, (xx, yy, xx, yy), site_id)
-
-
-# Read the list of road network distances. It is indexed by a tuple consisting of two
-# site identifiers.
-ifname = '%s/site_road_distances_scaled.psv' % biz_dir
+metrics.input(fname)
+sites = psvarray(fname)
+site_ids = sites['siteId']
+
+
+# Get a list of all sites to be used for area definition, and mark them in the big site list.
+fname = area_dir + '/ba_site_list.psv'
+print('## Reading list of area definition sites from "%s"' % fname)
+metrics.input(fname)
+ba_sites = psvarray(fname)
+is_ba_site = np.in1d(site_ids, ba_sites['siteId'])
+
+
+# Read the road network distances.
+ifname = '%s/site_road_distances_scaled.csr' % biz_dir
 print('## Reading scaled road network distances from "%s"' % ifname)
-road_distance_lookup = {}
-with open(ifname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        road_distance_lookup[(rec['siteId0'], rec['siteId1'])] = rec['distance']
+metrics.input(ifname)
+road_distances = read_pair_distances(ifname)
 
 
-# Loop over all sites. For each one, check the spatial index for sites that fall within
-# a threshold Euclidean distance.
+# Go through all site pairs that have a road network distance, and keep the ones where both sites are
+# used for area definition and fall within a threshold Euclidean distance of each other (in the sense of
+# a bounding box). Each row of the distance matrix lists all the sites near one site, so we get both
+# orderings of every pair, plus each site paired with itself.
 ofname = '%s/ba_site_distances.psv' % area_dir
 print('## Creating file containing inter-site distance metrics: "%s"' % ofname)
+metrics.output(ofname)
 print('### Output will only contain site pairs within %.0f meters of one another (Euclidean)' % distance_cutoff)
+thresh = distance_cutoff
+ix0 = road_distances.row_index()
+ix1 = np.asarray(road_distances.indices)
+keep = is_ba_site[ix0] & is_ba_site[ix1] & \
+    (np.abs(sites['xx'][ix1] - sites['xx'][ix0]) <= thresh) & \
+    (np.abs(sites['yy'][ix1] - sites['yy'][ix0]) <= thresh)
 with open(ofname, 'w') as outfile:
     writer = csv.writer(outfile, delimiter='|')
     writer.writerow(('siteId0', 'siteId1', 'distance'))
+    for (i0, i1, dd) in zip(ix0[keep].tolist(), ix1[keep].tolist(), road_distances.data[keep].tolist()):
+        writer.writerow((site_ids[i0], site_ids[i1], '%.0f' % dd))
+
+
+metrics.finish()
+
 
-    print('## Looping over sites')
-    k = 0
-    for siteId0 in ba_site_list:
-
-        k += 1
-        if k % 1000 == 0:
-            print('### Site %d / %d' % (k, len(ba_site_list)))
-
-        xx0 = float(ba_site_list[siteId0]['xx'])
-        yy0 = float(ba_site_list[siteId0]['yy'])
-        thresh = distance_cutoff
-        nearby = site_rtree.intersection((xx0-thresh, yy0-thresh, xx0+thresh, yy0+thresh), objects=True)
-        for x in nearby:
-            siteId1 = x.object
-
-            xx1 = float(ba_site_list[siteId1]['xx'])
-            yy1 = float(ba_site_list[siteId1]['yy'])
-
-            # Road network distance.
-            if siteId0 < siteId1:
-                ix = (siteId0, siteId1)
-            else:
-                ix = (siteId1, siteId0)
-            if ix in road_distance_lookup:
-                distance = '%.0f' % float(road_distance_lookup[ix])
-                writer.writerow((siteId0, siteId1, distance))
-
-print
\ No newline at end of file
+print
@@ -8,9 +8,11 @@
 import os
 import csv
 from e_utils import psvin
+from e_metrics_support import StageMetrics
 
 
 print('# Finding sites to be used for business area definition')
+metrics = StageMetrics('get_ba_site_list')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -27,11 +29,13 @@ road_dir = '%s/roads' % msa_dir
 # Read the table that gives business category semantics. That table contains an indicator of whether
 # businesses of any category are to be used for area definition.
 fname = '%s/sbc/sbc_semantics.psv' % ref_dir
+metrics.input(fname)
 biz_cat_semantics = psvin(fname, key='bcid')
 
 
 # Get a lookup table that maps business IDs to site IDs.
 fname = '%s/biz_site_lookup.psv' % biz_dir
+metrics.input(fname)
 site_lookup = psvin(fname, key='bizId')
 
 
@@ -40,6 +44,7 @@ site_lookup = psvin(fname, key='bizId')
 # business area definition. The "lambda" function below basically checks that field to determine whether
 # to keep a business.
 ifname = '%s/biz_list.psv' % biz_dir
+metrics.input(ifname)
 ba_biz_list = psvin(ifname, filter=lambda biz: biz_cat_semantics[biz['bcid']]['adef'] == '1')
 
 
@@ -59,6 +64,7 @@ with open('%s/site_list.psv' % biz_dir) as infile:
 
     ofname = '%s/ba_site_list.psv' % area_dir
     print('## Writing list of business area definition sites: "%s"' % ofname)
+    metrics.output(ofname)
     with open(ofname, 'w') as outfile:
         writer = csv.DictWriter(outfile, delimiter='|', fieldnames=reader.fieldnames)
         writer.writeheader()
@@ -68,10 +74,7 @@ with open('%s/site_list.psv' % biz_dir) as infile:
                 writer.writerow(rec)
 
 
-print
-
-
-
-
+metrics.finish()
 
 
+print
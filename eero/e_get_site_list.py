@@ -13,11 +13,18 @@
 
 import os
 import csv
-from rtree import index
-from e_utils import get_remap_function
+import numpy as np
+from e_spatial_index_support import build_index
+from e_spatial_index_support import point_boxes
+from e_utils import get_projector
+from e_utils import psvarray
+from e_table_support import save_table
+from e_id_support import first_appearance
+from e_metrics_support import StageMetrics
 
 
 print('# Refining list of businesses into list of distinct sites')
+metrics = StageMetrics('get_site_list')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -31,95 +38,75 @@ meta_dir = '%s/meta' % msa_dir
 road_dir = '%s/roads' % msa_dir
 
 
-# Get a function that re-maps coordinates for the local CRS.
-remap = get_remap_function()
+# Get the projector that re-maps coordinates for the local CRS.
+projector = get_projector()
 
 
 #
 # Read the input data, building a list of unique sites. A site's uniqueness is defined by its
 # xx and yy coordinates for the local MSA projection. These coordinates are rounded to meters.
 #
-idn = 0  # a counter, used for assigning site IDs
-site_list = {}
-biz_count = 0;
+# Sites are numbered in order of first appearance in the business list. The site index (starting
+# at 0) is the row number of the site in the site list; the site ID is that number plus one.
+#
 in_fname = '%s/biz_list.psv' % biz_dir
 print('## Reading list of businesses from "%s"' % in_fname)
-with open(in_fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-
-        biz_count += 1
-
-        biz_id = rec['pid']
-        lon = rec['lon']
-        lat = rec['lat']
-
-        # Get the reference coordinates for this location. Basically if the location has geocoded
-        # coordinates, we use them; otherwise we use the original coordinates.
-        if rec['gclon'] == '' or rec['gclat'] == '':
-            ref_lon = float(lon)
-            ref_lat = float(lat)
-        else:
-            ref_lon = float(rec['gclon'])
-            ref_lat = float(rec['gclat'])
-        
-        (xx, yy) = remap(ref_lon, ref_lat)
-
-        key = '%.0f-%.0f' % (xx, yy)
-        if key not in site_list:
-            idn += 1
-            site_id = '%d' % idn
-            site_list[key] = {'siteId': site_id,
-                              'lon': lon, 'lat': lat, 'xx': xx, 'yy': yy,
-                              'bizIdList': []}
-        site_list[key]['bizIdList'].append(biz_id)
+metrics.input(in_fname)
+biz_table = psvarray(in_fname)
+biz_count = len(biz_table)
+
+# Get the reference coordinates for each business. Basically if the location has geocoded
+# coordinates, we use them; otherwise we use the original coordinates.
+use_geocoded = ~(np.isnan(biz_table['gclon']) | np.isnan(biz_table['gclat']))
+ref_lon = np.where(use_geocoded, biz_table['gclon'], biz_table['lon'])
+ref_lat = np.where(use_geocoded, biz_table['gclat'], biz_table['lat'])
+(xx, yy) = projector.forward(ref_lon, ref_lat)
+
+key = np.column_stack((np.rint(xx), np.rint(yy))).astype(np.int64)
+(site_for_biz, first_biz) = first_appearance(key)
+site_count = len(first_biz)
 
 
 # Make the output files. First, the list of sites.
 out_fname = '%s/site_list.psv' % biz_dir
 print('## Writing list of sites to "%s"' % out_fname)
-with open(out_fname, 'w') as outfile:
-    fieldnames = ['siteId', 'lon', 'lat', 'xx', 'yy']
-    writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
-    writer.writeheader()
-    for key in site_list:
-        orec = {'siteId': site_list[key]['siteId'],
-                'lon': '%.6f' % float(site_list[key]['lon']),
-                'lat': '%.6f' % float(site_list[key]['lat']),
-                'xx': '%.0f' % site_list[key]['xx'],
-                'yy': '%.0f' % site_list[key]['yy']}
-        writer.writerow(orec)
+metrics.output(out_fname)
+site_ids = np.array(['%d' % (ix + 1) for ix in range(site_count)])
+site_table = np.empty(site_count, dtype=[('siteId', site_ids.dtype.str), ('lon', 'f8'), ('lat', 'f8'),
+                                         ('xx', 'f8'), ('yy', 'f8')])
+site_table['siteId'] = site_ids
+site_table['lon'] = biz_table['lon'][first_biz]
+site_table['lat'] = biz_table['lat'][first_biz]
+site_table['xx'] = xx[first_biz]
+site_table['yy'] = yy[first_biz]
+save_table(out_fname, site_table)
 
 
 # Next, write the file that gives the mapping between sites and businesses.
 out_fname = '%s/biz_site_lookup.psv' % biz_dir
 print('## Writing lookup table mapping businesses to sites: "%s"' % out_fname)
+metrics.output(out_fname)
 with open(out_fname, 'w') as outfile:
     fieldnames = ['siteId', 'bizId']
     writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
     writer.writeheader()
-    for key in site_list:
-        siteId = site_list[key]['siteId']
-        for bizId in site_list[key]['bizIdList']:
-            writer.writerow({'siteId': siteId, 'bizId': bizId})
+    biz_ids = biz_table['pid']
+    for ix in np.argsort(site_for_biz, kind='mergesort'):
+        writer.writerow({'siteId': site_ids[site_for_biz[ix]], 'bizId': biz_ids[ix]})
 
 
-# Build a spatial index for sites.
+# Build a spatial index for sites. The index entries are site indices.
 out_fname = '%s/site_rtree' % biz_dir
 print('## Creating a spatial index for sites: "%s"' % out_fname)
-try:
-    os.remove('%s/site_rtree.dat' % biz_dir)
-    os.remove('%s/site_rtree.idx' % biz_dir)
-except OSError:
-    pass
-
-idx = index.Rtree(out_fname)
-for key in site_list:
-    xx = float(site_list[key]['xx'])
-    yy = float(site_list[key]['yy'])
-    idx.insert(0, (xx, yy, xx, yy), site_list[key]['siteId'])
+idx = build_index(point_boxes(site_table['xx'], site_table['yy']), out_fname,
+                  source_fname='%s/site_list.psv' % biz_dir)
 idx.close()
 
 
-print('## %d businesses map to %d ditinct sites' % (biz_count, len(site_list)))
+print('## %d businesses map to %d ditinct sites' % (biz_count, site_count))
+
+
+metrics.finish()
+
+
 print
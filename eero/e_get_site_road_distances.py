@@ -6,10 +6,20 @@
 import networkx as nx
 from rote import *
 import os
-from e_utils import get_remap_function
+from e_utils import psvarray
+from e_distance_support import make_pair_distances
+from e_distance_support import write_pair_distances
+from e_distance_support import round_distances
+from e_id_support import IdIndex
+from e_graph_support import read_road_graph
+from e_csgraph_support import site_pair_distances
+from e_csgraph_support import site_vertex_distances
+from e_metrics_support import StageMetrics
+import numpy as np
 
 
 print('# Getting road network distances between nearby site pairs')
+metrics = StageMetrics('get_site_road_distances')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -25,29 +35,37 @@ road_dir = '%s/roads' % msa_dir
 distance_cutoff = 1200.0  # maximum distance [meters] for which to report road network distances.
 time_cutoff = 1200.0
 
-
-# Get a function to handle local map projections.
-remap = get_remap_function()
-
-
-# This is the list that we will be filling up here. It will consist of IDs of business pairs
-# along with the road network distance between them.
+# How to do the bounded shortest path searches: 'networkx' runs a Dijkstra search over the whole
+# graph for every source; 'csgraph' runs the searches in batches with "scipy.sparse.csgraph" and
+# puts the site pairs together with array operations (see "e_csgraph_support"). Both give the same
+# distances, except that a vertex whose time comes out right at the cutoff could in principle be
+# kept by one and dropped by the other, since they may add up the times along tied paths in a
+# different order.
+# 'virtual' also uses "scipy.sparse.csgraph", but treats each site as a vertex on its edge, so that
+# there is one search per site, and sites on the same edge are handled by the search like any
+# others; it keeps slightly different pairs near the cutoff, and a few of its distances are
+# shorter (see "e_csgraph_support.site_vertex_distances").
+distance_engine = os.environ.get('EERO_DISTANCE_ENGINE', 'networkx')
+
+
+# This is the list that we will be filling up here. It will consist of pairs of site indices
+# (i.e. row numbers in the site table) along with the road network distance between them.
+# See "doDistances" below.
 sitePairDistanceList = {}
 
 
-# Read the road network graph.
-fname = '%s/road_network.xml' % road_dir
+# Read the road network graph. Vertices are referred to by their vertex numbers in the graph file,
+# which are dense integers.
+fname = '%s/road_network.graph' % road_dir
 print('## Reading road network file "%s"' % fname)
-gg = nx.read_graphml(fname)
+metrics.input(fname)
+graph = read_road_graph(fname)
+vertexIndex = IdIndex(graph.vertex_id.tolist())
 
 
-# Add a "time" field to each edge. This will be based on a typical speed for each segement, which in turn depends
-# on its road class.
-for e in gg.edges():
-    e0 = e[0]
-    e1 = e[1]
-    length = gg.edge[e0][e1]['length']
-    road_class = gg.edge[e0][e1]['road_class']
+# Work out a "time" for each edge. This will be based on a typical speed for each segement, which in turn
+# depends on its road class.
+def road_speed(road_class):
 
     # Assign road speeds according to road class. Units are nominally meters per second.
     # These aren't really meant to be typical values -- they should just be considered relative
@@ -56,153 +74,193 @@ for e in gg.edges():
     # 500 meters apart on a major arterial are effectively "closer together" than are two
     # businesses that are 500 meters apart along residential streets.
     if road_class in ['primary', 'secondary']:
-        speed = 1.5
+        return 1.5
     elif road_class in ['residential']:
-        speed = 0.5
+        return 0.5
     else:
-        speed = 1.0
+        return 1.0
+
+
+edgeTime = np.array([length / road_speed(road_class)
+                     for (length, road_class) in zip(graph.edge_length.tolist(), graph.edge_road_classes())])
+
 
-    gg.edge[e0][e1]['time'] = length / speed
+# Read the list of road edges. The row number of an edge in this table is its edge index.
+fname = '%s/road_edges.psv' % road_dir
+print('## Reading road edge list: "%s"' % fname)
+metrics.input(fname)
+edgeIndex = IdIndex(psvarray(fname)['edge_id'].tolist())
 
 
 # Read the list of sites.
 fname = '%s/site_road_info.psv' % biz_dir
 print('## Reading site road network info: "%s"' % fname)
-siteList = {}
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        siteId = rec['siteId']
-        siteList[siteId] = rec
-
-
-# Below, we will need to get a list of sites on an edge given the edge ID. Here we
-# build a lookup table that lets us do that.
+metrics.input(fname)
+siteTable = psvarray(fname)
+siteCount = len(siteTable)
+siteEdge = edgeIndex.indices(siteTable['segId'].tolist()).tolist()
+siteSegAlong = siteTable['segAlong'].tolist()
+siteSegLength = siteTable['segLength'].tolist()
+
+
+# Below, we will need to get a list of sites on an edge given the edge. Here we build lookup tables
+# that let us do that. "sitesOnEdge" gives the sites on each edge, by edge index. "sitesLeaving" gives,
+# for each vertex, a list of (other vertex, sites) for the edges that start at that vertex and have
+# sites on them. Sites are given as row numbers in the site table; vertices as vertex indices.
 print('## Making edge / site lookup')
 sitesOnEdge = {}
-for siteId in siteList:
-    edgeId = siteList[siteId]['segId']
-    if edgeId not in sitesOnEdge:
-        sitesOnEdge[edgeId] = []
-    sitesOnEdge[edgeId].append(siteId)
+for ix in range(siteCount):
+    eix = siteEdge[ix]
+    if eix not in sitesOnEdge:
+        sitesOnEdge[eix] = []
+    sitesOnEdge[eix].append(ix)
+
+edgeV0 = {}
+edgeV1 = {}
+sitesLeaving = {}
+for eix in sitesOnEdge:
+    (v0, v1) = edgeIndex.id(eix).split('-')
+    edgeV0[eix] = vertexIndex.index(int(v0))
+    edgeV1[eix] = vertexIndex.index(int(v1))
+    if edgeV0[eix] not in sitesLeaving:
+        sitesLeaving[edgeV0[eix]] = []
+    sitesLeaving[edgeV0[eix]].append((edgeV1[eix], sitesOnEdge[eix]))
+
+
+# Set up the shortest path searches. "searchFrom" gives the time to every vertex within the time cutoff
+# of a given vertex. The 'csgraph' and 'virtual' engines do their searches all together, further down.
+print('## Setting up "%s" road network searches' % distance_engine)
+if distance_engine not in ['csgraph', 'virtual']:
+    gg = graph.networkx(labels='index')
+    for (v0, v1, t) in zip(graph.edge_v0.tolist(), graph.edge_v1.tolist(), edgeTime.tolist()):
+        gg[v0][v1]['time'] = t
+
+    def searchFrom(sourceNodeId):
+        # shortestPathLengths = nx.single_source_dijkstra_path_length(gg, sourceNodeId,
+        #                                                             cutoff=distance_cutoff, weight='length')
+        return nx.single_source_dijkstra_path_length(gg, sourceNodeId, cutoff=time_cutoff, weight='time')
 
 
 #
-# This is the routine that does all the work. It finds distances from a source site to all
-# destination sites within a given threshold distance.
+# This is the routine that does all the work. It finds distances from all the source sites
+# whose searches start at a given road network node to all destination sites within a given
+# threshold distance. The search is done once for the node, and the distance from the node to each
+# destination site is worked out once; the distance from each source site to the node is added
+# after that.
 #
-# This routine writes its results directly into the "sitePairDistanceList" dictionary.
+# This routine writes its results directly into the "sitePairDistanceList" dictionary, whose
+# keys are (smaller site index) * siteCount + (larger site index).
 # Note that entries of that dictionary may get updated over multiple calls to this function.
 # That's basically because the distance from A to B may not be the same as the distance from
 # B to A due to one way streets. In such cases the minimum distance is retained.
 #
-def doDistances(sourceNodeId, sourceSiteId, lengthOfFirstPart):
+def doDistances(sourceNodeId, sourceList):
 
     # Get the shortest path distance to all nodes within some threshold distance.
-    # shortestPathLengths = nx.single_source_dijkstra_path_length(gg, sourceNodeId,
-    #                                                             cutoff=distance_cutoff, weight='length')
-    shortestPathLengths = nx.single_source_dijkstra_path_length(gg, sourceNodeId,
-                                                                cutoff=time_cutoff, weight='time')
-
-    # This makes some debugging output, if needed.
-    # with open('tmp_localNodes_%s.csv' % sourceNodeId, 'w') as outfile:
-    #     writer = csv.DictWriter(outfile, delimiter='|', fieldnames=['id', 'lon', 'lat', 'dist[f]'])
-    #     writer.writeheader()
-    #     for nid in shortestPathLengths:
-    #         writer.writerow({'id': nid, 'lon': gg.node[nid]['lon'], 'lat': gg.node[nid]['lat'],
-    #                         'dist[f]': shortestPathLengths[nid]})
-
-    # The two nested loops below together loop over all edges in the local shortest path graph.
-    # For each edge, we compute the distance to any business site that lies along it.
+    shortestPathLengths = searchFrom(sourceNodeId)
+
+    # The two nested loops below together loop over all edges in the local shortest path graph that
+    # have sites on them. For each edge, we compute the distance to any business site that lies along it.
+    distanceToSite = {}
     for nid0 in shortestPathLengths:
+
+        leaving = sitesLeaving.get(nid0)
+        if leaving is None:
+            continue
+
         distanceToNid0 = shortestPathLengths[nid0]
 
-        for nid1 in gg.edge[nid0]:
+        for (nid1, destIxList) in leaving:
 
             if nid1 not in shortestPathLengths:
                 continue
 
             distanceToNid1 = shortestPathLengths[nid1]
 
-            # At this point, we know that we have found an edge that is part of the local
-            # shortest path graph. Skip it if it has no sites on it.
-            destEdgeId = '%s-%s' % (nid0, nid1)
-            if destEdgeId not in sitesOnEdge:
-                continue
-
-            # OK, so this edge has sites on it. For each one, figure out the total distance to
-            # the source node, accounting for the distance from the respective endpoints.
-            for destSiteId in sitesOnEdge[destEdgeId]:
-                destSite = siteList[destSiteId]
-                dd0 = lengthOfFirstPart + distanceToNid0 + float(destSite['segAlong'])
-                dd1 = lengthOfFirstPart + distanceToNid1 + float(destSite['segLength']) \
-                      - float(destSite['segAlong'])
-                dd = min(dd0, dd1)
-
-                indexTuple = (min(sourceSiteId, destSiteId), max(sourceSiteId, destSiteId))
-                if indexTuple in sitePairDistanceList:
-                    sitePairDistanceList[indexTuple] = min(sitePairDistanceList[indexTuple], dd)
-                else:
-                    sitePairDistanceList[indexTuple] = dd
-
-
-# Loop over all sites.
-k = 0
-for sourceSiteId in siteList:
-
-    k += 1
-    if k % 1000 == 0:
-        print('### Source site %d / %d' % (k, len(siteList)))
-
-    sourceSite = siteList[sourceSiteId]
-    sourceEdgeId = sourceSite['segId']
-    (sourceNodeId0, sourceNodeId1) = sourceEdgeId.split('-')
-    doDistances(sourceNodeId0, sourceSiteId, float(sourceSite['segAlong']))
-    doDistances(sourceNodeId1, sourceSiteId, float(sourceSite['segLength'])
-                - float(sourceSite['segAlong']))
-
-
-# A patch: If two businesses are on the same segment, re-compute their distance.
-for edgeId in sitesOnEdge:
-    siteIdList = sitesOnEdge[edgeId]
-    nn = len(siteIdList)
-    for ii in range(nn):
-        siteId0 = siteIdList[ii]
-
-        for jj in range(ii, nn):
-            siteId1 = siteIdList[jj]
-
-            dd = abs(float(siteList[siteId0]['segAlong']) - float(siteList[siteId1]['segAlong']))
-            indexTuple = (min(siteId0, siteId1), max(siteId0, siteId1))
-            sitePairDistanceList[indexTuple] = dd
+            # OK, so this edge is part of the local shortest path graph and has sites on it. For each one,
+            # figure out the distance to the source node, accounting for the distance from the
+            # respective endpoints.
+            for destIx in destIxList:
+                dd0 = distanceToNid0 + siteSegAlong[destIx]
+                dd1 = distanceToNid1 + siteSegLength[destIx] - siteSegAlong[destIx]
+                distanceToSite[destIx] = min(dd0, dd1)
+
+    # Now the total distance from each source site.
+    for (sourceIx, lengthOfFirstPart) in sourceList:
+        for (destIx, dd) in distanceToSite.items():
+            dd = lengthOfFirstPart + dd
+
+            if sourceIx < destIx:
+                key = sourceIx * siteCount + destIx
+            else:
+                key = destIx * siteCount + sourceIx
+            if key in sitePairDistanceList:
+                sitePairDistanceList[key] = min(sitePairDistanceList[key], dd)
+            else:
+                sitePairDistanceList[key] = dd
+
+
+# Loop over all sites; or, for the 'csgraph' and 'virtual' engines, do all of them together.
+if distance_engine == 'virtual':
+    (index0, index1, distance) = site_vertex_distances(graph, edgeTime, np.array(siteEdge), siteTable['segAlong'],
+                                                       siteTable['segLength'], siteTable['segxx'],
+                                                       siteTable['segyy'], time_cutoff)
+elif distance_engine == 'csgraph':
+    siteV0 = np.array([edgeV0[eix] for eix in siteEdge], dtype=np.int64)
+    siteV1 = np.array([edgeV1[eix] for eix in siteEdge], dtype=np.int64)
+    (index0, index1, distance) = site_pair_distances(graph, edgeTime, siteV0, siteV1, np.array(siteEdge),
+                                                     siteTable['segAlong'], siteTable['segLength'], time_cutoff)
+else:
+    # Each site needs a search from both ends of its edge. Many sites share the same end nodes
+    # (e.g. sites along a busy street, or on the edges meeting at an intersection), so the searches
+    # are grouped by node, and each node is searched from just once. "sourcesAt" gives, for each
+    # node, a list of (site, distance from the site to the node).
+    sourcesAt = {}
+    for ix in range(siteCount):
+        eix = siteEdge[ix]
+        for (nid, lengthOfFirstPart) in [(edgeV0[eix], siteSegAlong[ix]),
+                                         (edgeV1[eix], siteSegLength[ix] - siteSegAlong[ix])]:
+            if nid not in sourcesAt:
+                sourcesAt[nid] = []
+            sourcesAt[nid].append((ix, lengthOfFirstPart))
+
+    for (count, nid) in enumerate(sorted(sourcesAt)):
+
+        if (count + 1) % 1000 == 0:
+            print('### Source node %d / %d' % (count + 1, len(sourcesAt)))
+
+        doDistances(nid, sourcesAt[nid])
+
+    # A patch: If two businesses are on the same segment, re-compute their distance.
+    for eix in sitesOnEdge:
+        ixList = sitesOnEdge[eix]
+        nn = len(ixList)
+        for ii in range(nn):
+            ix0 = ixList[ii]
+
+            for jj in range(ii, nn):
+                ix1 = ixList[jj]
+
+                dd = abs(siteSegAlong[ix0] - siteSegAlong[ix1])
+                sitePairDistanceList[min(ix0, ix1) * siteCount + max(ix0, ix1)] = dd
+
+    pairCount = len(sitePairDistanceList)
+    keys = np.fromiter(sitePairDistanceList.keys(), dtype=np.int64, count=pairCount)
+    index0 = keys // siteCount
+    index1 = keys % siteCount
+    distance = np.fromiter(sitePairDistanceList.values(), dtype=np.float64, count=pairCount)
+
+
+# Create the big output file giving inter-site road distances. This is a binary sparse
+# matrix file (see "e_distance_support"). Distances are kept to the nearest 0.1 meter, as they
+# were when this was a text file.
+out_fname = '%s/site_road_distances.csr' % biz_dir
+print('## Writing file giving inter-site road distances: "%s"' % out_fname)
+metrics.output(out_fname)
+write_pair_distances(out_fname, make_pair_distances(siteCount, index0, index1, round_distances(distance)))
 
 
-# Create the big output file giving inter-site road distances
-out_fname = '%s/site_road_distances.psv' % biz_dir
-print('## Writing file giving inter-site road distances: "%s"' % out_fname)
-with open(out_fname, 'w') as outfile:
-    writer = csv.DictWriter(outfile, delimiter='|', fieldnames=['siteId0', 'siteId1', 'distance'])
-    writer.writeheader()
-    for key in sitePairDistanceList:
-        writer.writerow({'siteId0': key[0], 'siteId1': key[1], 'distance': '%.1f' % sitePairDistanceList[key]})
-
-
-# # Write out the results for a test case, for QA.
-# keySiteId = 'site006185'
-# with open('%s/results_%s.csv' % (biz_dir, keySiteId), 'w') as outfile:
-#     fieldnames = ['siteId', 'dist[f]', 'lon', 'lat']
-#     writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
-#     writer.writeheader()
-#     for key in sitePairDistanceList:
-#         if key[0] == keySiteId:
-#             outSiteId = key[1]
-#         elif key[1] == keySiteId:
-#             outSiteId = key[0]
-#         else:
-#             continue
-#         orec = {'siteId': outSiteId, 'dist[f]': sitePairDistanceList[key],
-#                 'lon': siteList[outSiteId]['lon'], 'lat': siteList[outSiteId]['lat']}
-#         writer.writerow(orec)
+metrics.finish()
 
 
 print
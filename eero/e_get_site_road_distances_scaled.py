@@ -7,9 +7,15 @@
 import csv
 import os
 import numpy as np
+from e_utils import psvarray
+from e_distance_support import read_pair_distances
+from e_distance_support import write_pair_distances
+from e_distance_support import round_distances
+from e_metrics_support import StageMetrics
 
 
 print('# Scaling inter-site road network distances according to local business density')
+metrics = StageMetrics('get_site_road_distances_scaled')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -26,110 +32,65 @@ sigma = 200.0  # kernel density bandwidth parameter
 max_distance = sigma * 3.0
 
 
-# First we just need a lost of site IDs.
+# First we just need a lost of site IDs. The distance files are indexed by row number in
+# this table.
 fname = biz_dir + '/site_list.psv'
 print('## Reading site IDs from "%s"' % fname)
-site_id_list = []
-with open(fname) as infile:
-    reader = csv.reader(infile, delimiter='|')
-    reader.next() # Skip the header.
-    for rec in reader:
-        site_id_list.append(rec[0])
+metrics.input(fname)
+site_table = psvarray(fname)
+site_count = len(site_table)
 
 
-# Initialize the list of density values.
-print('## Initializing density values.')
-density_list = {}
-for site_id in site_id_list:
-    density_list[site_id] = 0.0
-
-
-# Get density values by making a pass through the list of inter-site distances.
-fname = biz_dir + '/site_road_distances.psv'
+# Get density values by making a pass through the list of inter-site distances. Each row of the
+# distance matrix holds all of the distances from one site, including its distance to itself, so
+# the density for a site is just a sum over its row.
+fname = biz_dir + '/site_road_distances.csr'
 print('## Computing density from inter-site distances using "%s"' % fname)
+metrics.input(fname)
+distances = read_pair_distances(fname)
+# The distances were rounded to 0.1 and then stored as float32; rounding them again gets back the
+# values that were written, as they were read from the old text file.
 fff = -1.0 / (2.0 * sigma * sigma)  # Used in kernel density computation below.
-with open(fname) as infile:
-
-    reader = csv.reader(infile, delimiter='|')
-    reader.next() # Skip the header
-    k = 0
-    for rec in reader:
-
-        k += 1
-        if k % 1000000 == 0:
-            print('### Record %d' % k)
-
-        dd = float(rec[2])
-        if dd < max_distance:
-            # Compute the kernel density value.
-            kv = np.exp(dd * dd * fff)
-            sid0 = rec[0]
-            sid1 = rec[1]
-            density_list[sid0] += kv
-            if sid1 != sid0:
-                density_list[sid1] += kv
+dd = np.round(np.asarray(distances.data, dtype=np.float64), 1)
+kv = np.where(dd < max_distance, np.exp(dd * dd * fff), 0.0)
+density = np.bincount(distances.row_index(), weights=kv, minlength=site_count)
 
 
 # Write out the list of site density values.
 fname = biz_dir + '/site_density.psv'
 print('## Writing list of site density values: "%s"' % fname)
+metrics.output(fname)
 with open(fname, 'w') as outfile:
     writer = csv.DictWriter(outfile, delimiter='|', fieldnames=['siteId', 'lon', 'lat', 'density'])
     writer.writeheader()
-
-    with open(biz_dir + '/site_list.psv') as source:
-        reader = csv.DictReader(source, delimiter='|')
-        for rec in reader:
-            writer.writerow({'siteId': rec['siteId'],
-                             'lon': rec['lon'],
-                             'lat': rec['lat'],
-                             'density': '%.1f' % density_list[rec['siteId']]})
+    for ix in range(site_count):
+        writer.writerow({'siteId': site_table['siteId'][ix],
+                         'lon': '%.6f' % site_table['lon'][ix],
+                         'lat': '%.6f' % site_table['lat'][ix],
+                         'density': '%.1f' % density[ix]})
 
 
 # Get local scaling factors for each site.
-d = density_list.values()
-x0 = np.percentile(d, 20.0)
-x1 = np.percentile(d, 80.0)
+x0 = np.percentile(density, 20.0)
+x1 = np.percentile(density, 80.0)
 y0 = 0.2
 y1 = 1.0
-factor_list = {}
-for site_id in density_list:
-    xx = density_list[site_id]
-    yy = y0 + (xx - x0) / (x1 - x0) * (y1 - y0)
-    factor_list[site_id] = np.clip(yy, y0, y1)
+factor = np.clip(y0 + (density - x0) / (x1 - x0) * (y1 - y0), y0, y1)
 
 
 # Now that we have the scaling factors, go back and apply them to the original distance data.
-fname_in = biz_dir + '/site_road_distances.psv'
-fname_out = biz_dir + '/site_road_distances_scaled.psv'
+# The scaled distances have exactly the same site pairs as the original ones.
+fname_out = biz_dir + '/site_road_distances_scaled.csr'
 print('## Writing scaled road distances to "%s"' % fname_out)
-k = 0
-with open(fname_in) as infile:
-    reader = csv.reader(infile, delimiter='|')
+metrics.output(fname_out)
+f = np.maximum(factor[distances.row_index()], factor[distances.indices])
+# Hack: temporarily turning off the scaling.
+# f = 1.0
+scaled = distances.with_data(round_distances(dd * f).astype(np.float32))
+write_pair_distances(fname_out, scaled)
 
-    with open(fname_out, 'w') as outfile:
-        writer = csv.writer(outfile, delimiter='|')
 
-        rec = reader.next()
-        writer.writerow(rec)
-
-        k = 0
-        for rec in reader:
-
-            k += 1
-            if k % 1000000 == 0:
-                print('### Record %d' % k)
-
-            sid0 = rec[0]
-            sid1 = rec[1]
-            dd0 = float(rec[2])
-            f = np.max([factor_list[sid0], factor_list[sid1]])
-            # Hack: temporarily turning off the scaling.
-            # dd1 = '%.1f' % dd0
-            dd1 = '%.1f' % (dd0 * f)
-            writer.writerow((sid0, sid1, dd1))
+metrics.finish()
 
 
 print
-
-
@@ -5,6 +5,8 @@
 
 import shapely.geometry
 import shapely.ops
+import shapely.prepared
+import numpy as np
 from scipy.spatial import Voronoi
 from copy import copy
 
@@ -115,6 +117,74 @@ def ortho_merge(s0, label):
     return ff
 
 
+class ShapeCover(object):
+    """
+    A fast point-in-polygon test for a big, detailed shape (like an MSA boundary) and a lot of points.
+
+    The bounding box of the shape is divided into a grid of cells, and each cell is classified once
+    against a prepared version of the shape: cells that are entirely inside the shape, cells that
+    are entirely outside it, and cells that touch its boundary. A point in an inside or outside cell
+    gets its answer from the cell; only points in boundary cells need the exact test. The answers are
+    the same as "shape.contains(Point(x, y))".
+    """
+
+    def __init__(self, s, grid_size=64):
+        """
+        :param s: A "shape" (in the sense of the "shapely" package)
+        :param grid_size: number of grid cells along each side of the bounding box
+        """
+        self.prepared = shapely.prepared.prep(s)
+        (self.x0, self.y0, self.x1, self.y1) = s.bounds
+        self.grid_size = grid_size
+        self.dx = max((self.x1 - self.x0) / grid_size, 1e-12)
+        self.dy = max((self.y1 - self.y0) / grid_size, 1e-12)
+
+        # Cell status: 1 for inside, 0 for outside, -1 for "needs the exact test". A cell only counts
+        # as inside if it is clear of the boundary, since points on the boundary are not "contained".
+        # The cells are padded a little when classifying them, so that round-off in working out which
+        # cell a point is in can't matter.
+        self.cell_status = np.zeros((grid_size, grid_size), dtype=np.int8)
+        px = 0.01 * self.dx
+        py = 0.01 * self.dy
+        for i in range(grid_size):
+            for j in range(grid_size):
+                cx0 = self.x0 + i * self.dx
+                cy0 = self.y0 + j * self.dy
+                cell = shapely.geometry.box(cx0 - px, cy0 - py, cx0 + self.dx + px, cy0 + self.dy + py)
+                if self.prepared.contains_properly(cell):
+                    self.cell_status[i, j] = 1
+                elif self.prepared.intersects(cell):
+                    self.cell_status[i, j] = -1
+
+    def contains_points(self, xx, yy):
+        """
+        Tests which of a set of points are inside the shape.
+
+        :param xx: array of x coordinates
+        :param yy: array of y coordinates
+        :return: boolean array, True for points inside the shape
+        """
+        xx = np.asarray(xx, dtype=np.float64)
+        yy = np.asarray(yy, dtype=np.float64)
+        inside = np.zeros(len(xx), dtype=bool)
+
+        # Anything outside the bounding box is outside the shape.
+        in_box = (xx >= self.x0) & (xx <= self.x1) & (yy >= self.y0) & (yy <= self.y1)
+        ix = np.nonzero(in_box)[0]
+
+        # Look up the grid cell for the rest. (Points on the far edges of the box go in the last cells.)
+        i = np.minimum(((xx[ix] - self.x0) / self.dx).astype(np.int64), self.grid_size - 1)
+        j = np.minimum(((yy[ix] - self.y0) / self.dy).astype(np.int64), self.grid_size - 1)
+        status = self.cell_status[i, j]
+        inside[ix[status == 1]] = True
+
+        # Do the exact test for points near the boundary.
+        for k in ix[status == -1].tolist():
+            inside[k] = self.prepared.contains(shapely.geometry.Point(xx[k], yy[k]))
+
+        return inside
+
+
 
 
 
@@ -4,16 +4,264 @@
 #
 
 
-import math
+import os
 import json
+import hashlib
+import functools
+import multiprocessing
 import networkx as nx
+import numpy as np
+from e_id_support import first_appearance
+from e_artifact_support import remember
+from e_artifact_support import recall
 
+# "ijson" lets us parse the OSM files incrementally, without holding the whole parsed document in
+# memory; without it we fall back to "json.load".
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
-def graph_from_osm_files(osm_file_name_list, remap):
+
+# These define the types of roads we are interested in.
+good_classes = [ "motorway", "motorway_junction", "motorway_link",
+                 "primary", "primary_link", "residential", "secondary", "secondary_link",
+                 "service", "tertiary", "tertiary_link", "trunk", "trunk_link",
+                 "turning_circle", "unclassified"]
+
+good_class_codes = dict((road_class, code) for (code, road_class) in enumerate(good_classes))
+
+
+def iter_osm_elements(infile):
+    """
+    Yields the elements of an OSM JSON file one at a time, parsing incrementally if we can.
+    """
+    if ijson is None:
+        for e in json.load(infile)['elements']:
+            yield e
+    else:
+        for e in ijson.items(infile, 'elements.item'):
+            yield e
+
+
+def parse_osm_file(osm_file_name):
+    """
+    Parses one OSM JSON file into compact arrays. This is run in worker processes, so it only
+    returns plain arrays. Ways that aren't one of the "good_classes" of road are dropped here.
+
+    :param osm_file_name: name of the file
+    :return: (node_ids, node_lon, node_lat, way_ids, way_class, way_oneway, way_offsets, way_nodes),
+        where the nodes of way i are way_nodes[way_offsets[i]:way_offsets[i+1]] and way_class is an
+        index into "good_classes"; or None if the file can't be parsed.
+    """
+    node_ids = []
+    node_lon = []
+    node_lat = []
+    way_ids = []
+    way_class = []
+    way_oneway = []
+    way_offsets = [0]
+    way_nodes = []
+    try:
+        with open(osm_file_name, 'rb') as infile:
+            for e in iter_osm_elements(infile):
+                if e['type'] == 'node':
+                    node_ids.append(e['id'])
+                    node_lon.append(float(e['lon']))
+                    node_lat.append(float(e['lat']))
+                elif e['type'] == 'way':
+                    tags = e.get('tags', {})
+                    # 'highway' is the (unintuitive) name of the field that says what kind of road this is;
+                    road_class = tags.get('highway')
+                    if road_class in good_class_codes:
+                        way_ids.append(e['id'])
+                        way_class.append(good_class_codes[road_class])
+                        way_oneway.append(tags.get('oneway') == 'yes')
+                        way_nodes.extend(e['nodes'])
+                        way_offsets.append(len(way_nodes))
+    except Exception as exc:
+        # A truncated or garbled download; json and ijson raise different errors for these.
+        if isinstance(exc, (ValueError, KeyError)) or (ijson is not None and isinstance(exc, ijson.JSONError)):
+            return None
+        raise
+
+    return (np.array(node_ids, dtype=np.int64), np.array(node_lon), np.array(node_lat),
+            np.array(way_ids, dtype=np.int64), np.array(way_class, dtype=np.int8), np.array(way_oneway, dtype=bool),
+            np.array(way_offsets, dtype=np.int64), np.array(way_nodes, dtype=np.int64))
+
+
+# Names of the arrays returned by "parse_osm_file", as saved in the tile cache files.
+parsed_array_names = ['node_ids', 'node_lon', 'node_lat', 'way_ids', 'way_class', 'way_oneway', 'way_offsets',
+                      'way_nodes']
+
+
+def osm_cache_key(osm_file_name):
+    """
+    Gets the string that identifies a particular version of an OSM file: a hash of its contents,
+    plus the road classes that parsing keeps. The cache file for a tile is only used if the key
+    stored with it matches this one.
+    """
+    h = hashlib.sha1()
+    with open(osm_file_name, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            h.update(block)
+    return '%s|%r' % (h.hexdigest(), good_classes)
+
+
+def load_osm_file(osm_file_name, cache=True):
+    """
+    Gets the parsed arrays for one OSM JSON file, as from "parse_osm_file".
+
+    The parsed arrays are saved in a ".cache.npz" file next to the tile, along with a key made
+    from the tile's contents. The tiles are re-fetched with every run of the OSM queries, but
+    most of them don't change, so later runs only parse the tiles that are new or different.
+
+    :param osm_file_name: name of the file
+    :param cache: if False, don't read or write the cache files
+    :return: (parsed arrays or None, True if they came from the cache)
+    """
+    if not cache:
+        return (parse_osm_file(osm_file_name), False)
+
+    cache_fname = osm_file_name + '.cache.npz'
+    key = osm_cache_key(osm_file_name)
+
+    # Use the cache file if it is there and is up to date.
+    try:
+        with np.load(cache_fname) as cached:
+            if str(cached['key']) == key:
+                return (tuple(cached[name] for name in parsed_array_names), True)
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    parsed = parse_osm_file(osm_file_name)
+
+    # Tiles that can't be parsed aren't cached, so they are tried again next time. The cache file
+    # is written under a temporary name and then renamed, so it is never seen half-written.
+    if parsed is not None:
+        try:
+            tmp_fname = '%s.%d.tmp.npz' % (cache_fname, os.getpid())
+            np.savez(tmp_fname, key=np.array(key), **dict(zip(parsed_array_names, parsed)))
+            os.rename(tmp_fname, cache_fname)
+        except (IOError, OSError):
+            print('!!! Unable to write tile cache "%s"' % cache_fname)
+    return (parsed, False)
+
+
+def parse_osm_files(osm_file_name_list, processes=None, cache=True):
+    """
+    Parses a set of OSM JSON files in a pool of worker processes, and merges the results. Nodes and
+    ways often appear in more than one file (the files are overlapping tiles); the first copy wins.
+
+    :param osm_file_name_list: names of the files
+    :param processes: number of worker processes (default: one per CPU)
+    :param cache: if False, don't use the parsed-tile cache (see "load_osm_file")
+    :return: merged arrays, as for "parse_osm_file"
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(osm_file_name_list))
+    load = functools.partial(load_osm_file, cache=cache)
+
+    parsed = []
+    cached_count = 0
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.imap(load, osm_file_name_list)
+            for (osm_file_name, (result, was_cached)) in zip(osm_file_name_list, results):
+                print(osm_file_name)
+                if result is not None:
+                    parsed.append(result)
+                    cached_count += was_cached
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for osm_file_name in osm_file_name_list:
+            print(osm_file_name)
+            (result, was_cached) = load(osm_file_name)
+            if result is not None:
+                parsed.append(result)
+                cached_count += was_cached
+    print('## Parsed %d OSM files, %d of them from the cache' % (len(parsed), cached_count))
+
+    if len(parsed) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=bool),
+                np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def first_copies(ids):
+        # Indexes of the first copy of each ID, in order of appearance.
+        (unique_ids, first) = np.unique(ids, return_index=True)
+        return np.sort(first)
+
+    node_ids = np.concatenate([p[0] for p in parsed])
+    keep = first_copies(node_ids)
+    node_ids = node_ids[keep]
+    node_lon = np.concatenate([p[1] for p in parsed])[keep]
+    node_lat = np.concatenate([p[2] for p in parsed])[keep]
+
+    # The way node lists are ragged, so we carry them along as (start, length) pairs into one big
+    # concatenated node array.
+    way_ids = np.concatenate([p[3] for p in parsed])
+    keep = first_copies(way_ids)
+    way_ids = way_ids[keep]
+    way_class = np.concatenate([p[4] for p in parsed])[keep]
+    way_oneway = np.concatenate([p[5] for p in parsed])[keep]
+    base = np.cumsum([0] + [len(p[7]) for p in parsed[:-1]])
+    way_start = np.concatenate([p[6][:-1] + b for (p, b) in zip(parsed, base)])[keep]
+    way_length = np.concatenate([np.diff(p[6]) for p in parsed])[keep]
+    all_way_nodes = np.concatenate([p[7] for p in parsed])
+    way_offsets = np.concatenate([[0], np.cumsum(way_length)]).astype(np.int64)
+    # For each output position, the position it comes from in the concatenated node array.
+    source = np.arange(way_offsets[-1]) - np.repeat(way_offsets[:-1] - way_start, way_length)
+    way_nodes = all_way_nodes[source]
+
+    return (node_ids, node_lon, node_lat, way_ids, way_class, way_oneway, way_offsets, way_nodes)
+
+
+class RoadEdges(object):
+    """
+    The edges found along the OSM ways, in edge index order, along with their geometry. The
+    geometry is kept as flat arrays of the nodes along all the edges; the nodes of edge i, from
+    v0 to v1, are at positions offsets[i]:offsets[i+1].
+    """
+
+    def __init__(self, v0_id, v1_id, way_id, length, road_class, offsets, node_id, lon, lat, x, y):
+        self.v0_id = v0_id
+        self.v1_id = v1_id
+        self.way_id = way_id
+        self.length = length
+        self.road_class = road_class
+        self.offsets = offsets
+        self.node_id = node_id
+        self.lon = lon
+        self.lat = lat
+        self.x = x
+        self.y = y
+
+    def __len__(self):
+        return len(self.length)
+
+    def ids(self):
+        """
+        Gets the external ID ("<v0>-<v1>") of every edge.
+        """
+        return ['%d-%d' % (v0, v1) for (v0, v1) in zip(self.v0_id.tolist(), self.v1_id.tolist())]
+
+    def road_classes(self):
+        """
+        Gets the road class name of every edge.
+        """
+        return [good_classes[c] for c in self.road_class.tolist()]
+
+
+def graph_from_osm_files(osm_file_name_list, remap, processes=None):
     """
     This function assembles road network data structures from a set of OSM JSON files.
     Pass in a list of names of JSON files downloaded from the overpass API, and get back
-    a "networkx" graph structure and some associated data.
+    a road network graph and the geometry of its edges.
 
     The input files should be ones that were retrieved using the following Overpass API syntax:
         [out:json]; ( way(42.6,-71.9,42.7,-71.8) [highway]; node(w); ); out;
@@ -27,128 +275,366 @@ def graph_from_osm_files(osm_file_name_list, remap):
     :param osm_file_name_list:
     :param remap: The name of a function that gives local (x,y) coordinates given (lon,lat).
         That is, (x, y) = remap(lon, lat). This is the style of function returned by "pyproj.Proj()"
-    :return: A networkx-format graph and some other things.
+        or "e_utils.get_projector()"; it is called once, with arrays of coordinates for all the nodes.
+    :param processes: number of processes to use for parsing the files (default: one per CPU).
+    :return: (RoadGraph, RoadEdges). The edges are numbered by a dense edge index; each edge's
+        external ID is "<v0>-<v1>".
     """
 
-    # These define the types of roads we are interested in.
-    good_classes = [ "motorway", "motorway_junction", "motorway_link",
-                     "primary", "primary_link", "residential", "secondary", "secondary_link",
-                     "service", "tertiary", "tertiary_link", "trunk", "trunk_link",
-                     "turning_circle", "unclassified"]
+    # Parse all the input files (in parallel), and get big arrays of all nodes and all ways.
+    return graph_from_osm_arrays(parse_osm_files(osm_file_name_list, processes), remap)
 
-    # In the following loop, we will be building up big lists of all nodes and all edges
-    # from all of the input files; here we initialize them.
-    node_list = {}
-    way_list = {}
 
-    for osm_file_name in osm_file_name_list:
+def graph_from_osm_arrays(parsed, remap):
+    """
+    Assembles road network data structures from parsed OSM nodes and ways.
 
-        # slurp in the input file;
-        print osm_file_name
-        try:
-            with open(osm_file_name) as infile:
-                data = json.load(infile)
+    :param parsed: arrays of nodes and ways, as from "parse_osm_file"
+    :param remap: function that gives local (x,y) coordinates given arrays of (lon,lat), as for
+        "graph_from_osm_files"
+    :return: (RoadGraph, RoadEdges), as for "graph_from_osm_files"
+    """
+    (node_ids, node_lon, node_lat, way_ids, way_class, way_oneway, way_offsets, way_nodes) = parsed
 
-            for e in data['elements']:
+    # Get local coordinates for all the nodes, re-mapping them in one batch.
+    if len(node_ids) > 0:
+        (node_x, node_y) = remap(node_lon, node_lat)
+        node_x = np.asarray(node_x, dtype=np.float64)
+        node_y = np.asarray(node_y, dtype=np.float64)
+    else:
+        node_x = np.zeros(0)
+        node_y = np.zeros(0)
 
-                id = e['id']
+    # Find each way node in the node arrays. Ways that refer to nodes we don't have, or that have
+    # no nodes at all, are dropped.
+    way_lengths = np.diff(way_offsets)
+    way_of = np.repeat(np.arange(len(way_ids)), way_lengths)
+    sorter = np.argsort(node_ids, kind='mergesort')
+    where = np.minimum(np.searchsorted(node_ids, way_nodes, sorter=sorter), max(len(node_ids) - 1, 0))
+    pos = sorter[where] if len(node_ids) > 0 else np.zeros(len(way_nodes), dtype=np.int64)
+    found = node_ids[pos] == way_nodes if len(node_ids) > 0 else np.zeros(len(way_nodes), dtype=bool)
+    bad_way = (np.bincount(way_of[~found], minlength=len(way_ids)) > 0) | (way_lengths == 0)
+    if bad_way.any():
+        print('!!! Dropping %d ways with missing nodes' % bad_way.sum())
+        keep = ~bad_way[way_of]
+        pos = pos[keep]
+        way_of = way_of[keep]
+        way_lengths[bad_way] = 0
+        way_offsets = np.concatenate([[0], np.cumsum(way_lengths)])
+    good_ways = np.flatnonzero(~bad_way)
+    first = way_offsets[good_ways]
+    last = way_offsets[good_ways + 1] - 1
 
-                if e['type'] == 'node':
-                    if id not in node_list:
-                        (x, y) = remap(e['lon'], e['lat'])
-                        node_list[id] = {'x': x, 'y': y, 'lon': e['lon'], 'lat': e['lat'], 'ways': []}
+    # Now for the network vertices: the first and last node of each way, plus any node used by more
+    # than one way (or more than once by the same way).
+    is_vertex = np.bincount(pos, minlength=len(node_ids)) > 1
+    is_vertex[pos[first]] = True
+    is_vertex[pos[last]] = True
 
-                elif e['type'] == 'way':
-                    if id not in way_list:
-                        tags = e['tags']
-                        # 'highway' is the (unintuitive) name of the field that says what kind of road this is;
-                        road_class = tags['highway']
-                        is_one_way = False
-                        if 'oneway' in tags and tags['oneway'] == 'yes':
-                            is_one_way = True
-                        if road_class in good_classes:
-                            way_list[e['id']] = {'nodes': e['nodes'], 'road_class': road_class, 'oneway': is_one_way}
-        except ValueError:
-            continue
-
-    # End of loop over input files.
-
-    # Make each node remember the ways that use it.
-    for w in way_list:
-        for n in way_list[w]['nodes']:
-            node_list[n]['ways'].append(w)
-
-    # This will hold a set of network vertices.
-    vertex_set = set()
-
-    # Go through the list of ways; for each one, add the first and last node to the vertex set.
-    for w in way_list:
-        vertex_set.add(way_list[w]['nodes'][0])
-        vertex_set.add(way_list[w]['nodes'][-1])
-
-    # That doesn't catch all of them -- there may be other graph vertices that are internal to the node set.
-    # Those are precisely the ones that have more than one 'way' associated with them, which is what we
-    # figured out above.
-    for n in node_list:
-        if len(node_list[n]['ways']) > 1:
-            vertex_set.add(n)
-
-    # Now that we have a list of vertices, define the edges of the transportation network graph; we crawl along
-    # each 'way', and every time we encounter a vertex, chop off an edge at that point; note we're also keeping track of
-    # length as we crawl through the list of nodes;
-    edge_list = {}
-    for w in way_list:
-        nodes = way_list[w]['nodes']
-        road_class = way_list[w]['road_class']
-        is_one_way = way_list[w]['oneway']
-        last_vertex = nodes[0]
-        last_x = node_list[nodes[0]]['x']
-        last_y = node_list[nodes[0]]['y']
-        xx = [last_x]
-        yy = [last_y]
-        running_length = 0.0
-        for i in range(1, len(nodes)):
-            this_node = nodes[i]
-            this_x = node_list[this_node]['x']
-            this_y = node_list[this_node]['y']
-            xx.append(this_x)
-            yy.append(this_y)
-            dd = math.sqrt((this_x-last_x)**2 + (this_y-last_y)**2)
-            running_length += dd
-            if i == len(nodes)-1 or this_node in vertex_set:
-                # Found the end of an edge; add it to the list.
-                edge_id = '%d-%d' % (last_vertex, this_node)
-                edge_list[edge_id] = {'wayId': w,
-                                      'v0': last_vertex, 'v1': this_node,
-                                      'length': int(running_length),
-                                      'road_class': road_class,
-                                      'xx': xx, 'yy': yy}
-                # # if this way is *not* a one-way, then we need to add a separate edge going
-                # # 'the other way';
-                # if not is_one_way:
-                #     edge_id = '%d-%d' % (this_node, last_vertex)
-                #     edge_list[edge_id] = {'wayId': w,
-                #                         'v0': this_node, 'v1': last_vertex,
-                #                         'length': int(running_length), 'time': int(running_length / speed),
-                #                         'road_class': road_class,
-                #                         'xx': xx, 'yy': yy}
-                last_vertex = this_node
-                running_length = 0.0
-                xx = [this_x]
-                yy = [this_y]
-            last_x = this_x
-            last_y = this_y
-
-    # Build the transportation network graph.
-    # g = nx.DiGraph()
-    g = nx.Graph()
-    for v in vertex_set:
-        g.add_node(v, lon=node_list[v]['lon'], lat=node_list[v]['lat'])
-
-    for e in edge_list:
-        length = edge_list[e]['length']
-        road_class = edge_list[e]['road_class']
-        g.add_edge(edge_list[e]['v0'], edge_list[e]['v1'], length=length, road_class=road_class, id=e)
+    # Define the edges of the transportation network graph; we crawl along each 'way', and every time
+    # we encounter a vertex, chop off an edge at that point. An edge ends at every way node that is a
+    # vertex, except the first node of the way; it starts at the previous such point, or at the start
+    # of the way.
+    is_first = np.zeros(len(pos), dtype=bool)
+    is_first[first] = True
+    is_end = is_vertex[pos]
+    is_end[last] = True
+    is_end[first] = False
+    ends = np.flatnonzero(is_end)
+    breaks = np.flatnonzero(is_end | is_first)
+    starts = breaks[np.searchsorted(breaks, ends) - 1]
+
+    # The length of an edge is the sum of the lengths of the steps along it. Every position between
+    # one edge and the next is the first node of a way, which has a step length of zero, so the
+    # sums can be done in one go.
+    px = node_x[pos]
+    py = node_y[pos]
+    step = np.zeros(len(pos))
+    step[1:] = np.hypot(np.diff(px), np.diff(py))
+    step[first] = 0.0
+    if len(ends) > 0:
+        length = np.floor(np.add.reduceat(step, starts + 1)).astype(np.int64)
+    else:
+        length = np.zeros(0, dtype=np.int64)
+
+    # Edges are numbered densely in the order they are found; that number is what the later stages use to
+    # refer to an edge. The "<v0>-<v1>" ID is only for output. (If the same ID turns up twice, the later
+    # edge replaces the earlier one but keeps its number.)
+    v0_id = node_ids[pos[starts]]
+    v1_id = node_ids[pos[ends]]
+    (rank, first_row) = first_appearance(np.column_stack((v0_id, v1_id)))
+    latest = np.zeros(len(first_row), dtype=np.int64)
+    np.maximum.at(latest, rank, np.arange(len(rank)))
+    starts = starts[latest]
+    ends = ends[latest]
+    length = length[latest]
+    edge_way = way_of[ends]
+
+    # The geometry of each edge is the run of way nodes from its start to its end.
+    counts = ends - starts + 1
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    source = pos[np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts, counts)]
+    edges = RoadEdges(node_ids[pos[starts]], node_ids[pos[ends]], way_ids[edge_way], length, way_class[edge_way],
+                      offsets, node_ids[source], node_lon[source], node_lat[source], node_x[source], node_y[source])
+
+    # Build the transportation network graph. Vertices are numbered in order of OSM node ID. There is
+    # one graph edge per pair of vertices; where several edges join the same two vertices, the one
+    # with the highest edge index is used.
+    vertex_pos = np.flatnonzero(is_vertex)
+    vertex_pos = vertex_pos[np.argsort(node_ids[vertex_pos], kind='mergesort')]
+    vertex_number = np.zeros(len(node_ids), dtype=np.int32)
+    vertex_number[vertex_pos] = np.arange(len(vertex_pos), dtype=np.int32)
+    v0 = vertex_number[pos[starts]]
+    v1 = vertex_number[pos[ends]]
+    (rank, first_row) = first_appearance(np.column_stack((np.minimum(v0, v1), np.maximum(v0, v1))))
+    latest = np.zeros(len(first_row), dtype=np.int64)
+    np.maximum.at(latest, rank, np.arange(len(rank)))
+    latest = np.sort(latest)
+    graph = make_road_graph(node_ids[vertex_pos], node_lon[vertex_pos], node_lat[vertex_pos], node_x[vertex_pos],
+                            node_y[vertex_pos], v0[latest], v1[latest], length[latest], way_class[edge_way][latest],
+                            latest)
 
     # All done.
-    return g, node_list, way_list, edge_list
+    return graph, edges
+
+
+#
+# Road network graphs are stored in a compact binary file (".graph") rather than as GraphML, which
+# is slow to parse and gives vertex IDs back as strings. The layout follows the CSR distance files
+# (see "e_distance_support"):
+#
+#   header      8-byte magic string, then the vertex, edge and adjacency entry counts (int64)
+#   vertices    OSM node ID (int64), lon, lat, x, y (float64), each [vertex_count]
+#   indptr      int64[vertex_count + 1]; the adjacency entries of vertex i are at indptr[i]:indptr[i+1]
+#   edges       length (float64), v0, v1, edge index (int32), each [edge_count]
+#   adjacency   neighbouring vertex and edge number (int32), each [entry_count]
+#   road class  int8[edge_count]; an index into "good_classes"
+#
+# Vertices are numbered in order of OSM node ID. Every edge appears in the adjacency lists of both
+# of its ends (once, for a loop). The edge index is the edge's row in "road_edges.psv", and its
+# external ID is "<OSM ID of v0>-<OSM ID of v1>".
+#
+
+road_graph_magic = b'EERORGR1'
+road_graph_header_size = 32
+
+# (name, type, count) for each section of the file, in order; the counts are 'V' (vertices),
+# 'E' (edges) and 'N' (adjacency entries).
+road_graph_sections = [('vertex_id', np.int64, 'V'),
+                       ('lon', np.float64, 'V'),
+                       ('lat', np.float64, 'V'),
+                       ('x', np.float64, 'V'),
+                       ('y', np.float64, 'V'),
+                       ('indptr', np.int64, 'V+1'),
+                       ('edge_length', np.float64, 'E'),
+                       ('edge_v0', np.int32, 'E'),
+                       ('edge_v1', np.int32, 'E'),
+                       ('edge_index', np.int32, 'E'),
+                       ('indices', np.int32, 'N'),
+                       ('entry_edge', np.int32, 'N'),
+                       ('edge_class', np.int8, 'E')]
+
+
+class RoadGraph(object):
+    """
+    A road network graph, as read from (or about to be written to) a binary road graph file.
+    Vertices and edges are referred to by their positions in the arrays.
+    """
+
+    def __init__(self, vertex_id, lon, lat, x, y, indptr, edge_length, edge_v0, edge_v1, edge_index,
+                 indices, entry_edge, edge_class):
+        self.vertex_id = vertex_id
+        self.lon = lon
+        self.lat = lat
+        self.x = x
+        self.y = y
+        self.indptr = indptr
+        self.edge_length = edge_length
+        self.edge_v0 = edge_v0
+        self.edge_v1 = edge_v1
+        self.edge_index = edge_index
+        self.indices = indices
+        self.entry_edge = entry_edge
+        self.edge_class = edge_class
+        self.vertex_count = len(vertex_id)
+        self.edge_count = len(edge_length)
+
+    def arrays(self):
+        """
+        Gets the arrays making up the graph, as a dictionary keyed by section name.
+        """
+        return dict((name, getattr(self, name)) for (name, dtype, count) in road_graph_sections)
+
+    def edge_ids(self):
+        """
+        Gets the external ID ("<v0>-<v1>") of every edge.
+        """
+        ids = self.vertex_id.tolist()
+        return ['%d-%d' % (ids[v0], ids[v1]) for (v0, v1) in zip(self.edge_v0.tolist(), self.edge_v1.tolist())]
+
+    def edge_road_classes(self):
+        """
+        Gets the road class name of every edge.
+        """
+        return [good_classes[c] for c in self.edge_class.tolist()]
+
+    def neighbors(self, i):
+        """
+        Gets the vertices next to vertex i, and the edges that lead to them.
+
+        :param i: vertex number
+        :return: (array of vertex numbers, array of edge numbers)
+        """
+        a = self.indptr[i]
+        b = self.indptr[i + 1]
+        return self.indices[a:b], self.entry_edge[a:b]
+
+    def csgraph(self, weight=None):
+        """
+        Gets the graph as a "scipy.sparse" CSR matrix, for use with "scipy.sparse.csgraph". The
+        matrix is symmetric, with rows and columns indexed by vertex number.
+
+        :param weight: array giving the weight of each edge; the default is the edge length
+        :return: csr_matrix of shape (vertex_count, vertex_count)
+        """
+        from scipy.sparse import csr_matrix
+        if weight is None:
+            weight = self.edge_length
+        data = np.asarray(weight, dtype=np.float64)[self.entry_edge]
+        return csr_matrix((data, self.indices, self.indptr), shape=(self.vertex_count, self.vertex_count))
+
+    def networkx(self, labels='id'):
+        """
+        Gets the graph as a networkx graph. Vertices have 'lon', 'lat', 'x' and 'y' attributes;
+        edges have 'id', 'index', 'length' and 'road_class'.
+
+        :param labels: 'id' to label vertices with their OSM node IDs, 'index' to use vertex numbers
+        :return: networkx graph
+        """
+        if labels == 'id':
+            names = self.vertex_id.tolist()
+        else:
+            names = list(range(self.vertex_count))
+        g = nx.Graph()
+        for (v, lon, lat, x, y) in zip(names, self.lon.tolist(), self.lat.tolist(), self.x.tolist(),
+                                       self.y.tolist()):
+            g.add_node(v, lon=lon, lat=lat, x=x, y=y)
+        for (v0, v1, edge_id, eix, length, road_class) in zip(self.edge_v0.tolist(), self.edge_v1.tolist(),
+                                                               self.edge_ids(), self.edge_index.tolist(),
+                                                               self.edge_length.tolist(), self.edge_road_classes()):
+            g.add_edge(names[v0], names[v1], id=edge_id, index=eix, length=length, road_class=road_class)
+        return g
+
+
+def make_road_graph(vertex_id, lon, lat, x, y, edge_v0, edge_v1, edge_length, edge_class, edge_index):
+    """
+    Builds a road graph from vertex and edge arrays, working out the adjacency lists.
+
+    :param vertex_id: OSM node IDs of the vertices
+    :param lon: vertex longitudes
+    :param lat: vertex latitudes
+    :param x: vertex local x coordinates
+    :param y: vertex local y coordinates
+    :param edge_v0: vertex number at the start of each edge
+    :param edge_v1: vertex number at the end of each edge
+    :param edge_length: length of each edge
+    :param edge_class: road class code of each edge (an index into "good_classes")
+    :param edge_index: edge index of each edge (i.e. its row in "road_edges.psv")
+    :return: RoadGraph
+    """
+    edge_v0 = np.asarray(edge_v0, dtype=np.int32)
+    edge_v1 = np.asarray(edge_v1, dtype=np.int32)
+    vertex_count = len(vertex_id)
+    edge_count = len(edge_v0)
+
+    # Each edge is listed under both of its ends, except that a loop is only listed once.
+    edge_number = np.arange(edge_count, dtype=np.int32)
+    off = edge_v0 != edge_v1
+    rows = np.concatenate((edge_v0, edge_v1[off]))
+    cols = np.concatenate((edge_v1, edge_v0[off]))
+    entry_edge = np.concatenate((edge_number, edge_number[off]))
+    order = np.lexsort((cols, rows))
+
+    indptr = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=vertex_count), out=indptr[1:])
+    return RoadGraph(np.asarray(vertex_id, dtype=np.int64), np.asarray(lon, dtype=np.float64),
+                     np.asarray(lat, dtype=np.float64), np.asarray(x, dtype=np.float64),
+                     np.asarray(y, dtype=np.float64), indptr, np.asarray(edge_length, dtype=np.float64),
+                     edge_v0, edge_v1, np.asarray(edge_index, dtype=np.int32), cols[order], entry_edge[order],
+                     np.asarray(edge_class, dtype=np.int8))
+
+
+def write_road_graph(fname, graph):
+    """
+    Writes a binary road graph file.
+
+    :param fname: name of the output file
+    :param graph: RoadGraph
+    """
+    arrays = graph.arrays()
+    header = np.zeros(3, dtype=np.int64)
+    header[0] = graph.vertex_count
+    header[1] = graph.edge_count
+    header[2] = len(graph.indices)
+    with open(fname, 'wb') as outfile:
+        outfile.write(road_graph_magic)
+        outfile.write(header.tobytes())
+        for (name, dtype, count) in road_graph_sections:
+            outfile.write(np.asarray(arrays[name], dtype=dtype).tobytes())
+
+    # Later stages in the same process can use the graph as it is (see "e_artifact_support").
+    # Like a memory-mapped graph, it is read-only from here on.
+    for (name, dtype, count) in road_graph_sections:
+        arrays[name] = np.asarray(arrays[name], dtype=dtype)
+        arrays[name].flags.writeable = False
+    remember(fname, RoadGraph(**arrays))
+
+
+def read_road_graph(fname, mmap=True):
+    """
+    Reads a binary road graph file. The graph may be shared with other stages, so don't modify
+    its arrays.
+
+    :param fname: name of the input file
+    :param mmap: if True, memory-map the arrays rather than reading them into memory
+    :return: RoadGraph
+    """
+    graph = recall(fname)
+    if graph is not None:
+        return graph
+
+    with open(fname, 'rb') as infile:
+        magic = infile.read(len(road_graph_magic))
+        if magic != road_graph_magic:
+            raise ValueError('"%s" is not a road graph file' % fname)
+        header = np.frombuffer(infile.read(road_graph_header_size - len(road_graph_magic)), dtype=np.int64)
+    counts = {'V': int(header[0]), 'V+1': int(header[0]) + 1, 'E': int(header[1]), 'N': int(header[2])}
+
+    offset = road_graph_header_size
+    arrays = {}
+    for (name, dtype, count) in road_graph_sections:
+        count = counts[count]
+        if count == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            with open(fname, 'rb') as infile:
+                infile.seek(offset)
+                arrays[name] = np.fromfile(infile, dtype=dtype, count=count)
+        offset += count * np.dtype(dtype).itemsize
+
+    graph = RoadGraph(**arrays)
+    remember(fname, graph)
+    return graph
+
+
+def write_road_graph_graphml(fname, graph):
+    """
+    Writes a road graph as a GraphML file, for looking at in other tools. None of the eero
+    stages read this file.
+
+    :param fname: name of the output file
+    :param graph: RoadGraph
+    """
+    nx.write_graphml(graph.networkx(), fname)
@@ -0,0 +1,95 @@
+#
+# This file has support for "interning" identifiers -- i.e. assigning a dense integer index
+# (0, 1, 2, ...) to each distinct external identifier, such as a site ID, an OSM node ID or
+# a road edge ID.
+#
+# External IDs are strings like "1234" or "53212345-53212399", or big OSM integers. Using them
+# as dictionary keys in inner loops means hashing, string formatting and tuple building on
+# every step. Instead, the stages intern their IDs once, work with numpy arrays and lists
+# indexed by the dense integers, and translate back to external IDs only when writing output.
+#
+
+
+import numpy as np
+
+
+class IdIndex(object):
+    """
+    Assigns dense int32 indices to external IDs, in order of first appearance.
+    """
+
+    def __init__(self, ids=None):
+        self.lookup = {}
+        self.ids = []
+        if ids is not None:
+            for x in ids:
+                self.add(x)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, x):
+        return x in self.lookup
+
+    def add(self, x):
+        """
+        Gets the index for an external ID, assigning the next free index if the ID is new.
+
+        :param x: external ID
+        :return: integer index
+        """
+        ix = self.lookup.get(x)
+        if ix is None:
+            ix = len(self.ids)
+            self.lookup[x] = ix
+            self.ids.append(x)
+        return ix
+
+    def index(self, x):
+        """
+        Gets the index for an external ID that is already known.
+
+        :param x: external ID
+        :return: integer index
+        """
+        return self.lookup[x]
+
+    def indices(self, xs, missing=None):
+        """
+        Gets indices for a sequence of external IDs.
+
+        :param xs: sequence of external IDs
+        :param missing: index to use for unknown IDs; if None, unknown IDs raise a KeyError
+        :return: int32 array of indices
+        """
+        if missing is None:
+            return np.array([self.lookup[x] for x in xs], dtype=np.int32)
+        return np.array([self.lookup.get(x, missing) for x in xs], dtype=np.int32)
+
+    def id(self, ix):
+        """
+        Gets the external ID for an index.
+        """
+        return self.ids[ix]
+
+
+def first_appearance(keys):
+    """
+    Assigns dense indices to the distinct rows of an integer array, in order of first appearance.
+    This is the vectorized counterpart of feeding the rows one at a time to "IdIndex.add".
+
+    :param keys: integer array, one row per item; e.g. rounded (x, y) coordinates
+    :return: (int32 array giving the index for each row, array giving the first row for each index)
+    """
+    keys = np.ascontiguousarray(keys)
+    if keys.ndim == 1:
+        keys = keys.reshape(-1, 1)
+    row_view = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    (unique_rows, first, inverse) = np.unique(row_view, return_index=True, return_inverse=True)
+
+    # "np.unique" numbers the distinct rows in sorted order; renumber them in order of first
+    # appearance.
+    order = np.argsort(first, kind='mergesort')
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return rank[inverse], first[order]
@@ -9,9 +9,11 @@ import csv
 import shapely.geometry
 import numpy
 from e_utils import get_msa_shape
+from e_metrics_support import StageMetrics
 
 
 print('# Generating queries that get OSM road network data using the Overpass API')
+metrics = StageMetrics('make_osm_road_queries')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -33,6 +35,7 @@ lonMax = numpy.ceil(bounds[2] * 10.0) / 10.0
 latMax = numpy.ceil(bounds[3] * 10.0) / 10.0
 
 print('## Writing the query script')
+metrics.output(road_dir + '/z_run_osm_queries.sh')
 increment = 0.1
 
 # This block creates a shell script that gets the OSM road network data. It does not
@@ -65,10 +68,8 @@ with open(road_dir + '/z_run_osm_queries.sh', 'w') as outfile:
 
         lon += increment
 
-print
-
-
-
 
+metrics.finish()
 
 
+print
@@ -2,17 +2,24 @@
 # This script assembles a big road network graph from the chunks in a bunch of OSM JSON files.
 #
 
-import shapely.geometry
 import os
 import glob
-import networkx as nx
+import numpy as np
 from e_graph_support import graph_from_osm_files
-from rtree import index
-from e_utils import get_remap_function
+from e_graph_support import graph_from_osm_arrays
+from e_osm_extract_support import parse_osm_extract
+from e_graph_support import write_road_graph
+from e_graph_support import write_road_graph_graphml
+from e_spatial_index_support import build_index
+from e_snap_support import chunk_boxes
+from e_utils import get_projector
+from e_utils import get_msa_shape
+from e_metrics_support import StageMetrics
 import csv
 
 
 print('# Building road network graph structure')
+metrics = StageMetrics('make_road_network')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -24,96 +31,78 @@ biz_dir = '%s/biz' % msa_dir
 road_dir = '%s/roads' % msa_dir
 
 
-remap = get_remap_function()
-
-
-# Get the road network graph, and some associated information that we will use below.
-fnameList = glob.glob('%s/osm/roads*.json' % road_dir)
-gg, nodeList, wayList, edgeList = graph_from_osm_files(fnameList, remap)
-nx.write_graphml(gg, '%s/road_network.xml' % road_dir)
-
-
-# For every edge, find its nodes by referring back to the original way and node list.
-print('## Getting nodes for each road segment')
-internalNodeList = []
-edgeBoxList = {}
-k = 0
-for edge_id in edgeList:
-
-    # k += 1
-    # if k > 1000:
-    #     break
-
-    edge = edgeList[edge_id]
-    wid = edge['wayId']
-    nid0 = edge['v0']
-    nid1 = edge['v1']
-    way = wayList[wid]
-    node_id_list = way['nodes']
-    index0 = node_id_list.index(nid0)
-    index1 = node_id_list.index(nid1)
-    xxMin = None
-    xxMax = None
-    yyMin = None
-    yyMax = None
-
-    if index0 < index1:
-        indexList = range(index0, index1 + 1)
-    else:
-        indexList = range(index0, index1 - 1, -1)
-    for ii in indexList:
-        node_id = node_id_list[ii]
-        lon = float(nodeList[node_id]['lon'])
-        lat = float(nodeList[node_id]['lat'])
-        (xx, yy) = remap(lon, lat)
-        internalNodeList.append({'edge_id': edge_id, 'node_id': node_id, 'lon': lon, 'lat': lat,
-                                 'xx': '%.0f' % xx, 'yy': '%.0f' % yy})
-        if xxMin is None or xx < xxMin:
-            xxMin = xx
-        if xxMax is None or xx > xxMax:
-            xxMax = xx
-        if yyMin is None or yy < yyMin:
-            yyMin = yy
-        if yyMax is None or yy > yyMax:
-            yyMax = yy
-
-    edgeBoxList[edge_id] = (xxMin, yyMin, xxMax, yyMax)
-
-
+# Set this to True to also write the graph as GraphML ("road_network.xml"), for looking at in other
+# tools. The eero stages only use the binary graph file.
+write_graphml = False
+
+
+projector = get_projector()
+
+
+# Get the road network graph, and some associated information that we will use below. If a local
+# OSM extract (".osm" or ".osm.pbf") is given, the roads come from that, clipped to the MSA bounds
+# rounded out to 0.1 degree (i.e. the area covered by the Overpass tiles); otherwise they come from
+# the Overpass tiles fetched into the "osm" directory.
+osm_extract = os.environ.get('EERO_OSM_EXTRACT')
+if osm_extract:
+    print('## Reading roads from OSM extract "%s"' % osm_extract)
+    metrics.input(osm_extract)
+    bounds = get_msa_shape().bounds
+    bounds = (np.floor(bounds[0] * 10.0) / 10.0, np.floor(bounds[1] * 10.0) / 10.0,
+              np.ceil(bounds[2] * 10.0) / 10.0, np.ceil(bounds[3] * 10.0) / 10.0)
+    graph, edges = graph_from_osm_arrays(parse_osm_extract(osm_extract, bounds), projector)
+else:
+    fnameList = glob.glob('%s/osm/roads*.json' % road_dir)
+    for fname in fnameList:
+        metrics.input(fname)
+    graph, edges = graph_from_osm_files(fnameList, projector)
+write_road_graph('%s/road_network.graph' % road_dir, graph)
+metrics.output('%s/road_network.graph' % road_dir)
+if write_graphml:
+    write_road_graph_graphml('%s/road_network.xml' % road_dir, graph)
+    metrics.output('%s/road_network.xml' % road_dir)
+
+
+# Write out the nodes along every edge. The node range of each edge was recorded when the edge was
+# made, and the nodes' local coordinates were worked out when the graph was built, so this is a
+# single pass over the edge geometry arrays.
 out_fname = '%s/road_segments.psv' % road_dir
 print('## Writing road segment CSV file: "%s"' % out_fname)
+metrics.output(out_fname)
+edgeIdList = edges.ids()
+edgeOfNode = np.repeat(np.arange(len(edges)), np.diff(edges.offsets)).tolist()
 with open(out_fname, 'w') as outfile:
-    fieldnames = ['edge_id', 'node_id', 'lon', 'lat', 'xx', 'yy']
-    writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
-    writer.writeheader()
-    for rec in internalNodeList:
-        writer.writerow(rec)
+    outfile.write('edge_id|node_id|lon|lat|xx|yy\n')
+    for (eix, node_id, lon, lat, xx, yy) in zip(edgeOfNode, edges.node_id.tolist(), edges.lon.tolist(),
+                                                edges.lat.tolist(), edges.x.tolist(), edges.y.tolist()):
+        outfile.write('%s|%d|%r|%r|%.0f|%.0f\n' % (edgeIdList[eix], node_id, lon, lat, xx, yy))
 
 
 # Make a file that contains some extra info about road edges, i.e. their typical speeds and
-# road class.
+# road class. The rows are in edge index order, so the row number of an edge in this file is
+# its edge index.
 out_fname = '%s/road_edges.psv' % road_dir
 print('## Writing file with information about road network edges: "%s"' % out_fname)
+metrics.output(out_fname)
 with open(out_fname, 'w') as outfile:
     writer = csv.DictWriter(outfile, delimiter='|', fieldnames=['edge_id', 'road_class', 'length'])
     writer.writeheader()
-    for edge_id in edgeList:
-        writer.writerow({'edge_id': edge_id, 'road_class': edgeList[edge_id]['road_class'],
-                         'length': edgeList[edge_id]['length']})
+    for (edge_id, road_class, length) in zip(edgeIdList, edges.road_classes(), edges.length.tolist()):
+        writer.writerow({'edge_id': edge_id, 'road_class': road_class, 'length': length})
 
 
-# Create an index for the road segments.
-out_fname = '%s/road_segments' % road_dir
+# Create an index for the road segments. Rather than one box for each segment, which for a long,
+# curvy road covers a lot of ground that the road doesn't, it has a box for each "chunk" of a few
+# consecutive pieces of a segment (see "e_snap_support.road_chunks"). The index entries are chunk
+# numbers; "road_chunks" maps them back to edge indices.
+out_fname = '%s/road_segment_chunks' % road_dir
 print('## Building spatial index for road segments: "%s"' % out_fname)
-try:
-    os.remove('%s/road_segments.dat' % road_dir)
-    os.remove('%s/road_segments.idx' % road_dir)
-except OSError:
-    pass
-idx = index.Rtree(out_fname)
-for edge_id in edgeBoxList:
-    idx.insert(0, edgeBoxList[edge_id], obj=edge_id)
+idx = build_index(chunk_boxes(edges.x, edges.y, edges.offsets), out_fname,
+                  source_fname='%s/road_segments.psv' % road_dir)
 idx.close()
 
 
+metrics.finish()
+
+
 print
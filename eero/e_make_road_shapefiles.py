@@ -3,17 +3,19 @@
 #
 
 
-import shapely.geometry
-import networkx as nx
-import fiona
-import pyproj
-import shapely
-import csv
 import os
-from e_utils import get_remap_function
+import numpy as np
+from e_graph_support import read_road_graph
+from e_table_support import load_table
+from e_export_support import PointArray
+from e_export_support import LineArray
+from e_export_support import layer_name
+from e_export_support import write_layer
+from e_metrics_support import StageMetrics
 
 
 print('# Making shapefiles describing the road network')
+metrics = StageMetrics('make_road_shapefiles')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -25,81 +27,58 @@ biz_dir = '%s/biz' % msa_dir
 road_dir = '%s/roads' % msa_dir
 
 
-remap = get_remap_function()
-
-
-gg = nx.read_graphml('%s/road_network.xml' % road_dir)
-
-
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
+graph = read_road_graph('%s/road_network.graph' % road_dir)
+metrics.input('%s/road_network.graph' % road_dir)
 
 
 #
 # write a file containing road network vertices;
 #
-oname = '%s/road_network_vertices.shp' % road_dir
+oname = layer_name('%s/road_network_vertices' % road_dir)
 print('## Making shapefile with road network vertices: "%s"' % oname)
+metrics.output(oname)
 schema = {'geometry': 'Point',
           'properties': {'id':'str'}}
-
-with fiona.open(oname, 'w', crs=crs, driver=driver, schema=schema) as dest:
-    for v in gg.nodes():
-        feature = {'type': 'Feature',
-                   'id': v,
-                   'geometry': {'coordinates': (gg.node[v]['lon'], gg.node[v]['lat']), 'type': 'Point'},
-                   'properties': {'id': v}}
-        dest.write(feature)
+vertexIdList = [str(vid) for vid in graph.vertex_id.tolist()]
+write_layer(oname, PointArray(graph.lon, graph.lat), {'id': vertexIdList}, schema)
 
 
 #
 # write a file containing road network edges;
 #
-oname = '%s/road_network_edges.shp' % road_dir
+oname = layer_name('%s/road_network_edges' % road_dir)
 print('## Making shapefile with road network edges: "%s"' % oname)
+metrics.output(oname)
 schema = {'geometry': 'LineString',
           'properties': {'id': 'str', 'length': 'float', 'road_class': 'str'}}
+ends = np.column_stack((graph.edge_v0, graph.edge_v1)).ravel()
+edges = LineArray(graph.lon[ends], graph.lat[ends], np.arange(0, len(ends) + 1, 2))
+write_layer(oname, edges, {'id': graph.edge_ids(), 'length': graph.edge_length,
+                           'road_class': graph.edge_road_classes()}, schema)
 
-with fiona.open(oname, 'w', crs=crs, driver=driver, schema=schema) as dest:
-    for e in gg.edges():
-        n0 = e[0]
-        n1 = e[1]
-        id = gg.edge[e[0]][e[1]]['id']
-        length = gg.edge[e[0]][e[1]]['length']
-        road_class = gg.edge[e[0]][e[1]]['road_class']
-        coords = [(gg.node[n0]['lon'], gg.node[n0]['lat']), (gg.node[n1]['lon'], gg.node[n1]['lat'])]
-        feature = {'type': 'Feature',
-                   'id': id,
-                   'geometry': {'coordinates': coords, 'type': 'LineString'},
-                   'properties': {'id': id, 'length': length, 'road_class': road_class}}
-        dest.write(feature)
 
-
-
-oname = '%s/road_segments.psv' % road_dir
+#
+# write a file containing the road segments, i.e. the full geometry of each edge;
+#
+fname = '%s/road_segments.psv' % road_dir
+oname = layer_name('%s/road_segments' % road_dir)
 print('## Making shapefile with road segments: "%s"' % oname)
-segmentList = {}
-with open(oname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        eid = rec['edge_id']
-        if eid not in segmentList:
-            segmentList[eid] = []
-        segmentList[eid].append((float(rec['lon']), float(rec['lat'])))
-
-
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
+metrics.input(fname)
+metrics.output(oname)
+segments = load_table(fname)
+
+# The points for each edge are on consecutive rows.
+eid = segments['edge_id']
+new_edge = np.ones(len(eid), dtype=bool)
+new_edge[1:] = eid[1:] != eid[:-1]
+starts = np.flatnonzero(new_edge)
 schema = {'geometry': 'LineString',
           'properties': {'eid': 'str'}}
+lines = LineArray(segments['lon'], segments['lat'], np.append(starts, len(eid)))
+write_layer(oname, lines, {'eid': eid[starts]}, schema)
+
 
-with fiona.open('%s/road_segments.shp' % road_dir, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for eid in segmentList:
-        feature = {'type': 'Feature',
-                   'id': eid,
-                   'geometry': {'coordinates': segmentList[eid], 'type': 'LineString'},
-                   'properties': {'eid': eid}}
-        dest.write(feature)
+metrics.finish()
 
 
-print
\ No newline at end of file
+print
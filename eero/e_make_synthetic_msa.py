@@ -0,0 +1,449 @@
+#
+# This script builds a synthetic, fully staged MSA directory, for benchmarking the pipeline offline
+# at whatever scale we like. Usage:
+#
+#   eero make_synthetic_msa --businesses 100000 [--name synth_100k] [--seed 1]
+#
+# The MSA is made in "$MSA_BASE/<name>", and has everything that the "proto" directory has, plus
+# the things that a real MSA directory would have staged:
+#
+#   meta/bounds.shp, meta/meta.psv      a detailed, wiggly boundary and a local projection
+#   roads/osm/roads_*.json              street grid tiles in the Overpass API JSON format
+#   roads/osm_check                     so that "make" doesn't try to fetch the tiles
+#   biz/biz_list_0.psv                  businesses, clustered around a few downtowns
+#   parcels/parcels.shp                 one parcel per lot, four lots per block
+#   parcels/site_parcel_lookup.psv      the parcel for each site that "get_site_list" will find
+#   areas/ba_parameters.psv, Makefile   as in "proto"
+#
+# plus the "ref/sbc" lookup tables in "$MSA_BASE/ref", if they aren't there already. The size of
+# the MSA grows with the number of businesses (about 8 businesses per 100 m city block), so
+# anything from 10k to a few million businesses gives a realistic density.
+#
+
+
+import os
+import sys
+import csv
+import json
+import argparse
+import fiona
+import numpy as np
+from e_utils import Projector
+from e_id_support import first_appearance
+
+
+msa_base = os.environ.get('MSA_BASE')
+eero_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# Street grid layout. Blocks are square; every 8th street is an arterial, and ways are broken
+# every 8 blocks, as they tend to be in OSM.
+block_size = 100.0
+arterial_spacing = 8
+way_blocks = 8
+node_spacing = 25.0  # distance between shape nodes along a street
+lot_inset = 8.0  # distance from a street's center line to the edge of a lot
+
+# Tiles are 0.1 degrees on a side, as in "e_make_osm_road_queries".
+tile_size = 0.1
+
+# Business categories: (SIC, NAICS 2017, SBC ID, bc1, bc2, bc3, relative frequency, semantics).
+# The semantics are the attribute flags in "sbc_semantics.psv" that are set for the category.
+attr_names = ['adef', 'blucol', 'whtcol', 'conv', 'dest', 'fsr', 'lsr', 'bar', 'hotel', 'artsy', 'eds', 'meds', 'gov']
+categories = [
+    ('58120000', '722511', '10-110-111', 'Food', 'Restaurant', 'Full service', 8, ['adef', 'fsr', 'dest']),
+    ('58120100', '722513', '10-110-112', 'Food', 'Restaurant', 'Limited service', 6, ['adef', 'lsr', 'conv']),
+    ('58120200', '722515', '10-110-113', 'Food', 'Restaurant', 'Coffee', 3, ['adef', 'lsr', 'conv']),
+    ('58130000', '722410', '10-120-121', 'Food', 'Bar', 'Bar', 3, ['adef', 'bar', 'dest']),
+    ('54110000', '445110', '20-210-211', 'Retail', 'Grocery', 'Grocery', 4, ['adef', 'conv']),
+    ('56510000', '448140', '20-220-221', 'Retail', 'Clothing', 'Clothing', 6, ['adef', 'dest']),
+    ('59120000', '446110', '20-230-231', 'Retail', 'Pharmacy', 'Pharmacy', 2, ['adef', 'conv', 'meds']),
+    ('72310000', '812112', '30-310-311', 'Service', 'Personal', 'Salon', 6, ['adef', 'conv']),
+    ('75380000', '811111', '30-320-321', 'Service', 'Auto', 'Repair', 4, ['adef', 'blucol']),
+    ('70110000', '721110', '40-410-411', 'Lodging', 'Hotel', 'Hotel', 1, ['adef', 'hotel', 'dest']),
+    ('84120000', '712110', '50-510-511', 'Culture', 'Museum', 'Museum', 1, ['adef', 'artsy', 'dest']),
+    ('73710000', '541511', '60-610-611', 'Office', 'Technology', 'Software', 10, ['whtcol']),
+    ('81110000', '541110', '60-620-621', 'Office', 'Legal', 'Law firm', 8, ['whtcol']),
+    ('80110000', '621111', '70-710-711', 'Health', 'Medical', 'Physician', 8, ['whtcol', 'meds']),
+    ('82110000', '611110', '80-810-811', 'Education', 'School', 'School', 2, ['eds']),
+    ('91110000', '921110', '90-910-911', 'Government', 'Executive', 'Executive', 2, ['gov', 'whtcol']),
+    ('34940000', '332919', '95-950-951', 'Industry', 'Manufacturing', 'Metal', 6, ['blucol']),
+    ('42120000', '484110', '95-960-961', 'Industry', 'Transport', 'Trucking', 4, ['blucol']),
+    ('99990000', '0', '99-999-999', 'Unknown', 'Unknown', 'Unknown', 2, []),
+]
+restaurant_types = ['', 'Fast Food', 'Casual', 'Coffee/Drinks']
+
+
+def write_psv(fname, fieldnames, rows):
+    with open(fname, 'w') as outfile:
+        writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def write_ref_tables(ref_dir):
+    """
+    Writes the business category lookup tables, if they aren't already there. (The "ref" directory
+    is shared by all the MSAs under MSA_BASE, so real tables are never overwritten.)
+    """
+    sbc_dir = '%s/sbc' % ref_dir
+    if os.path.isfile('%s/sbc_semantics.psv' % sbc_dir):
+        print('## Using existing reference tables in "%s"' % sbc_dir)
+        return
+    print('## Writing reference tables to "%s"' % sbc_dir)
+    if not os.path.isdir(sbc_dir):
+        os.makedirs(sbc_dir)
+
+    write_psv('%s/lookup_sic_n17.psv' % sbc_dir, ['sic', 'naics2017'],
+              [{'sic': c[0], 'naics2017': c[1]} for c in categories if c[1] != '0'])
+    write_psv('%s/lookup_n17_sbc.psv' % sbc_dir, ['naics2017', 'bcid', 'bc1', 'bc2', 'bc3'],
+              [{'naics2017': c[1], 'bcid': c[2], 'bc1': c[3], 'bc2': c[4], 'bc3': c[5]}
+               for c in categories if c[1] != '0'])
+    rows = []
+    for c in categories:
+        row = {'bcid': c[2], 'bc1': c[3], 'bc2': c[4], 'bc3': c[5]}
+        for attr_name in attr_names:
+            row[attr_name] = '1' if attr_name in c[7] else '0'
+        rows.append(row)
+    write_psv('%s/sbc_semantics.psv' % sbc_dir, ['bcid', 'bc1', 'bc2', 'bc3'] + attr_names, rows)
+
+
+def make_boundary(extent, rng):
+    """
+    Makes a detailed boundary polygon around the street grid, in local coordinates. The edges
+    wiggle in and out, but always stay at least 100 m clear of the grid.
+
+    :param extent: size of the (square) street grid, which has its lower left corner at (0, 0)
+    :return: array of (x, y) vertices, closed
+    """
+    n = max(int(extent / 20.0), 200)
+    t = np.linspace(0.0, 1.0, n, endpoint=False)
+    phase = rng.uniform(0.0, 2.0 * np.pi, 4)
+    ring = []
+    for side in range(4):
+        wobble = 300.0 + 150.0 * np.sin(2.0 * np.pi * 7.0 * t + phase[side]) + 50.0 * np.sin(2.0 * np.pi * 53.0 * t)
+        s = t * (extent + 600.0) - 300.0
+        if side == 0:
+            ring.append(np.column_stack((s, -wobble)))
+        elif side == 1:
+            ring.append(np.column_stack((extent + wobble, s)))
+        elif side == 2:
+            ring.append(np.column_stack((extent - s, extent + wobble)))
+        else:
+            ring.append(np.column_stack((-wobble, extent - s)))
+    ring = np.concatenate(ring)
+    return np.concatenate((ring, ring[:1]))
+
+
+def make_streets(block_count):
+    """
+    Lays out the street grid as OSM-style nodes and ways.
+
+    :param block_count: number of blocks along each side of the grid
+    :return: (node (x, y) array, list of way dictionaries with 'nodes' (indices into the node array)
+        and 'tags')
+    """
+    extent = block_count * block_size
+    steps = int(block_size / node_spacing)
+    node_xy = []
+    node_lookup = {}
+
+    def node(x, y):
+        # Nodes at the same spot are shared, which is what makes intersections into graph vertices.
+        key = (int(round(x * 10.0)), int(round(y * 10.0)))
+        if key not in node_lookup:
+            node_lookup[key] = len(node_xy)
+            node_xy.append((x, y))
+        return node_lookup[key]
+
+    def street_class(k):
+        if k % (4 * arterial_spacing) == 0:
+            return 'primary'
+        elif k % arterial_spacing == 0:
+            return 'secondary'
+        elif k % arterial_spacing == arterial_spacing // 2:
+            return 'tertiary'
+        return 'residential'
+
+    ways = []
+    for direction in range(2):
+        for k in range(block_count + 1):
+            road_class = street_class(k)
+            tags = {'highway': road_class}
+            if road_class == 'secondary' and (k // arterial_spacing) % 3 == 1:
+                tags['oneway'] = 'yes'
+            for b0 in range(0, block_count, way_blocks):
+                b1 = min(b0 + way_blocks, block_count)
+                nodes = []
+                for i in range(b0 * steps, b1 * steps + 1):
+                    s = i * node_spacing
+                    # Shape nodes between intersections are nudged a little off the line.
+                    wiggle = 0.0 if i % steps == 0 else 1.5 * np.sin(0.7 * i + k)
+                    c = k * block_size + wiggle
+                    nodes.append(node(s, c) if direction == 0 else node(c, s))
+                ways.append({'nodes': nodes, 'tags': tags})
+
+    # A motorway across the middle of the grid, running between streets so that it only meets
+    # them at its ramps, which join the arterials.
+    y = (block_count // 2) * block_size + 0.5 * block_size
+    nodes = [node(x, y) for x in np.arange(0.0, extent + 1.0, 4 * node_spacing)]
+    ways.append({'nodes': nodes, 'tags': {'highway': 'motorway'}})
+    for k in range(arterial_spacing, block_count, arterial_spacing):
+        x = k * block_size
+        ramp = [node(x, y), node(x + 30.0, y + 20.0), node(x + block_size, y + 0.5 * block_size)]
+        ways.append({'nodes': ramp, 'tags': {'highway': 'motorway_link'}})
+
+    # Service roads from some of the intersections into the blocks.
+    for k in range(2, block_count, 5):
+        x = k * block_size
+        y = ((k * 7) % block_count) * block_size
+        ways.append({'nodes': [node(x, y), node(x + 30.0, y + 30.0)], 'tags': {'highway': 'service'}})
+
+    return np.array(node_xy), ways
+
+
+def write_tiles(osm_dir, node_lonlat, ways):
+    """
+    Writes the streets out as OSM JSON tiles. As with the Overpass API, a tile has every way that
+    touches it (by bounding box here), along with all of the nodes of those ways.
+    """
+    node_base = 1000000000
+    way_base = 500000000
+    tile_ways = {}
+    for (w, way) in enumerate(ways):
+        ll = node_lonlat[way['nodes']]
+        (lon0, lat0) = np.floor(ll.min(axis=0) / tile_size).astype(int)
+        (lon1, lat1) = np.floor(ll.max(axis=0) / tile_size).astype(int)
+        for i in range(lon0, lon1 + 1):
+            for j in range(lat0, lat1 + 1):
+                tile_ways.setdefault((i, j), []).append(w)
+
+    for (i, j) in sorted(tile_ways.keys()):
+        fname = '%s/roads_%.0f_%.0f.json' % (osm_dir, abs(i), abs(j))
+        elements = []
+        node_set = set()
+        for w in tile_ways[(i, j)]:
+            node_set.update(ways[w]['nodes'])
+        for n in sorted(node_set):
+            elements.append({'type': 'node', 'id': node_base + n,
+                             'lon': round(float(node_lonlat[n, 0]), 7), 'lat': round(float(node_lonlat[n, 1]), 7)})
+        for w in tile_ways[(i, j)]:
+            elements.append({'type': 'way', 'id': way_base + w,
+                             'nodes': [node_base + n for n in ways[w]['nodes']], 'tags': ways[w]['tags']})
+        with open(fname, 'w') as outfile:
+            json.dump({'version': 0.6, 'generator': 'eero synthetic MSA', 'elements': elements}, outfile)
+
+    return len(tile_ways)
+
+
+def make_sites(site_count, block_count, rng):
+    """
+    Places business sites along the streets. Sites cluster around a few downtowns and along the
+    arterials. Each site is inside one lot.
+
+    :return: (x array, y array, lot index array)
+    """
+    extent = block_count * block_size
+    center_count = max(3, site_count // 100000)
+    centers = rng.uniform(0.15 * extent, 0.85 * extent, (center_count, 2))
+    sigma = extent / 12.0
+
+    # Which block is each site in? Most are near a downtown; the rest are spread along arterials
+    # or anywhere at all.
+    kind = rng.choice(3, site_count, p=[0.6, 0.25, 0.15])
+    c = rng.randint(0, center_count, site_count)
+    bx = np.where(kind == 0, centers[c, 0] + rng.normal(0.0, sigma, site_count), rng.uniform(0, extent, site_count))
+    by = np.where(kind == 0, centers[c, 1] + rng.normal(0.0, sigma, site_count), rng.uniform(0, extent, site_count))
+    bi = np.clip((bx / block_size).astype(int), 0, block_count - 1)
+    bj = np.clip((by / block_size).astype(int), 0, block_count - 1)
+    on_arterial = kind == 1
+    bj[on_arterial] = np.minimum((bj[on_arterial] // arterial_spacing) * arterial_spacing, block_count - 1)
+
+    # Which street does the site face (0 = bottom, 1 = left), and where along it? Sites stay clear of
+    # the lot boundaries, so it's unambiguous which lot they are in.
+    side = np.where(on_arterial, 0, rng.randint(0, 2, site_count))
+    along = np.where(rng.randint(0, 2, site_count) == 0, rng.uniform(12.0, 45.0, site_count),
+                     rng.uniform(55.0, 88.0, site_count))
+    offset = rng.uniform(15.0, 40.0, site_count)
+    u = np.where(side == 0, along, offset)
+    v = np.where(side == 0, offset, along)
+    x = np.round(bi * block_size + u, 1)
+    y = np.round(bj * block_size + v, 1)
+
+    # Lots are numbered 4 per block.
+    lot = (bj * block_count + bi) * 4 + (v > 50.0) * 2 + (u > 50.0)
+    return x, y, lot
+
+
+def write_parcels(fname, block_count, projector):
+    """
+    Writes the parcel polygons: four lots per block, each set back from the streets.
+    """
+    half = 0.5 * block_size
+    crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
+    schema = {'geometry': 'Polygon', 'properties': {'id': 'int'}}
+    with fiona.open(fname, 'w', crs=crs, driver='ESRI Shapefile', schema=schema) as dest:
+        for bj in range(block_count):
+            # Work out the corners for a whole row of blocks at a time.
+            bi = np.repeat(np.arange(block_count), 4)
+            q = np.tile(np.arange(4), block_count)
+            x0 = bi * block_size + (q % 2) * half + np.where(q % 2 == 0, lot_inset, 0.0)
+            x1 = bi * block_size + (q % 2) * half + np.where(q % 2 == 0, half, half - lot_inset)
+            y0 = bj * block_size + (q // 2) * half + np.where(q // 2 == 0, lot_inset, 0.0)
+            y1 = bj * block_size + (q // 2) * half + np.where(q // 2 == 0, half, half - lot_inset)
+            (lon0, lat0) = projector.inverse(x0, y0)
+            (lon1, lat1) = projector.inverse(x1, y1)
+            records = []
+            for k in range(len(bi)):
+                ring = [(lon0[k], lat0[k]), (lon1[k], lat0[k]), (lon1[k], lat1[k]), (lon0[k], lat1[k]),
+                        (lon0[k], lat0[k])]
+                records.append({'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                                'properties': {'id': int((bj * block_count + bi[k]) * 4 + q[k])}})
+            dest.writerecords(records)
+
+
+parser = argparse.ArgumentParser(prog='eero make_synthetic_msa', description='Build a synthetic MSA for benchmarks')
+parser.add_argument('--businesses', type=int, default=100000, help='number of businesses (default 100000)')
+parser.add_argument('--name', default=None, help='MSA name (default "synth_<businesses>")')
+parser.add_argument('--seed', type=int, default=1, help='random number seed')
+parser.add_argument('--lon', type=float, default=-100.0, help='longitude of the lower left corner of the grid')
+parser.add_argument('--lat', type=float, default=40.0, help='latitude of the lower left corner of the grid')
+args = parser.parse_args(sys.argv[1:])
+
+if msa_base is None:
+    sys.exit('MSA_BASE must be set')
+msa_name = args.name or 'synth_%d' % args.businesses
+msa_dir = '%s/%s' % (msa_base, msa_name)
+rng = np.random.RandomState(args.seed)
+
+
+print('# Building synthetic MSA "%s" with %d businesses' % (msa_dir, args.businesses))
+
+for d in ['meta', 'biz', 'areas', 'parcels', 'roads/osm']:
+    if not os.path.isdir('%s/%s' % (msa_dir, d)):
+        os.makedirs('%s/%s' % (msa_dir, d))
+
+write_ref_tables('%s/ref' % msa_base)
+
+
+# The grid is sized for about 8 businesses per block, and is a whole number of arterial blocks.
+block_count = max(4 * arterial_spacing, int(np.sqrt(args.businesses / 8.0)))
+block_count = int(np.ceil(block_count / float(arterial_spacing))) * arterial_spacing
+extent = block_count * block_size
+print('## Street grid is %d x %d blocks (%.1f km on a side)' % (block_count, block_count, extent / 1000.0))
+
+# Set up a local projection whose origin is at the lower left corner of the grid.
+projection = '+proj=tmerc +lat_0=%.4f +lon_0=%.4f +y_0=0 +x_0=0 +k_0=0.9996 +units=m +ellps=WGS84' % (
+    args.lat, args.lon)
+projector = Projector(projection)
+
+
+# The MSA boundary and meta data.
+fname = '%s/meta/bounds.shp' % msa_dir
+print('## Writing MSA boundary "%s"' % fname)
+ring = make_boundary(extent, rng)
+(ring_lon, ring_lat) = projector.inverse(ring[:, 0], ring[:, 1])
+schema = {'geometry': 'Polygon', 'properties': {'name': 'str'}}
+with fiona.open(fname, 'w', crs='+proj=longlat +ellps=WGS84 +datum=WGS84', driver='ESRI Shapefile',
+                schema=schema) as dest:
+    dest.write({'geometry': {'type': 'Polygon', 'coordinates': [list(zip(ring_lon.tolist(), ring_lat.tolist()))]},
+                'properties': {'name': msa_name}})
+
+write_psv('%s/meta/meta.psv' % msa_dir, ['name', 'value'],
+          [{'name': 'msa_name', 'value': msa_name},
+           {'name': 'lon_min', 'value': '%.2f' % ring_lon.min()},
+           {'name': 'lon_max', 'value': '%.2f' % ring_lon.max()},
+           {'name': 'lat_min', 'value': '%.2f' % ring_lat.min()},
+           {'name': 'lat_max', 'value': '%.2f' % ring_lat.max()},
+           {'name': 'projection', 'value': projection}])
+
+
+# The road network tiles.
+print('## Laying out streets')
+(node_xy, ways) = make_streets(block_count)
+(node_lon, node_lat) = projector.inverse(node_xy[:, 0], node_xy[:, 1])
+tile_count = write_tiles('%s/roads/osm' % msa_dir, np.column_stack((node_lon, node_lat)), ways)
+print('## Wrote %d nodes and %d ways in %d tiles' % (len(node_xy), len(ways), tile_count))
+with open('%s/roads/osm_check' % msa_dir, 'w'):
+    pass
+
+
+# The businesses. Sites are shared by several businesses (malls, office buildings) with a long-tailed
+# distribution. A few businesses are well outside the MSA, to exercise the bounds filter.
+print('## Placing businesses')
+biz_count = args.businesses
+site_count = max(1, int(0.6 * biz_count))
+(site_x, site_y, site_lot) = make_sites(site_count, block_count, rng)
+popularity = rng.pareto(2.5, site_count) + 1.0
+site_for_biz = rng.choice(site_count, biz_count, p=popularity / popularity.sum())
+biz_x = site_x[site_for_biz]
+biz_y = site_y[site_for_biz]
+outside = rng.uniform(0.0, 1.0, biz_count) < 0.01
+biz_x[outside] = -3000.0 - rng.uniform(0.0, 5000.0, outside.sum())
+(biz_lon, biz_lat) = projector.inverse(biz_x, biz_y)
+
+frequency = np.array([c[6] for c in categories], dtype=float)
+category_for_biz = rng.choice(len(categories), biz_count, p=frequency / frequency.sum())
+chain_for_biz = np.where(rng.uniform(0.0, 1.0, biz_count) < 0.15, rng.randint(1, 500, biz_count), 0)
+res_type_for_biz = rng.randint(0, len(restaurant_types), biz_count)
+
+fname = '%s/biz/biz_list_0.psv' % msa_dir
+print('## Writing business list "%s"' % fname)
+fieldnames = ['pid', 'name', 'address', 'city', 'state', 'zip', 'lon', 'lat', 'chainid', 'psic', 'allsics', 'res_type']
+lon_text = ['%.6f' % v for v in biz_lon.tolist()]
+lat_text = ['%.6f' % v for v in biz_lat.tolist()]
+with open(fname, 'w') as outfile:
+    writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
+    writer.writeheader()
+    for k in range(biz_count):
+        c = categories[category_for_biz[k]]
+        writer.writerow({'pid': '%d' % (20000000 + k),
+                         'name': 'Business %d' % k,
+                         'address': '%d Synthetic St' % (k % 9999 + 1),
+                         'city': 'Synthville',
+                         'state': 'XX',
+                         'zip': '%05d' % (k % 100000),
+                         'lon': lon_text[k],
+                         'lat': lat_text[k],
+                         'chainid': '%d' % chain_for_biz[k] if chain_for_biz[k] > 0 else '',
+                         'psic': c[0],
+                         'allsics': '%s:' % c[0],
+                         'res_type': restaurant_types[res_type_for_biz[k]] if c[1] == '722511' else ''})
+
+
+# The parcels, and the parcel for each site. Site IDs are worked out just the way "get_site_list"
+# will do it, i.e. from the rounded local coordinates of the businesses that are in the MSA, in
+# order of first appearance.
+fname = '%s/parcels/parcels.shp' % msa_dir
+print('## Writing parcels "%s"' % fname)
+write_parcels(fname, block_count, projector)
+
+fname = '%s/parcels/site_parcel_lookup.psv' % msa_dir
+print('## Writing site / parcel lookup "%s"' % fname)
+inside = np.nonzero(~outside)[0]
+(xx, yy) = projector.forward(np.array([float(lon_text[k]) for k in inside]),
+                             np.array([float(lat_text[k]) for k in inside]))
+(site_index, first_biz) = first_appearance(np.column_stack((np.rint(xx), np.rint(yy))).astype(np.int64))
+write_psv(fname, ['siteId', 'parcelId'],
+          [{'siteId': '%d' % (ix + 1), 'parcelId': '%d' % site_lot[site_for_biz[inside[first_biz[ix]]]]}
+           for ix in range(len(first_biz))])
+
+
+# Parameters and the Makefile, as in the prototype MSA.
+write_psv('%s/areas/ba_parameters.psv' % msa_dir, ['epsilon', 'merge_threshold', 'max_cluster_size'],
+          [{'epsilon': '150.0', 'merge_threshold': '1.8', 'max_cluster_size': '300.0'}])
+
+with open('%s/../proto/Makefile' % eero_dir) as infile:
+    makefile = infile.read().split('\n')
+for i in range(len(makefile)):
+    if makefile[i].startswith('export MSA_BASE:='):
+        makefile[i] = 'export MSA_BASE:=%s' % msa_base
+    elif makefile[i].startswith('export MSA_NAME:='):
+        makefile[i] = 'export MSA_NAME:=%s' % msa_name
+with open('%s/Makefile' % msa_dir, 'w') as outfile:
+    outfile.write('\n'.join(makefile))
+
+
+print('## Done; %d businesses (%d outside the MSA) at %d sites' % (biz_count, outside.sum(), len(first_biz)))
+print
@@ -0,0 +1,180 @@
+#
+# This file has support for recording how each eero stage performed: wall and CPU time, peak memory
+# use, and the sizes of the files that it read and wrote.
+#
+# Each stage makes a "StageMetrics" object when it starts, tells it about its input and output
+# files as it goes, and calls "finish" at the end. That appends one JSON record per run to the
+# MSA's metrics log ("stage_metrics.jsonl" in the MSA directory), so the log shows which stage
+# dominates each MSA, and how that changes from one version of the code to the next.
+#
+
+
+import os
+import sys
+import json
+import time
+import struct
+import datetime
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+msa_base = os.environ.get('MSA_BASE')
+msa_name = os.environ.get('MSA_NAME')
+msa_dir = '%s/%s' % (msa_base, msa_name)
+metrics_fname = '%s/stage_metrics.jsonl' % msa_dir
+eero_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_code_version():
+    """
+    Gets a string identifying the version of the eero code, i.e. the git commit, or None if that
+    can't be found out.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=eero_dir, stderr=devnull)
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_peak_rss(children=False):
+    """
+    Gets the peak resident set size of this process so far, in megabytes. Note that when several
+    stages run in one process (see "e_run.py"), this is the peak over all of them so far.
+
+    :param children: if True, get the largest peak of any one child process that has finished and
+        been waited for instead (e.g. the workers of a "multiprocessing" pool, once it is joined);
+        None if there hasn't been one
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    if children and rss == 0:
+        return None
+    # Linux reports kilobytes; OS X reports bytes.
+    if sys.platform == 'darwin':
+        return rss / (1024.0 * 1024.0)
+    return rss / 1024.0
+
+
+def count_rows(fname):
+    """
+    Works out the number of rows (records, features, ...) in a pipeline file, for the kinds of
+    file where that's cheap to do.
+
+    :param fname: name of the file
+    :return: number of rows, or None if unknown
+    """
+    try:
+        if fname.endswith('.psv'):
+            # All of our PSV files have a header row.
+            with open(fname, 'rb') as infile:
+                return max(sum(1 for line in infile) - 1, 0)
+        elif fname.endswith('.csr') or fname.endswith('.graph'):
+            # The stored entry count (or edge count, for a road graph) is in the header (see
+            # "e_distance_support" and "e_graph_support").
+            with open(fname, 'rb') as infile:
+                header = infile.read(24)
+            return struct.unpack('<q', header[16:24])[0]
+        elif fname.endswith('.shp'):
+            # The ".shx" index has a 100-byte header, then 8 bytes per feature.
+            shx_fname = fname[:-4] + '.shx'
+            return (os.path.getsize(shx_fname) - 100) // 8
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class StageMetrics(object):
+    """
+    Collects the metrics for one run of a stage.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = datetime.datetime.now()
+        self.wall0 = time.time()
+        # The CPU time includes that of child processes, such as pool workers, once they have
+        # finished and been waited for.
+        t = os.times()
+        self.cpu0 = t[0] + t[1] + t[2] + t[3]
+        self.inputs = []
+        self.outputs = []
+
+    def input(self, fname, rows=None):
+        """
+        Notes a file that the stage read.
+
+        :param fname: name of the file
+        :param rows: number of rows read; if None, it is counted when possible
+        """
+        self.inputs.append((fname, rows))
+
+    def output(self, fname, rows=None):
+        """
+        Notes a file that the stage wrote.
+
+        :param fname: name of the file
+        :param rows: number of rows written; if None, it is counted when possible
+        """
+        self.outputs.append((fname, rows))
+
+    def file_info(self, fname, rows):
+        if rows is None:
+            rows = count_rows(fname)
+        try:
+            size = os.path.getsize(fname)
+        except OSError:
+            size = None
+        return {'file': os.path.relpath(fname, msa_dir), 'rows': rows, 'bytes': size}
+
+    def finish(self):
+        """
+        Works out the metrics for the stage, and appends them to the MSA's metrics log.
+
+        :return: dictionary containing the metrics
+        """
+        wall = time.time() - self.wall0
+        t = os.times()
+        cpu = t[0] + t[1] + t[2] + t[3] - self.cpu0
+
+        inputs = [self.file_info(fname, rows) for (fname, rows) in self.inputs]
+        outputs = [self.file_info(fname, rows) for (fname, rows) in self.outputs]
+
+        def total(info_list, field):
+            return sum([info[field] for info in info_list if info[field] is not None])
+
+        peak_rss = get_peak_rss()
+        child_peak_rss = get_peak_rss(children=True)
+
+        record = {'stage': self.stage,
+                  'msa': msa_name,
+                  'started': self.started.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'version': get_code_version(),
+                  'pid': os.getpid(),
+                  'wall_time': round(wall, 3),
+                  'cpu_time': round(cpu, 3),
+                  'peak_rss_mb': None if peak_rss is None else round(peak_rss, 1),
+                  'child_peak_rss_mb': None if child_peak_rss is None else round(child_peak_rss, 1),
+                  'input_rows': total(inputs, 'rows'),
+                  'output_rows': total(outputs, 'rows'),
+                  'output_bytes': total(outputs, 'bytes'),
+                  'inputs': inputs,
+                  'outputs': outputs}
+
+        try:
+            with open(metrics_fname, 'a') as outfile:
+                outfile.write(json.dumps(record, sort_keys=True) + '\n')
+        except (IOError, OSError):
+            print('!!! Unable to write metrics log "%s"' % metrics_fname)
+
+        print('## Stage "%s" took %.1f s (%.1f s CPU), peak memory %s MB%s' % (
+            self.stage, wall, cpu, record['peak_rss_mb'],
+            '' if child_peak_rss is None else ' (largest child process %s MB)' % record['child_peak_rss_mb']))
+        return record
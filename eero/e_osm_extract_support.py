@@ -0,0 +1,155 @@
+#
+# This file has support for reading road network data from a local OpenStreetMap extract (an
+# ".osm" XML file, or an ".osm.pbf" file, e.g. a state or region downloaded from Geofabrik),
+# rather than from Overpass API tiles.
+#
+# Extracts are much bigger than the area we want, so they are streamed rather than loaded, and
+# clipped to a bounding box: we keep the ways of the "good_classes" of road that have at least one
+# node in the box, along with all of their nodes. That's the same selection that the Overpass
+# queries make for each tile ("way(box) [highway]; node(w);"). Since the nodes come before the
+# ways in an OSM file, this takes two passes: the first finds the nodes in the box and the ways
+# that use them, the second gets the coordinates of the nodes of those ways.
+#
+# Reading ".osm.pbf" files needs the "osmium" package (pyosmium); ".osm" files are read with the
+# standard library.
+#
+
+
+import numpy as np
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+from e_graph_support import good_class_codes
+
+
+class BoxPass(object):
+    """
+    Collects the ways we want in the first pass over an extract.
+    """
+
+    def __init__(self, bounds):
+        (self.lon0, self.lat0, self.lon1, self.lat1) = bounds
+        self.in_box = set()
+        self.way_ids = []
+        self.way_class = []
+        self.way_oneway = []
+        self.way_offsets = [0]
+        self.way_nodes = []
+
+    def on_node(self, id, lon, lat):
+        if self.lon0 <= lon <= self.lon1 and self.lat0 <= lat <= self.lat1:
+            self.in_box.add(id)
+
+    def on_way(self, id, nodes, highway, oneway):
+        if highway not in good_class_codes:
+            return
+        in_box = self.in_box
+        for n in nodes:
+            if n in in_box:
+                break
+        else:
+            return
+        self.way_ids.append(id)
+        self.way_class.append(good_class_codes[highway])
+        self.way_oneway.append(oneway == 'yes')
+        self.way_nodes.extend(nodes)
+        self.way_offsets.append(len(self.way_nodes))
+
+
+class NodePass(object):
+    """
+    Collects the nodes of the ways we want in the second pass over an extract.
+    """
+
+    def __init__(self, wanted):
+        self.wanted = wanted
+        self.node_ids = []
+        self.node_lon = []
+        self.node_lat = []
+
+    def on_node(self, id, lon, lat):
+        if id in self.wanted:
+            self.node_ids.append(id)
+            self.node_lon.append(lon)
+            self.node_lat.append(lat)
+
+    def on_way(self, id, nodes, highway, oneway):
+        pass
+
+
+def read_osm_xml(fname, collector, ways=True):
+    """
+    Streams the nodes and ways of an ".osm" XML file to a collector.
+
+    :param fname: name of the file
+    :param collector: object with "on_node" and "on_way" methods
+    :param ways: if False, stop at the first way (they come after all the nodes)
+    """
+    context = ElementTree.iterparse(fname, events=('start', 'end'))
+    (event, root) = next(context)
+    for (event, elem) in context:
+        if event != 'end':
+            continue
+        if elem.tag == 'node':
+            collector.on_node(int(elem.get('id')), float(elem.get('lon')), float(elem.get('lat')))
+        elif elem.tag == 'way':
+            if not ways:
+                break
+            nodes = [int(nd.get('ref')) for nd in elem.iter('nd')]
+            tags = dict((tag.get('k'), tag.get('v')) for tag in elem.iter('tag'))
+            collector.on_way(int(elem.get('id')), nodes, tags.get('highway'), tags.get('oneway'))
+        elif elem.tag != 'relation':
+            continue
+        # Drop everything parsed so far, so memory use stays flat.
+        root.clear()
+
+
+def read_osm_pbf(fname, collector, ways=True):
+    """
+    Streams the nodes and ways of an ".osm.pbf" file to a collector.
+
+    :param fname: name of the file
+    :param collector: object with "on_node" and "on_way" methods
+    :param ways: if False, skip the ways
+    """
+    import osmium
+
+    class Handler(osmium.SimpleHandler):
+
+        def node(self, n):
+            collector.on_node(n.id, n.location.lon, n.location.lat)
+
+        def way(self, w):
+            if ways:
+                collector.on_way(w.id, [nd.ref for nd in w.nodes], w.tags.get('highway'), w.tags.get('oneway'))
+
+    Handler().apply_file(fname, locations=False)
+
+
+def parse_osm_extract(fname, bounds):
+    """
+    Reads the roads in a bounding box from an OSM extract.
+
+    :param fname: name of an ".osm" or ".osm.pbf" file
+    :param bounds: (lon_min, lat_min, lon_max, lat_max)
+    :return: arrays of nodes and ways, as from "e_graph_support.parse_osm_file"
+    """
+    if fname.endswith('.pbf'):
+        read = read_osm_pbf
+    else:
+        read = read_osm_xml
+
+    print('### Finding roads in (%.3f, %.3f, %.3f, %.3f)' % tuple(bounds))
+    ways = BoxPass(bounds)
+    read(fname, ways)
+    del ways.in_box
+
+    print('### Getting nodes for %d ways' % len(ways.way_ids))
+    nodes = NodePass(set(ways.way_nodes))
+    read(fname, nodes, ways=False)
+
+    return (np.array(nodes.node_ids, dtype=np.int64), np.array(nodes.node_lon), np.array(nodes.node_lat),
+            np.array(ways.way_ids, dtype=np.int64), np.array(ways.way_class, dtype=np.int8),
+            np.array(ways.way_oneway, dtype=bool), np.array(ways.way_offsets, dtype=np.int64),
+            np.array(ways.way_nodes, dtype=np.int64))
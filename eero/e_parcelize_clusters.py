@@ -11,13 +11,18 @@ import csv
 import fiona
 from rtree import index
 import os
-from e_utils import get_remap_function
+from e_utils import get_projector
+from e_utils import psvarray
+from e_export_support import layer_name
+from e_export_support import write_layer
 # from e_gis_support import ortho_merge
 from scipy.spatial import Voronoi
 from copy import copy
+from e_metrics_support import StageMetrics
 
 
 print('# Parcelizing business areas.')
+metrics = StageMetrics('parcelize_clusters')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -32,28 +37,26 @@ road_dir = '%s/roads' % msa_dir
 
 
 min_viable_size = 4
-remap = get_remap_function()
+projector = get_projector()
 
 
 # Get a list of sites.
 fname = '%s/ba_clusters.psv' % area_dir
 print('## Reading business area labels from "%s"' % fname)
+metrics.input(fname)
 ba_site_list = {}
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid = rec['siteId']
-        label = rec['label']
-        lon = float(rec['lon'])
-        lat = float(rec['lat'])
-        (xx, yy) = remap(lon, lat)
-        ba_site_list[sid] = {'label': label, 'xx': xx, 'yy': yy}
+ba_clusters = psvarray(fname)
+(xx_list, yy_list) = projector.forward(ba_clusters['lon'], ba_clusters['lat'])
+for (sid, label, xx, yy) in zip(ba_clusters['siteId'].tolist(), ba_clusters['label'].tolist(),
+                                xx_list.tolist(), yy_list.tolist()):
+    ba_site_list[sid] = {'label': label, 'xx': xx, 'yy': yy}
 
 
 # Read the list of parcel labels for each site. There is one parcel or every site, but
 # generally multiple sites per parcel. We will need lookup tables that go both ways.
 fname = '%s/site_parcel_lookup.psv' % parcel_dir
 print('## Reading site / parcel lookup from "%s"' % fname)
+metrics.input(fname)
 parcel_for_site = {}
 sites_for_parcel = {}
 with open(fname) as infile:
@@ -73,27 +76,22 @@ fname = '%s/ba_clusters.psv' % area_dir
 print('## Reading business area labels from "%s"' % fname)
 ba_site_list = {}
 site_count_for_label = {}
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid = rec['siteId']
-        label = rec['label']
-        lon = float(rec['lon'])
-        lat = float(rec['lat'])
-        (xx, yy) = remap(lon, lat)
-        ba_site_list[sid] = {'label': label, 'xx': xx, 'yy': yy}
-        if label not in site_count_for_label:
-            site_count_for_label[label] = 0
-        site_count_for_label[label] += 1
+ba_clusters = psvarray(fname)
+(xx_list, yy_list) = projector.forward(ba_clusters['lon'], ba_clusters['lat'])
+for (sid, label, xx, yy) in zip(ba_clusters['siteId'].tolist(), ba_clusters['label'].tolist(),
+                                xx_list.tolist(), yy_list.tolist()):
+    ba_site_list[sid] = {'label': label, 'xx': xx, 'yy': yy}
+    if label not in site_count_for_label:
+        site_count_for_label[label] = 0
+    site_count_for_label[label] += 1
 
 
 # Read all parcel polygons.
 fn = parcel_dir + '/parcels.shp'
 print('## Reading original parcel data from "%s"' % fn)
+metrics.input(fn)
 ba_list = {}
 with fiona.open(fn) as source:
-    driver = source.driver
-    crs = source.crs
     k = 0
     for f0 in source:
 
@@ -110,7 +108,7 @@ with fiona.open(fn) as source:
 
         # Make the feature into a shape, and re-map it to the local CRS.
         s0 = shapely.geometry.geo.shape(f0['geometry'])
-        s1 = shapely.ops.transform(remap, s0)
+        s1 = projector.transform_geometry(s0)
 
         # Get the list of all sites that fall in this parcel.
         for sid in sites_for_parcel[pid]:
@@ -241,38 +239,29 @@ for label in ba_multi:
     ba_ortho[label] = ortho_merge(ss, label)
 
 
-# This is used below to re-map coordinates from the local system back to WGS84.
-def towgs(xx, yy, zz=None):
-    return remap(xx, yy, inverse=True)
-
-
-outfile = area_dir + '/s_ba_multi.shp'
+# The shapes below are all in the local system; "write_layer" re-maps them back to WGS84.
+outfile = layer_name(area_dir + '/s_ba_multi')
 print('## Writing business area polygons to "%s"' % outfile)
+metrics.output(outfile)
 schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for label in ba_multi:
-        if site_count_for_label[label] < min_viable_size:
-            continue
-        shape = shapely.ops.transform(towgs, ba_multi[label])
-        outFeature = {
-            'geometry': shapely.geometry.mapping(shape),
-            'properties': {'label': label}}
-        dest.write(outFeature)
+label_list = [label for label in ba_multi if site_count_for_label[label] >= min_viable_size]
+write_layer(outfile, [ba_multi[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
-outfile = area_dir + '/s_ba_ortho.shp'
+outfile = layer_name(area_dir + '/s_ba_ortho')
 print('## Writing business area polygons to "%s"' % outfile)
+metrics.output(outfile)
 schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for label in ba_ortho:
-        if site_count_for_label[label] < min_viable_size:
-            continue
-        shape = shapely.ops.transform(towgs, ba_ortho[label])
-        if shape.geom_type != 'Polygon' and shape.geom_type != 'MultiPolygon':
-            print ('### Skipping %s (type %s)' % (label, shape.geom_type))
-            continue
-        outFeature = {
-            'geometry': shapely.geometry.mapping(shape),
-            'properties': {'label': label}}
-        dest.write(outFeature)
-
+label_list = []
+for label in ba_ortho:
+    if site_count_for_label[label] < min_viable_size:
+        continue
+    shape = ba_ortho[label]
+    if shape.geom_type != 'Polygon' and shape.geom_type != 'MultiPolygon':
+        print ('### Skipping %s (type %s)' % (label, shape.geom_type))
+        continue
+    label_list.append(label)
+write_layer(outfile, [ba_ortho[label] for label in label_list], {'label': label_list}, schema, projector=projector)
+
+
+metrics.finish()
@@ -6,17 +6,19 @@
 #
 
 
-import shapely.geometry
 import os
 import os.path
 import csv
 from e_utils import psvin
 from e_utils import get_msa_shape
-from e_utils import get_remap_function
+from e_utils import get_projector
+from e_gis_support import ShapeCover
+from e_metrics_support import StageMetrics
 import numpy as np
 
 
 print('# Adding business category information to the list of all businesses')
+metrics = StageMetrics('prep_biz_list')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -30,8 +32,10 @@ meta_dir = '%s/meta' % msa_dir
 road_dir = '%s/roads' % msa_dir
 
 
+# The MSA boundary can be very detailed, so points are tested against it in bulk (see "ShapeCover").
 msa_shape = get_msa_shape()
-remap = get_remap_function()
+msa_cover = ShapeCover(msa_shape)
+projector = get_projector()
 
 
 # THis threshold controls the maximum distance by which the geolocation process is allowed to
@@ -46,12 +50,14 @@ geocode_reloc_threshold = 50.0
 # Read the file that maps SIC codes into NAICS code.
 infile = '%s/sbc/lookup_sic_n17.psv' % ref_dir
 print('## Using SIC-to-NAICS lookup table "%s"' % infile)
+metrics.input(infile)
 sic_to_n17 = psvin(infile, key='sic')
 
 
 # Read the table that maps NAICS codes into Spatially Business Class (SBC) codes
 infile = '%s/sbc/lookup_n17_sbc.psv' % ref_dir
 print('## Using NAICS-to-SBC lookup table "%s"' % infile)
+metrics.input(infile)
 n17_to_sbc = psvin(infile, key='naics2017')
 
 
@@ -68,13 +74,31 @@ else:
 reloc_list = {}
 
 
+# Businesses are handled in chunks of this many records, so that their coordinates can be
+# re-mapped a whole chunk at a time rather than one point at a time.
+chunk_size = 10000
+
+
+def read_chunks(reader, chunk_size):
+    chunk = []
+    for rec in reader:
+        chunk.append(rec)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
 # Loop over all businesses, applying Spatially business class labels.
 in_fname = '%s/biz_list_0.psv' % biz_dir
+metrics.input(in_fname)
 with open(in_fname) as infile:
     reader = csv.DictReader(infile, delimiter='|')
 
     out_fname = '%s/biz_list.psv' % biz_dir
     print('## Creating classified business list "%s"' % out_fname)
+    metrics.output(out_fname)
     with open(out_fname, 'w') as outfile:
         fieldnames = reader.fieldnames + ['gclon', 'gclat', 'bcid', 'bc1', 'bc2', 'bc3']
         writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
@@ -82,79 +106,99 @@ with open(in_fname) as infile:
 
         k = 0
 
-        for rec in reader:
-
-            k += 1
-            if k % 10000 == 0:
-                print('### Record %d' % k)
-
-            biz_id = rec['pid']
-
-            lon = float(rec['lon'])
-            lat = float(rec['lat'])
-            if not msa_shape.contains(shapely.geometry.Point(lon, lat)):
-                continue
-
-            # Check whether we have geocoded info for this record.
-            # The key for geocoded coordinates is derived from teh various address fueklds.
-            rec['gclon'] = ''
-            rec['gclat'] = ''
-            key = '%s, %s, %s, %s' % (rec['address'], rec['city'], rec['state'], rec['zip'])
-            if key in geocode_lookup:
-                gclon = float(geocode_lookup[key]['lon'])
-                gclat = float(geocode_lookup[key]['lat'])
-                (gcxx, gcyy) = remap(gclon, gclat)
-                (xx, yy) = remap(lon, lat)
-                d = np.sqrt((xx - gcxx) ** 2 + (yy - gcyy) ** 2)
-                if d < geocode_reloc_threshold:
-                    rec['gclon'] = '%.6f' % gclon
-                    rec['gclat'] = '%.6f' % gclat
-                    reloc_list[biz_id] = {
-                        'coords': ([(lon, lat), (gclon, gclat)]),
-                        'addr': key}
-
-            # Deal with the business classification.
-            sic = rec['psic']
-            if sic in sic_to_n17:
-                n17 = sic_to_n17[sic]['naics2017']
-            else:
-                n17 = '0'
-
-            if rec['res_type'] == 'Fast Food':
-                n17 = '722513'
-            elif rec['res_type'] == 'Coffee/Drinks':
-                n17 = '722515'
-            elif rec['res_type'] == 'Casual':
-                n17 = '722511'
-
-            if n17 in n17_to_sbc:
-                rec['bcid'] = n17_to_sbc[n17]['bcid']
-                rec['bc1'] = n17_to_sbc[n17]['bc1']
-                rec['bc2'] = n17_to_sbc[n17]['bc2']
-                rec['bc3'] = n17_to_sbc[n17]['bc3']
-                writer.writerow(rec)
-            else:
-                rec['bcid'] = '99-999-999'
-                rec['bc1'] = 'Unknown'
-                rec['bc2'] = 'Unknown'
-                rec['bc3'] = 'Unknown'
-                writer.writerow(rec)
+        for chunk in read_chunks(reader, chunk_size):
+
+            # Get the original coordinates and any geocoded coordinates for the whole chunk, check which
+            # businesses are inside the MSA, and re-map them all to the local CRS. The key for geocoded
+            # coordinates is derived from the various address fields.
+            key_list = ['%s, %s, %s, %s' % (rec['address'], rec['city'], rec['state'], rec['zip'])
+                        for rec in chunk]
+            lon_list = np.array([float(rec['lon']) for rec in chunk])
+            lat_list = np.array([float(rec['lat']) for rec in chunk])
+            gclon_list = np.array([float(geocode_lookup[key]['lon']) if key in geocode_lookup else np.nan
+                                   for key in key_list])
+            gclat_list = np.array([float(geocode_lookup[key]['lat']) if key in geocode_lookup else np.nan
+                                   for key in key_list])
+            in_msa = msa_cover.contains_points(lon_list, lat_list)
+            (xx_list, yy_list) = projector.forward(lon_list, lat_list)
+            has_gc = ~np.isnan(gclon_list)
+            gcxx_list = np.full(len(chunk), np.nan)
+            gcyy_list = np.full(len(chunk), np.nan)
+            (gcxx_list[has_gc], gcyy_list[has_gc]) = projector.forward(gclon_list[has_gc], gclat_list[has_gc])
+            reloc_distance_list = np.sqrt((xx_list - gcxx_list) ** 2 + (yy_list - gcyy_list) ** 2)
+
+            for i in range(len(chunk)):
+                rec = chunk[i]
+
+                k += 1
+                if k % 10000 == 0:
+                    print('### Record %d' % k)
+
+                biz_id = rec['pid']
+
+                if not in_msa[i]:
+                    continue
+
+                lon = lon_list[i]
+                lat = lat_list[i]
+
+                # Check whether we have geocoded info for this record.
+                rec['gclon'] = ''
+                rec['gclat'] = ''
+                key = key_list[i]
+                if has_gc[i]:
+                    gclon = gclon_list[i]
+                    gclat = gclat_list[i]
+                    d = reloc_distance_list[i]
+                    if d < geocode_reloc_threshold:
+                        rec['gclon'] = '%.6f' % gclon
+                        rec['gclat'] = '%.6f' % gclat
+                        reloc_list[biz_id] = {
+                            'coords': ([(float(lon), float(lat)), (float(gclon), float(gclat))]),
+                            'addr': key}
+
+                # Deal with the business classification.
+                sic = rec['psic']
+                if sic in sic_to_n17:
+                    n17 = sic_to_n17[sic]['naics2017']
+                else:
+                    n17 = '0'
+
+                if rec['res_type'] == 'Fast Food':
+                    n17 = '722513'
+                elif rec['res_type'] == 'Coffee/Drinks':
+                    n17 = '722515'
+                elif rec['res_type'] == 'Casual':
+                    n17 = '722511'
+
+                if n17 in n17_to_sbc:
+                    rec['bcid'] = n17_to_sbc[n17]['bcid']
+                    rec['bc1'] = n17_to_sbc[n17]['bc1']
+                    rec['bc2'] = n17_to_sbc[n17]['bc2']
+                    rec['bc3'] = n17_to_sbc[n17]['bc3']
+                    writer.writerow(rec)
+                else:
+                    rec['bcid'] = '99-999-999'
+                    rec['bc1'] = 'Unknown'
+                    rec['bc2'] = 'Unknown'
+                    rec['bc3'] = 'Unknown'
+                    writer.writerow(rec)
 
 # Make a file indicating how points were moved via geolocation.
-oname = '%s/s_relocation.shp' % biz_dir
+from e_export_support import LineArray
+from e_export_support import layer_name
+from e_export_support import write_layer
+oname = layer_name('%s/s_relocation' % biz_dir)
 print('## Making shapefile with relocation information: "%s"' % oname)
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
+metrics.output(oname)
 schema = {'geometry': 'LineString', 'properties': {'id': 'str', 'addr': 'str'}}
-import fiona
-
-with fiona.open(oname, 'w', crs=crs, driver=driver, schema=schema) as dest:
-    for biz_id in reloc_list:
-        feature = {'type': 'Feature',
-                   'id': biz_id,
-                   'geometry': {'coordinates': reloc_list[biz_id]['coords'], 'type': 'LineString'},
-                   'properties': {'id': biz_id, 'addr': reloc_list[biz_id]['addr']}}
-        dest.write(feature)
+reloc_ids = list(reloc_list.keys())
+coords = np.array([reloc_list[biz_id]['coords'] for biz_id in reloc_ids], dtype=np.float64).reshape(-1, 2)
+lines = LineArray(coords[:, 0], coords[:, 1], np.arange(0, len(coords) + 1, 2))
+write_layer(oname, lines, {'id': reloc_ids, 'addr': [reloc_list[biz_id]['addr'] for biz_id in reloc_ids]}, schema)
+
+
+metrics.finish()
 
 
 print
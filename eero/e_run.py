@@ -0,0 +1,171 @@
+#
+# This script runs the whole eero pipeline for an MSA inside a single Python process, i.e. it is
+# an alternative to typing "make" in the MSA directory. Usage:
+#
+#   eero run [target ...]
+#
+# where the targets are the ones in the Makefile ("all" by default; "roads" also works, as do
+# file names like "biz/site_list.psv"). As with make, a target is only rebuilt if it is missing
+# or older than one of the files it depends on, so partial reruns work the same way.
+#
+# The difference is that every stage runs in this one process. Packages like shapely, fiona,
+# sklearn and networkx are imported once, and the big artifacts (the road graph, the pipeline
+# tables and the distance stores) are handed from the stage that wrote them to the stages that
+# read them without being parsed again (see "e_artifact_support"). All the usual files are
+# still written.
+#
+
+
+import os
+import sys
+import runpy
+import argparse
+import subprocess
+import e_artifact_support
+
+
+msa_base = os.environ.get('MSA_BASE')
+msa_name = os.environ.get('MSA_NAME')
+msa_dir = '%s/%s' % (msa_base, msa_name)
+road_dir = '%s/roads' % msa_dir
+eero_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# A local OSM extract to build the road network from, instead of fetching tiles; see
+# "e_make_road_network.py".
+osm_extract = os.environ.get('EERO_OSM_EXTRACT')
+
+
+def fetch_osm_tiles():
+    """
+    Runs the OSM road queries written by the "make_osm_road_queries" stage, and marks them done.
+    """
+    subprocess.check_call(['sh', 'z_run_osm_queries.sh'], cwd=road_dir)
+    with open('%s/osm_check' % road_dir, 'w'):
+        pass
+
+
+def use_osm_extract():
+    """
+    Marks the OSM data as being there, when it comes from a local extract.
+    """
+    with open('%s/osm_check' % road_dir, 'w'):
+        pass
+
+
+# These are the rules from the Makefile in the prototype MSA directory: (target, dependencies,
+# steps), with file names relative to the MSA directory (or absolute). A step is either the name
+# of an eero stage or a function to call. Keep these in step with "proto/Makefile".
+rules = [
+    ('biz/biz_list.psv', ['biz/biz_list_0.psv'], ['prep_biz_list']),
+    ('biz/site_list.psv', ['biz/biz_list.psv'], ['get_site_list']),
+    ('biz/site_road_info.psv', ['biz/site_list.psv', 'roads/road_network.graph'], ['map_sites_to_roads']),
+    ('biz/site_road_distances.csr', ['biz/site_road_info.psv', 'roads/road_network.graph'],
+     ['get_site_road_distances']),
+    ('biz/site_road_distances_scaled.csr', ['biz/site_road_distances.csr'], ['get_site_road_distances_scaled']),
+    ('areas/ba_site_list.psv', ['biz/biz_site_lookup.psv', 'biz/biz_list.psv'], ['get_ba_site_list']),
+    ('areas/ba_site_attributes.psv', ['areas/ba_site_list.psv', 'biz/site_road_distances.csr', 'biz/biz_list.psv'],
+     ['get_ba_site_attributes']),
+    ('areas/ba_site_distances.psv', ['biz/site_road_distances_scaled.csr', 'areas/ba_site_list.psv'],
+     ['get_ba_site_distances']),
+    ('areas/ba_site_labels.psv', ['biz/site_road_distances_scaled.csr', 'areas/ba_site_list.psv',
+                                  'areas/ba_site_attributes.psv', 'areas/ba_parameters.psv'],
+     ['cluster_sites', 'wrap_clusters', 'tidy_clusters']),
+    ('roads/road_network.graph', ['roads/osm_check'], ['make_road_network', 'make_road_shapefiles']),
+    ('roads/osm_check', [osm_extract] if osm_extract else [],
+     [use_osm_extract] if osm_extract else ['make_osm_road_queries', fetch_osm_tiles]),
+]
+
+rule_lookup = dict((target, (deps, steps)) for (target, deps, steps) in rules)
+
+# These are the "phony" targets from the Makefile.
+aliases = {
+    'all': ['biz/biz_list.psv',
+            'biz/site_list.psv',
+            'biz/site_road_info.psv',
+            'biz/site_road_distances.csr',
+            'biz/site_road_distances_scaled.csr',
+            'roads/road_network.graph',
+            'areas/ba_site_list.psv',
+            'areas/ba_site_attributes.psv',
+            'areas/ba_site_distances.psv',
+            'areas/ba_site_labels.psv'],
+    'roads': ['roads/road_network.graph'],
+}
+
+
+def mtime(target):
+    """
+    Gets the modification time of a target, or None if it doesn't exist.
+    """
+    try:
+        return os.path.getmtime(os.path.join(msa_dir, target))
+    except OSError:
+        return None
+
+
+def run_stage(stage):
+    """
+    Runs one eero stage in this process, just as "eero <stage>" would run it in a new one.
+    """
+    fname = '%s/e_%s.py' % (eero_dir, stage)
+    runpy.run_path(fname, run_name='__main__')
+
+
+def make(target, done, dry_run=False):
+    """
+    Brings a target up to date, after first doing the same for everything it depends on.
+
+    :param target: target name, relative to the MSA directory
+    :param done: dictionary giving, for each target already dealt with in this run, whether it was
+        rebuilt
+    :param dry_run: if True, just print the steps that would be run
+    :return: True if the target was rebuilt (or, for a dry run, would be)
+    """
+    if target in done:
+        return done[target]
+    done[target] = False
+
+    if target not in rule_lookup:
+        if mtime(target) is None:
+            raise RuntimeError('No rule to make target "%s"' % target)
+        return False
+
+    (deps, steps) = rule_lookup[target]
+    rebuilt = [make(dep, done, dry_run) for dep in deps]
+
+    # The target is out of date if it is missing, or older than any of its dependencies, or if any
+    # of them was just rebuilt. (On a dry run, nothing is rebuilt, so the times alone don't show
+    # that the dependencies would be newer.)
+    t = mtime(target)
+    if t is not None and not any(rebuilt) and all(mtime(dep) is not None and mtime(dep) <= t for dep in deps):
+        return False
+
+    for step in steps:
+        if dry_run:
+            print('### Would run %s' % (step if isinstance(step, str) else step.__name__))
+        elif isinstance(step, str):
+            run_stage(step)
+        else:
+            step()
+    done[target] = True
+    return True
+
+
+parser = argparse.ArgumentParser(prog='eero run', description='Run eero pipeline stages in a single process')
+parser.add_argument('targets', nargs='*', default=['all'], help='targets to bring up to date (default "all")')
+parser.add_argument('-n', '--dry-run', action='store_true', help='just print the stages that would be run')
+args = parser.parse_args(sys.argv[1:])
+
+
+print('# Running eero pipeline for "%s"' % msa_dir)
+
+e_artifact_support.keep_artifacts = True
+done = {}
+for name in args.targets:
+    for target in aliases.get(name, [name]):
+        make(target, done, args.dry_run)
+e_artifact_support.forget_all()
+
+
+print
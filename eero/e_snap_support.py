@@ -0,0 +1,554 @@
+#
+# This file has support for "snapping" points (business sites) to the nearest point on the road
+# network.
+#
+# The road segments are kept as flat coordinate arrays, and broken into "pieces", the straight
+# lines between consecutive coordinates of a segment. To find candidate pieces for a batch of
+# points at once, every piece is sampled at regular intervals, and the sample points go in a k-d
+# tree. Any point on a piece is within half the sample spacing of one of its samples, so if the
+# nearest sample to a site is at distance d, the nearest piece is among those that have a sample
+# within d plus the sample spacing. The distance from each site to each of its candidate pieces
+# (and the nearest point on the piece) is then worked out with array operations.
+#
+# For a big MSA, the sites are split into square tiles, which are snapped in a pool of worker
+# processes. Each worker only gets the pieces that could be nearest to one of the sites in its
+# tile: the nearest road to a site is no further away than the nearest road vertex, so that gives
+# a margin around the tile. The pieces are found with the road segment spatial index, which holds
+# a box for each "chunk" of a few consecutive pieces rather than one for each whole segment, since
+# the box around a long, curvy road can cover a lot of ground that the road doesn't. The pieces are
+# kept in edge index order, and their distances along their segments are worked out beforehand, so
+# a tile gives just the same results as snapping against the whole road network.
+#
+
+
+import multiprocessing
+import numpy as np
+
+
+# Distance between samples along a piece of road [m].
+sample_spacing = 25.0
+
+# Number of sites snapped at a time; this bounds the memory used for site / piece pairs.
+chunk_size = 10000
+
+# Size of the tiles that the sites are split into for snapping in parallel [m].
+tile_size = 5000.0
+
+# Number of consecutive pieces of a segment that share a box in the road segment spatial index.
+chunk_pieces = 8
+
+# The road segment spatial index is built from the exact coordinates, but "road_segments.psv"
+# rounds them to the nearest metre, so the boxes looked up in the index are widened by this [m].
+index_slack = 1.0
+
+
+class RoadPieces(object):
+    """
+    A set of pieces of road segments. Piece i runs from (x0[i], y0[i]) to (x1[i], y1[i]) on the
+    segment for edge index piece_edge[i], starting at distance piece_along[i] along the segment;
+    the whole segment has length edge_length[i]. The pieces are in edge index order, and in order
+    along each segment.
+    """
+
+    def __init__(self, piece_edge, x0, y0, x1, y1, piece_along, edge_length):
+        self.piece_edge = piece_edge
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.piece_along = piece_along
+        self.edge_length = edge_length
+        self.piece_count = len(piece_edge)
+
+    def subset(self, pieces):
+        """
+        Gets some of the pieces, as another RoadPieces.
+
+        :param pieces: array of piece numbers, in increasing order
+        """
+        return RoadPieces(self.piece_edge[pieces], self.x0[pieces], self.y0[pieces], self.x1[pieces],
+                          self.y1[pieces], self.piece_along[pieces], self.edge_length[pieces])
+
+
+def piece_positions(start):
+    """
+    Finds the pieces of a set of road segments. There is a piece starting at every coordinate
+    except the last one of each segment, so a segment with fewer than two coordinates has no
+    pieces, and can't be snapped to.
+
+    :param start: array giving the position of the coordinates for each edge index, as for
+        "road_pieces"
+    :return: (array giving the position of the first coordinate of each piece, array giving the
+        edge index of each piece)
+    """
+    counts = np.diff(start)
+    is_piece = np.ones(start[-1], dtype=bool)
+    is_piece[start[1:][counts > 0] - 1] = False
+    k = np.flatnonzero(is_piece)
+    return (k, np.repeat(np.arange(len(counts)), counts)[k])
+
+
+def road_pieces(xx, yy, start):
+    """
+    Breaks all the road segments into pieces. The coordinates of the segment for edge index "eix"
+    are (xx[k], yy[k]) for k in start[eix]:start[eix+1].
+
+    :param xx: array of x coordinates of all road segments
+    :param yy: array of y coordinates of all road segments
+    :param start: array giving the position of the coordinates for each edge index
+    :return: RoadPieces
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    start = np.asarray(start, dtype=np.int64)
+    (k, piece_edge) = piece_positions(start)
+    if len(k) == 0:
+        raise ValueError('There are no road segments to snap to')
+    (x0, y0, x1, y1) = (xx[k], yy[k], xx[k + 1], yy[k + 1])
+
+    # Lengths of the pieces and segments.
+    dx = x1 - x0
+    dy = y1 - y0
+    piece_length = np.sqrt(dx * dx + dy * dy)
+    edge_length = np.bincount(piece_edge, weights=piece_length, minlength=len(start) - 1)
+
+    # The distance along its segment to the start of each piece. This is added up a piece at a time
+    # for all segments at once (the j'th pieces of all segments, then the j+1'th...).
+    rank = np.arange(len(k)) - np.searchsorted(piece_edge, piece_edge)
+    by_rank = np.argsort(rank, kind='mergesort')
+    rank_start = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2))
+    piece_along = np.zeros(len(k))
+    for j in range(1, len(rank_start) - 1):
+        i = by_rank[rank_start[j]:rank_start[j + 1]]
+        piece_along[i] = piece_along[i - 1] + piece_length[i - 1]
+
+    return RoadPieces(piece_edge, x0, y0, x1, y1, piece_along, edge_length[piece_edge])
+
+
+def road_chunks(start):
+    """
+    Groups the pieces of the road segments into "chunks" of up to "chunk_pieces" consecutive
+    pieces of the same segment. The chunks are what the road segment spatial index holds.
+
+    :param start: array giving the position of the coordinates for each edge index, as for
+        "road_pieces"
+    :return: (array giving the edge index of each chunk, array giving the number of the first piece
+        of each chunk, with the number of pieces tacked on the end)
+    """
+    start = np.asarray(start, dtype=np.int64)
+    piece_edge = piece_positions(start)[1]
+    rank = np.arange(len(piece_edge)) - np.searchsorted(piece_edge, piece_edge)
+    first = np.flatnonzero(rank % chunk_pieces == 0)
+    return (piece_edge[first], np.append(first, len(piece_edge)))
+
+
+def chunk_boxes(xx, yy, start):
+    """
+    Gets the bounding box of every chunk of the road segments (see "road_chunks"), for use with
+    "e_spatial_index_support.build_index".
+
+    :param xx: array of x coordinates of all road segments
+    :param yy: array of y coordinates of all road segments
+    :param start: array giving the position of the coordinates for each edge index, as for
+        "road_pieces"
+    :return: array with one row (x0, y0, x1, y1) per chunk
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    start = np.asarray(start, dtype=np.int64)
+    k = piece_positions(start)[0]
+    first = road_chunks(start)[1][:-1]
+    if len(first) == 0:
+        return np.zeros((0, 4))
+    (x0, y0, x1, y1) = (xx[k], yy[k], xx[k + 1], yy[k + 1])
+    return np.column_stack((np.minimum.reduceat(np.minimum(x0, x1), first),
+                            np.minimum.reduceat(np.minimum(y0, y1), first),
+                            np.maximum.reduceat(np.maximum(x0, x1), first),
+                            np.maximum.reduceat(np.maximum(y0, y1), first)))
+
+
+class SegmentStore(object):
+    """
+    A set of pieces of road segments, with a k-d tree for finding the ones near a point.
+    """
+
+    def __init__(self, pieces):
+        from scipy.spatial import cKDTree
+
+        self.piece_edge = pieces.piece_edge
+        self.x0 = pieces.x0
+        self.y0 = pieces.y0
+        self.x1 = pieces.x1
+        self.y1 = pieces.y1
+        self.piece_along = pieces.piece_along
+        self.edge_length = pieces.edge_length
+        self.piece_count = pieces.piece_count
+        dx = self.x1 - self.x0
+        dy = self.y1 - self.y0
+        self.piece_length = np.sqrt(dx * dx + dy * dy)
+
+        # Samples at the middle of "n" equal parts of each piece, with n chosen so that the parts
+        # are no longer than the sample spacing.
+        n = np.maximum(np.ceil(self.piece_length / sample_spacing), 1).astype(np.int64)
+        self.sample_piece = np.repeat(np.arange(self.piece_count), n)
+        j = np.arange(len(self.sample_piece)) - np.repeat(np.cumsum(n) - n, n)
+        t = (j + 0.5) / n[self.sample_piece]
+        sx = self.x0[self.sample_piece] + t * dx[self.sample_piece]
+        sy = self.y0[self.sample_piece] + t * dy[self.sample_piece]
+        self.sample_tree = cKDTree(np.column_stack((sx, sy)))
+        self.sample_count = len(self.sample_piece)
+
+    def candidates(self, px, py):
+        """
+        Finds the pieces that might be nearest to each of a set of points.
+
+        :param px: array of x coordinates
+        :param py: array of y coordinates
+        :return: (array of point numbers, array of piece numbers), giving all the candidate pairs
+        """
+        points = np.column_stack((px, py))
+        site_list = []
+        sample_list = []
+        radius = None
+
+        # Get the nearest k samples to each point. For the points where all k samples are within
+        # the search radius, there may be more, so look again with a bigger k.
+        todo = np.arange(len(points))
+        k = 16
+        while len(todo) > 0:
+            k = min(k, self.sample_count)
+            (dist, nearest) = self.sample_tree.query(points[todo], k=k)
+            dist = dist.reshape(len(todo), k)
+            nearest = nearest.reshape(len(todo), k)
+            if radius is None:
+                radius = dist[:, 0] + sample_spacing
+            keep = dist <= radius[todo][:, np.newaxis]
+            done = ~keep[:, -1] | (k == self.sample_count)
+            (rows, cols) = np.nonzero(keep[done])
+            site_list.append(todo[done][rows])
+            sample_list.append(nearest[done][rows, cols])
+            todo = todo[~done]
+            k *= 4
+
+        site = np.concatenate(site_list)
+        piece = self.sample_piece[np.concatenate(sample_list)]
+
+        # A piece with several samples in range only needs to be looked at once.
+        pair = np.unique(site * np.int64(self.piece_count) + piece)
+        return (pair // self.piece_count, pair % self.piece_count)
+
+    def snap(self, px, py):
+        """
+        Finds the nearest point on the road network to each of a set of points. Where two
+        segments are equally near (e.g. when the nearest point is an intersection), the one with
+        the lowest edge index is used.
+
+        :param px: array of x coordinates
+        :param py: array of y coordinates
+        :return: (edge index, distance to the segment, distance along the segment to the nearest
+            point, x and y of the nearest point, length of the segment), each an array with one
+            entry per point
+        """
+        px = np.asarray(px, dtype=np.float64)
+        py = np.asarray(py, dtype=np.float64)
+        (site, piece) = self.candidates(px, py)
+
+        # Project each point onto each of its candidate pieces.
+        x0 = self.x0[piece]
+        y0 = self.y0[piece]
+        dx = self.x1[piece] - x0
+        dy = self.y1[piece] - y0
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = ((px[site] - x0) * dx + (py[site] - y0) * dy) / length2
+        t[~(length2 > 0)] = 0.0
+        t = np.clip(t, 0.0, 1.0)
+
+        # Use the exact end coordinates, so that segments meeting at the nearest point give
+        # exactly the same distance.
+        nx = np.where(t >= 1.0, self.x1[piece], x0 + t * dx)
+        ny = np.where(t >= 1.0, self.y1[piece], y0 + t * dy)
+        dist = np.hypot(px[site] - nx, py[site] - ny)
+
+        # Pick the nearest piece for each point. Pieces are in edge index order, so ties go to the
+        # lowest edge index.
+        order = np.lexsort((piece, dist, site))
+        first = order[np.flatnonzero(np.diff(np.concatenate(([-1], site[order]))) != 0)]
+        best = piece[first]
+        along = self.piece_along[best] + t[first] * self.piece_length[best]
+        return (self.piece_edge[best], dist[first], along, nx[first], ny[first], self.edge_length[best])
+
+
+def snap_points(store, px, py):
+    """
+    Snaps a set of points to the road network, "chunk_size" points at a time (see
+    "SegmentStore.snap").
+
+    :param store: SegmentStore
+    :param px: array of x coordinates
+    :param py: array of y coordinates
+    :return: (edge index, distance to the segment, distance along the segment to the nearest
+        point, x and y of the nearest point, length of the segment), each an array with one entry
+        per point
+    """
+    n = len(px)
+    result = (np.zeros(n, dtype=np.int64), np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n))
+    for a in range(0, n, chunk_size):
+        b = min(a + chunk_size, n)
+        for (r, chunk) in zip(result, store.snap(px[a:b], py[a:b])):
+            r[a:b] = chunk
+    return result
+
+
+def snap_tile(task):
+    """
+    Snaps the sites in one tile. This is run in worker processes.
+
+    :param task: (site x, site y, RoadPieces near the tile)
+    :return: as for "snap_points"
+    """
+    (px, py, pieces) = task
+    return snap_points(SegmentStore(pieces), px, py)
+
+
+def snap_sites(xx, yy, start, px, py, processes=None, index=None):
+    """
+    Snaps a set of sites to the road network, splitting them into tiles that are snapped in a pool
+    of worker processes.
+
+    :param xx: array of x coordinates of all road segments
+    :param yy: array of y coordinates of all road segments
+    :param start: array giving the position of the coordinates for each edge index, as for
+        "road_pieces"
+    :param px: array of site x coordinates
+    :param py: array of site y coordinates
+    :param processes: number of worker processes (default: one per CPU)
+    :param index: spatial index of the chunks of the road segments, as made by "e_make_road_network"
+        (default: build one in memory)
+    :return: as for "snap_points"
+    """
+    from scipy.spatial import cKDTree
+    from e_spatial_index_support import build_index
+
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    start = np.asarray(start, dtype=np.int64)
+    px = np.asarray(px, dtype=np.float64)
+    py = np.asarray(py, dtype=np.float64)
+    site_count = len(px)
+    result = (np.zeros(site_count, dtype=np.int64), np.zeros(site_count), np.zeros(site_count),
+              np.zeros(site_count), np.zeros(site_count), np.zeros(site_count))
+    if site_count == 0:
+        return result
+
+    pieces = road_pieces(xx, yy, start)
+    chunk_start = road_chunks(start)[1]
+    if index is None:
+        index = build_index(chunk_boxes(xx, yy, start))
+
+    # How far each site might have to look for its nearest road.
+    counts = np.diff(start)
+    in_edge = np.repeat(counts > 1, counts)
+    vertex_tree = cKDTree(np.column_stack((xx[in_edge], yy[in_edge])))
+    reach = vertex_tree.query(np.column_stack((px, py)))[0] + 1.0
+
+    # Split the sites into tiles.
+    tx = np.floor((px - px.min()) / tile_size).astype(np.int64)
+    ty = np.floor((py - py.min()) / tile_size).astype(np.int64)
+    (tiles, tile_of_site) = np.unique(tx * (ty.max() + 1) + ty, return_inverse=True)
+    site_order = np.argsort(tile_of_site, kind='mergesort')
+    tile_start = np.zeros(len(tiles) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tile_of_site, minlength=len(tiles)), out=tile_start[1:])
+    tile_sites = [site_order[tile_start[t]:tile_start[t + 1]] for t in range(len(tiles))]
+
+    def make_task(t):
+        # Get the pieces of the chunks whose boxes reach the box around the tile's sites. They are
+        # kept in order, so that ties go the same way as when snapping against all the pieces.
+        sites = tile_sites[t]
+        box = ((px[sites] - reach[sites]).min() - index_slack, (py[sites] - reach[sites]).min() - index_slack,
+               (px[sites] + reach[sites]).max() + index_slack, (py[sites] + reach[sites]).max() + index_slack)
+        near = np.sort(np.fromiter(index.intersection(box), dtype=np.int64))
+        n = chunk_start[near + 1] - chunk_start[near]
+        near_pieces = np.arange(n.sum()) + np.repeat(chunk_start[near] - (np.cumsum(n) - n), n)
+        return (px[sites], py[sites], pieces.subset(near_pieces))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tiles))
+
+    tasks = (make_task(t) for t in range(len(tiles)))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.imap(snap_tile, tasks)
+            merge_tiles(results, tile_sites, result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        merge_tiles((snap_tile(task) for task in tasks), tile_sites, result)
+    return result
+
+
+def merge_tiles(results, tile_sites, result):
+    """
+    Copies the results for each tile into the results for all sites, in tile order. This is used
+    by "snap_sites".
+    """
+    done = 0
+    for (sites, tile_result) in zip(tile_sites, results):
+        for (r, tr) in zip(result, tile_result):
+            r[sites] = tr
+        if (done + len(sites)) // chunk_size > done // chunk_size or done + len(sites) == len(result[0]):
+            print('### Site %d / %d' % (done + len(sites), len(result[0])))
+        done += len(sites)
+
+
+def save_snap_state(fname, edge_ids, xx, yy, start, px, py, result):
+    """
+    Saves the results of snapping a set of sites, along with the road segments they were snapped
+    to, for "snap_sites_incremental" to use next time.
+    """
+    edge_ids = np.asarray(edge_ids)
+    try:
+        np.savez(fname, edge_ids=edge_ids, xx=xx, yy=yy, start=start, px=px, py=py,
+                 edge=result[0], dist=result[1], along=result[2], nx=result[3], ny=result[4],
+                 length=result[5])
+    except (IOError, OSError):
+        print('!!! Unable to save snapping results "%s"' % fname)
+
+
+def load_snap_state(fname):
+    """
+    Reads the results saved by "save_snap_state".
+
+    :return: dictionary of arrays, or None if there are no saved results
+    """
+    try:
+        with np.load(fname) as saved:
+            return dict((name, saved[name]) for name in saved.files)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def changed_edges(old, edge_ids, xx, yy, start):
+    """
+    Compares the road segments saved with earlier snapping results to the current ones.
+
+    :param old: saved state, from "load_snap_state"
+    :param edge_ids: list of current edge IDs, by edge index
+    :param xx: array of x coordinates of all road segments
+    :param yy: array of y coordinates of all road segments
+    :param start: array giving the position of the coordinates for each edge index
+    :return: (array giving the current edge index for each old edge index, or -1 if that edge has
+        gone or changed shape; boolean array marking the current edges that are new or have changed
+        shape)
+    """
+    lookup = dict((eid, eix) for (eix, eid) in enumerate(edge_ids))
+    old_to_new = np.array([lookup.get(eid, -1) for eid in old['edge_ids'].tolist()], dtype=np.int64)
+    old_counts = np.diff(old['start'])
+    counts = np.diff(start)
+
+    # Compare the coordinates of the edges that are still there and have the same number of them.
+    same = old_to_new >= 0
+    same[same] = old_counts[same] == counts[old_to_new[same]]
+    both = np.flatnonzero(same)
+    n = old_counts[both]
+    offsets = np.repeat(np.cumsum(n) - n, n)
+    k = np.arange(n.sum())
+    old_k = np.repeat(old['start'][both], n) + k - offsets
+    new_k = np.repeat(start[old_to_new[both]], n) + k - offsets
+    differs = (old['xx'][old_k] != xx[new_k]) | (old['yy'][old_k] != yy[new_k])
+    same[both] = np.bincount(np.repeat(np.arange(len(both)), n), weights=differs, minlength=len(both)) == 0
+
+    old_to_new[~same] = -1
+    changed = np.ones(len(counts), dtype=bool)
+    changed[old_to_new[same]] = False
+    return (old_to_new, changed)
+
+
+def snap_sites_incremental(fname, edge_ids, xx, yy, start, px, py, processes=None, index=None):
+    """
+    Snaps a set of sites to the road network, as "snap_sites" does, but re-using the results saved
+    from the last time wherever they still hold. A site is only snapped again if it is new or has
+    moved (sites are matched on their coordinates), if the segment it was snapped to has gone or
+    changed shape, or if a new or changed segment is at least as near to it. The results are the
+    same as from snapping all of the sites.
+
+    :param fname: name of the ".npz" file in which the results are kept
+    :param edge_ids: list of edge IDs, by edge index
+    :param xx: array of x coordinates of all road segments
+    :param yy: array of y coordinates of all road segments
+    :param start: array giving the position of the coordinates for each edge index, as for
+        "road_pieces"
+    :param px: array of site x coordinates
+    :param py: array of site y coordinates
+    :param processes: number of worker processes (default: one per CPU)
+    :param index: spatial index of the chunks of the road segments, as for "snap_sites"
+    :return: as for "snap_points"
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    start = np.asarray(start, dtype=np.int64)
+    px = np.asarray(px, dtype=np.float64)
+    py = np.asarray(py, dtype=np.float64)
+    site_count = len(px)
+
+    old = load_snap_state(fname)
+    if old is not None:
+        (old_to_new, changed) = changed_edges(old, edge_ids, xx, yy, start)
+
+        # Ties between equally near segments go to the lowest edge index, so the old results only
+        # hold if the edges that are still there are in the same order.
+        kept_edges = old_to_new[old_to_new >= 0]
+        if np.any(np.diff(kept_edges) < 0):
+            print('### The road edges have been re-ordered')
+            old = None
+
+    if old is None:
+        print('### Snapping all %d sites' % site_count)
+        result = snap_sites(xx, yy, start, px, py, processes, index)
+        save_snap_state(fname, edge_ids, xx, yy, start, px, py, result)
+        return result
+
+    # Match the sites to the old ones on their coordinates.
+    old_count = len(old['px'])
+    keys = np.concatenate((np.column_stack((old['px'], old['py'])), np.column_stack((px, py))))
+    (unique_keys, inverse) = np.unique(keys, axis=0, return_inverse=True)
+    old_site_for_key = np.full(len(unique_keys), -1, dtype=np.int64)
+    old_site_for_key[inverse[:old_count]] = np.arange(old_count)
+    old_site = old_site_for_key[inverse[old_count:]]
+
+    # Sites that haven't moved, and whose segment is still there, keep their old results unless
+    # a new or changed segment is at least as near.
+    moved = old_site < 0
+    lost = np.zeros(site_count, dtype=bool)
+    lost[~moved] = old_to_new[old['edge'][old_site[~moved]]] < 0
+    closer = np.zeros(site_count, dtype=bool)
+    kept = np.flatnonzero(~moved & ~lost)
+    if np.any(changed) and len(kept) > 0:
+        counts = np.diff(start)
+        near = np.flatnonzero(changed)
+        sub_start = np.zeros(len(near) + 1, dtype=np.int64)
+        np.cumsum(counts[near], out=sub_start[1:])
+        source = np.arange(sub_start[-1]) - np.repeat(sub_start[:-1] - start[near], counts[near])
+        if np.any(counts[near] > 1):
+            d = snap_sites(xx[source], yy[source], sub_start, px[kept], py[kept], processes)[1]
+            closer[kept] = d <= old['dist'][old_site[kept]]
+
+    redo = np.flatnonzero(moved | lost | closer)
+    print('### Snapping %d of %d sites (%d new or moved, %d on changed roads, %d near changed roads)' %
+          (len(redo), site_count, moved.sum(), lost.sum(), closer.sum()))
+
+    result = (np.zeros(site_count, dtype=np.int64), np.zeros(site_count), np.zeros(site_count),
+              np.zeros(site_count), np.zeros(site_count), np.zeros(site_count))
+    keep = np.flatnonzero(~(moved | lost | closer))
+    for (r, name) in zip(result, ['edge', 'dist', 'along', 'nx', 'ny', 'length']):
+        r[keep] = old[name][old_site[keep]]
+    result[0][keep] = old_to_new[result[0][keep]]
+    if len(redo) > 0:
+        for (r, rr) in zip(result, snap_sites(xx, yy, start, px[redo], py[redo], processes, index)):
+            r[redo] = rr
+
+    save_snap_state(fname, edge_ids, xx, yy, start, px, py, result)
+    return result
@@ -0,0 +1,97 @@
+#
+# This file has support for building and reusing R-tree spatial indexes.
+#
+# Inserting entries into an R-tree one at a time is slow, and gives a poorly packed tree. The
+# functions here bulk-load an index from all its bounding boxes at once (the "rtree" package's
+# stream loader, which packs the tree sort-tile-recursive style), either in memory or in a pair of
+# ".dat"/".idx" files next to the artifact being indexed. An index on disk has a ".key" file
+# recording the size and modification time of that artifact, so a later stage can just reopen the
+# index, and knows to rebuild it if the artifact has changed since.
+#
+
+
+import os
+import numpy as np
+from rtree import index
+from e_artifact_support import file_signature
+
+
+def point_boxes(xx, yy):
+    """
+    Gets the bounding boxes for a set of points, for use with "build_index".
+
+    :param xx: array of x coordinates
+    :param yy: array of y coordinates
+    :return: array with one row (x0, y0, x1, y1) per point
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    return np.column_stack((xx, yy, xx, yy))
+
+
+def remove_index(fname):
+    """
+    Removes the files for an index on disk, if they are there.
+    """
+    for ext in ['.dat', '.idx', '.key']:
+        try:
+            os.remove(fname + ext)
+        except OSError:
+            pass
+
+
+def build_index(boxes, fname=None, source_fname=None, objects=None):
+    """
+    Bulk-loads an R-tree. The index entries are the row numbers of the boxes.
+
+    :param boxes: array or list of (x0, y0, x1, y1) bounding boxes
+    :param fname: base name of the index files; if None, the index is only kept in memory
+    :param source_fname: name of the file that the index is for; if given, the index can be
+        reopened with "open_index" for as long as that file doesn't change
+    :param objects: optional list of objects to store with the entries; these come back from
+        queries made with "objects=True"
+    :return: rtree index
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if objects is None:
+        stream = ((i, tuple(box), None) for (i, box) in enumerate(boxes.tolist()))
+    else:
+        stream = ((i, tuple(box), obj) for (i, (box, obj)) in enumerate(zip(boxes.tolist(), objects)))
+
+    # The stream loader doesn't cope with an empty stream.
+    args = [] if len(boxes) == 0 else [stream]
+
+    if fname is None:
+        return index.Index(*args)
+
+    remove_index(fname)
+    idx = index.Index(fname, *args)
+    if source_fname is not None:
+        # The index must be flushed to disk before the key says it's good.
+        idx.close()
+        with open(fname + '.key', 'w') as outfile:
+            outfile.write(repr(file_signature(source_fname)))
+        idx = index.Index(fname)
+    return idx
+
+
+def open_index(fname, source_fname=None):
+    """
+    Reopens an index built by "build_index".
+
+    :param fname: base name of the index files
+    :param source_fname: name of the file that the index is for; if given, the index is only
+        used if that file hasn't changed since the index was built
+    :return: rtree index, or None if there's no usable index on disk
+    """
+    if not (os.path.isfile(fname + '.dat') and os.path.isfile(fname + '.idx')):
+        return None
+    if source_fname is not None:
+        try:
+            with open(fname + '.key') as infile:
+                key = infile.read()
+        except (IOError, OSError):
+            return None
+        if key != repr(file_signature(source_fname)):
+            return None
+    return index.Index(fname)
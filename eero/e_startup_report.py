@@ -0,0 +1,130 @@
+#
+# This script reports how long each eero stage takes to start up, i.e. how long its module-level
+# imports take in a fresh Python process. Usage:
+#
+#   eero startup-report [--budget SECONDS] [stage ...]
+#
+# The pipeline runs for hundreds of MSAs and some stages only take a few seconds, so the cost of
+# importing packages like shapely, fiona, sklearn and networkx adds up. Stages whose imports take
+# longer than the budget are flagged, and the exit status is non-zero if there are any, so this
+# can be used as a check. Imports done inside functions aren't counted, since they only cost
+# anything when the function is used.
+#
+
+
+import os
+import sys
+import ast
+import glob
+import json
+import argparse
+import subprocess
+
+
+eero_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# Modules that are not stages in their own right.
+non_stages = ['e_utils', 'e_smpc', 'e_run', 'e_startup_report', 'e_wrap_clusters_v0', 'e_subdivide_clusters',
+              'e_make_synthetic_msa']
+
+
+# This is run in a fresh process for each stage. It runs the import statements one at a time and
+# reports how long each one took; an import that fails is reported with a time of None.
+timing_script = '''
+import sys
+import json
+import time
+sys.path.insert(0, sys.argv[1])
+statements = json.loads(sys.argv[2])
+namespace = {}
+result = []
+for stmt in statements:
+    t0 = time.time()
+    try:
+        exec(stmt, namespace)
+        result.append((stmt, time.time() - t0))
+    except Exception:
+        result.append((stmt, None))
+print(json.dumps(result))
+'''
+
+
+def get_stage_list():
+    """
+    Gets the names of all the eero stages, e.g. "prep_biz_list".
+    """
+    stage_list = []
+    for fname in sorted(glob.glob('%s/e_*.py' % eero_dir)):
+        module = os.path.splitext(os.path.basename(fname))[0]
+        if module in non_stages or module.endswith('_support'):
+            continue
+        stage_list.append(module[2:])
+    return stage_list
+
+
+def get_import_statements(fname):
+    """
+    Gets the module-level import statements of a script, as source code.
+
+    :param fname: name of the script
+    :return: list of strings, e.g. ["import os", "from e_utils import psvarray"]
+    """
+    with open(fname) as infile:
+        tree = ast.parse(infile.read(), fname)
+
+    def name_list(names):
+        return ', '.join([a.name if a.asname is None else '%s as %s' % (a.name, a.asname) for a in names])
+
+    statements = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            statements.append('import %s' % name_list(node.names))
+        elif isinstance(node, ast.ImportFrom):
+            module = '.' * (node.level or 0) + (node.module or '')
+            statements.append('from %s import %s' % (module, name_list(node.names)))
+    return statements
+
+
+def time_imports(stage):
+    """
+    Times the module-level imports of a stage in a fresh Python process.
+
+    :param stage: stage name
+    :return: list of (statement, seconds) pairs; seconds is None if the import failed
+    """
+    statements = get_import_statements('%s/e_%s.py' % (eero_dir, stage))
+    output = subprocess.check_output([sys.executable, '-c', timing_script, eero_dir, json.dumps(statements)],
+                                     cwd=eero_dir)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+parser = argparse.ArgumentParser(prog='eero startup-report', description='Measure import time for eero stages')
+parser.add_argument('stages', nargs='*', help='stages to measure (default: all of them)')
+parser.add_argument('--budget', type=float, default=1.0, help='flag stages whose imports take longer than this [s]')
+parser.add_argument('--top', type=int, default=3, help='number of slowest imports to list for each stage')
+args = parser.parse_args(sys.argv[1:])
+
+
+print('# Measuring start-up time for eero stages (budget %.2f s)' % args.budget)
+
+over_budget = []
+for stage in args.stages or get_stage_list():
+    timings = time_imports(stage)
+    total = sum([t for (stmt, t) in timings if t is not None])
+    flag = 'OVER' if total > args.budget else 'ok'
+    if total > args.budget:
+        over_budget.append(stage)
+    print('## %-32s %7.3f s  %s' % (stage, total, flag))
+    for (stmt, t) in sorted([x for x in timings if x[1] is not None], key=lambda x: -x[1])[:args.top]:
+        print('###     %7.3f s  %s' % (t, stmt))
+    for (stmt, t) in timings:
+        if t is None:
+            print('###     (failed)   %s' % stmt)
+
+if over_budget:
+    print('## %d stage(s) over budget: %s' % (len(over_budget), ', '.join(over_budget)))
+    sys.exit(1)
+
+
+print
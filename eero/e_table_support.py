@@ -0,0 +1,263 @@
+#
+# This file has functions supporting typed reading and writing of the PSV tables that the
+# eero stages pass to one another.
+#
+# Reading a PSV file with "csv.DictReader" gives one dictionary per row, with every value
+# kept as a string. For the big tables (site lists, site road info and so on) that is slow
+# to build and slower still to use, since the scripts then call "float()" on the same fields
+# over and over. The functions here read a table once into a numpy structured array, using a
+# schema that says what type each column has. The array is saved in a binary "sidecar" file
+# next to the source table; later reads of an unchanged table just memory-map the sidecar.
+#
+
+
+import os
+import csv
+import numpy as np
+from e_artifact_support import remember
+from e_artifact_support import recall
+
+
+# Column types (and output formats) for the pipeline tables, indexed by the base name of the
+# table file. Column types are numpy type codes; 'S' means a string column, whose width is
+# determined from the data. A column named '*' gives the type for any column not otherwise
+# listed -- this is for tables like "ba_site_attributes" that have a variable set of columns.
+# The formats are the ones the eero scripts use when they write these tables.
+site_columns = [('siteId', 'S', '%s'),
+                ('lon', 'f8', '%.6f'),
+                ('lat', 'f8', '%.6f'),
+                ('xx', 'f8', '%.0f'),
+                ('yy', 'f8', '%.0f')]
+
+table_schemas = {
+    'biz_list': [('pid', 'S', '%s'),
+                 ('lon', 'f8', '%.6f'),
+                 ('lat', 'f8', '%.6f'),
+                 ('gclon', 'f8', '%.6f'),
+                 ('gclat', 'f8', '%.6f')],
+    'site_list': site_columns,
+    'ba_site_list': site_columns,
+    'site_road_info': site_columns + [('segId', 'S', '%s'),
+                                      ('segDistance', 'f8', '%.1f'),
+                                      ('segAlong', 'f8', '%.1f'),
+                                      ('segLength', 'f8', '%.1f'),
+                                      ('segxx', 'f8', '%.1f'),
+                                      ('segyy', 'f8', '%.1f')],
+    'biz_site_lookup': [('siteId', 'S', '%s'),
+                        ('bizId', 'S', '%s')],
+    'site_density': [('siteId', 'S', '%s'),
+                     ('lon', 'f8', '%.6f'),
+                     ('lat', 'f8', '%.6f'),
+                     ('density', 'f8', '%.1f')],
+    'ba_site_attributes': [('siteId', 'S', '%s'),
+                           ('lon', 'f8', '%.6f'),
+                           ('lat', 'f8', '%.6f'),
+                           ('*', 'f8', '%.4f')],
+    'ba_site_distances': [('siteId0', 'S', '%s'),
+                          ('siteId1', 'S', '%s'),
+                          ('distance', 'f8', '%.0f')],
+    'ba_clusters': [('siteId', 'S', '%s'),
+                    ('lon', 'f8', '%.6f'),
+                    ('lat', 'f8', '%.6f'),
+                    ('label', 'S', '%s')],
+    'road_edges': [('edge_id', 'S', '%s'),
+                   ('road_class', 'S', '%s'),
+                   ('length', 'f8', '%.0f')],
+    'road_segments': [('edge_id', 'S', '%s'),
+                      ('node_id', 'i8', '%d'),
+                      ('lon', 'f8', '%s'),
+                      ('lat', 'f8', '%s'),
+                      ('xx', 'f8', '%.0f'),
+                      ('yy', 'f8', '%.0f')],
+}
+
+
+def get_table_schema(fname):
+    """
+    Gets the schema for a pipeline table, based on the name of the file.
+
+    :param fname: name of the table file, e.g. ".../biz/site_list.psv"
+    :return: list of (column, type, format) tuples, or None if the table is not one we know about
+    """
+    table = os.path.splitext(os.path.basename(fname))[0]
+    return table_schemas.get(table)
+
+
+def column_types(schema, fieldnames):
+    """
+    Matches up a schema with the columns actually present in a table.
+
+    :param schema: list of (column, type, format) tuples
+    :param fieldnames: column names from the header of the table
+    :return: list of (column, type, format) tuples, in the order of the table columns
+    """
+    lookup = {}
+    for (name, type_code, fmt) in schema:
+        lookup[name] = (name, type_code, fmt)
+
+    columns = []
+    for name in fieldnames:
+        if name in lookup:
+            columns.append(lookup[name])
+        elif '*' in lookup:
+            columns.append((name, lookup['*'][1], lookup['*'][2]))
+        else:
+            # Anything that the schema doesn't mention is kept as a string.
+            columns.append((name, 'S', '%s'))
+    return columns
+
+
+def parse_table(fname, schema):
+    """
+    Reads a PSV file into a numpy structured array, without any caching.
+
+    :param fname: name of the input file
+    :param schema: list of (column, type, format) tuples
+    :return: numpy structured array with one element per row
+    """
+    with open(fname) as infile:
+        reader = csv.reader(infile, delimiter='|')
+        fieldnames = next(reader)
+        columns = column_types(schema, fieldnames)
+        values = [[] for c in columns]
+        for rec in reader:
+            for i in range(len(columns)):
+                values[i].append(rec[i])
+
+    dtype = []
+    arrays = []
+    for i in range(len(columns)):
+        (name, type_code, fmt) = columns[i]
+        if type_code == 'S':
+            # Empty tables still need a non-zero string width.
+            width = max([len(v) for v in values[i]] + [1])
+            arrays.append(np.array(values[i], dtype='S%d' % width))
+            dtype.append((name, 'S%d' % width))
+        elif type_code.startswith('f'):
+            # Blank numeric fields (e.g. missing geocoded coordinates) become NaN.
+            arrays.append(np.array([float(v) if v != '' else np.nan for v in values[i]], dtype=type_code))
+            dtype.append((name, type_code))
+        else:
+            arrays.append(np.array([int(v) for v in values[i]], dtype=type_code))
+            dtype.append((name, type_code))
+
+    table = np.empty(len(values[0]) if values else 0, dtype=dtype)
+    for i in range(len(columns)):
+        table[columns[i][0]] = arrays[i]
+    return table
+
+
+def cache_key(fname, schema):
+    """
+    Gets the string that identifies a particular version of a table file. The binary sidecar
+    for a table is only used if the key stored with it matches this one.
+    """
+    st = os.stat(fname)
+    return '%s|%d|%r|%r' % (os.path.abspath(fname), st.st_size, st.st_mtime, schema)
+
+
+def load_table(fname, schema=None, cache=True):
+    """
+    Reads a pipeline table into a numpy structured array.
+
+    The first time a table is read, it is parsed from the PSV file and saved as a ".cache.npy"
+    sidecar file next to it, along with a ".cache.key" file recording the source path, size and
+    modification time. Later reads of an unchanged table memory-map the sidecar, which is very
+    fast even for big tables. Note that the table is read-only either way; use "np.array()"
+    on it to get a private, writable copy.
+
+    :param fname: name of the input file
+    :param schema: list of (column, type, format) tuples; if None, look it up based on the file name
+    :param cache: if False, don't read or write the sidecar files
+    :return: numpy structured array with one element per row
+    """
+    if schema is None:
+        schema = get_table_schema(fname)
+        if schema is None:
+            schema = []
+
+    if not cache:
+        return parse_table(fname, schema)
+
+    cache_fname = fname + '.cache.npy'
+    key_fname = fname + '.cache.key'
+    key = cache_key(fname, schema)
+
+    # A table that was already loaded in this process (see "e_artifact_support") is used as is.
+    remembered = recall(fname)
+    if remembered is not None and remembered[0] == key:
+        return remembered[1]
+
+    # Use the sidecar if it is there and is up to date.
+    try:
+        with open(key_fname) as infile:
+            cached_key = infile.read()
+        if cached_key == key:
+            table = np.load(cache_fname, mmap_mode='r')
+            remember(fname, (key, table))
+            return table
+    except (IOError, OSError, ValueError):
+        pass
+
+    table = parse_table(fname, schema)
+    table.flags.writeable = False
+    remember(fname, (key, table))
+
+    # Save the sidecar. If the directory isn't writable or something, just carry on without it.
+    # The key file is written last, so a half-written sidecar never gets used.
+    try:
+        tmp_fname = cache_fname + '.tmp'
+        with open(tmp_fname, 'wb') as outfile:
+            np.save(outfile, table)
+        os.rename(tmp_fname, cache_fname)
+        with open(key_fname, 'w') as outfile:
+            outfile.write(key)
+    except (IOError, OSError):
+        print('!!! Unable to write table cache "%s"' % cache_fname)
+
+    return table
+
+
+def format_row(table, i, columns):
+    """
+    Gets one row of a structured array as a dictionary of strings, formatted for output.
+
+    :param table: numpy structured array
+    :param i: row index
+    :param columns: list of (column, type, format) tuples
+    :return: dictionary indexed by column name
+    """
+    row = table[i]
+    rec = {}
+    for (name, type_code, fmt) in columns:
+        v = row[name]
+        if type_code == 'S':
+            rec[name] = v
+        elif type_code.startswith('f') and np.isnan(v):
+            rec[name] = ''
+        else:
+            rec[name] = fmt % v
+    return rec
+
+
+def save_table(fname, table, schema=None):
+    """
+    Writes a numpy structured array as a PSV file, formatting the values the same way the
+    eero scripts do.
+
+    :param fname: name of the output file
+    :param table: numpy structured array
+    :param schema: list of (column, type, format) tuples; if None, look it up based on the file name
+    """
+    if schema is None:
+        schema = get_table_schema(fname)
+        if schema is None:
+            schema = []
+
+    fieldnames = list(table.dtype.names)
+    columns = column_types(schema, fieldnames)
+    with open(fname, 'w') as outfile:
+        writer = csv.DictWriter(outfile, delimiter='|', fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(len(table)):
+            writer.writerow(format_row(table, i, columns))
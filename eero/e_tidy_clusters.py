@@ -7,19 +7,24 @@ import shapely.geometry
 import shapely.ops
 from shapely.topology import TopologicalError
 from shapely.predicates import PredicateError
-import csv
 import fiona
-from rtree import index
+from e_spatial_index_support import build_index
+from e_spatial_index_support import point_boxes
+from e_export_support import layer_name
+from e_export_support import write_layer
 import os
 import os.path
-from e_utils import get_remap_function
+from e_utils import get_projector
+from e_utils import psvarray
 from e_utils import remap_feature
 from e_gis_support import outer_ring
 from copy import copy
 from copy import deepcopy
+from e_metrics_support import StageMetrics
 
 
 print('# Tidying up business areas.')
+metrics = StageMetrics('tidy_clusters')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -35,34 +40,20 @@ meta_dir = '%s/meta' % msa_dir
 min_viable_size = 2
 
 # For remapping coordinates.
-remap = get_remap_function()
-
-
-# This is used below to re-map coordinates from the local system back to WGS84.
-def towgs(xx, yy, zz=None):
-    return remap(xx, yy, inverse=True)
-
-
-# This will be an index for all business points. The index gives the BA label of the point.
-point_index = index.Index()
+projector = get_projector()
 
 
 fname = '%s/ba_clusters.psv' % area_dir
 print('## Reading business area point labels from "%s"' % fname)
+metrics.input(fname)
 ba_points = {}
 ba_bounds = {}
 site_count_for_label = {}
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid = rec['siteId']
-        label = rec['label']
-        lon = float(rec['lon'])
-        lat = float(rec['lat'])
-        (xx, yy) = remap(lon, lat)
+ba_clusters = psvarray(fname)
+(xx_list, yy_list) = projector.forward(ba_clusters['lon'], ba_clusters['lat'])
 
-        # Insert this point into our spatial index for all points.
-        point_index.insert(0, (xx, yy, xx, yy), label)
+# This is an index for all business points. The index gives the BA label of the point.
+point_index = build_index(point_boxes(xx_list, yy_list), objects=ba_clusters['label'].tolist())
 
 
 # Read all business area polygons. While we're at it, unroll all multipolygons into single
@@ -71,11 +62,12 @@ with open(fname) as infile:
 poly_list = {}
 idn = 0
 
-fname = area_dir + '/s_ba_ortho.shp'
+fname = layer_name(area_dir + '/s_ba_ortho')
 print('## Reading business area shapes from "%s"' % fname)
+metrics.input(fname)
 with fiona.open(fname) as source:
     for f0 in source:
-        f1 = remap_feature(f0, remap)
+        f1 = remap_feature(f0, projector)
         s1 = shapely.geometry.shape(f1['geometry'])
         if s1.geom_type == 'Polygon':
             idn += 1
@@ -88,25 +80,16 @@ with fiona.open(fname) as source:
 
 
 # Write the file containing the unrolled polygons.
-# crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-# driver = 'ESRI Shapefile'
-# outfile = area_dir + '/s_ba_polys.shp'
+# outfile = layer_name(area_dir + '/s_ba_polys')
 # print('## Writing business area shapes to "%s"' % outfile)
 # schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-# with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-#     for label in poly_list:
-#         shape = shapely.ops.transform(towgs, poly_list[label])
-#         outFeature = {
-#             'geometry': shapely.geometry.mapping(shape),
-#             'properties': {'label': label}}
-#         dest.write(outFeature)
+# label_list = list(poly_list.keys())
+# write_layer(outfile, [poly_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
 # Make a spatial index for the polygons.
-poly_index = index.Index()
-for label in poly_list:
-    bb = poly_list[label].bounds
-    poly_index.insert(0, poly_list[label].bounds, label)
+poly_labels = list(poly_list.keys())
+poly_index = build_index([poly_list[label].bounds for label in poly_labels], objects=poly_labels)
 
 
 # A post-processing step. We sometimes get shapes that have a hole that contains
@@ -124,7 +107,10 @@ for label0 in poly_list:
     if len(bb) != 4:
         continue
 
-    nearby = poly_index.intersection(bb, objects=True)
+    # Go through the candidates in the order the polygons were put in the index (the entry IDs are
+    # their positions in "poly_labels"). The loop changes "poly_list" as it goes, so the result
+    # depends on the order, and the order the index returns them in depends on how it was built.
+    nearby = sorted(poly_index.intersection(bb, objects=True), key=lambda z: z.id)
     for zz in nearby:
 
         label1 = zz.object
@@ -196,20 +182,21 @@ poly_list = new_poly_list
 # Specifically we will need to know whether a BA falls entirely within a residential area.
 # The easiest way to do this is to store and index the tapestry polygons that do NOT
 # correspond to residential areas.
-tap_index = index.Index()
 tap_shape_list = {}
 fname = '%s/tapestry.shp' % meta_dir
 if os.path.isfile(fname):
     print('## Reading tapestry information from "%s"' % fname)
+    metrics.input(fname)
     with fiona.open(fname) as source:
         for f0 in source:
             if f0['properties']['type'] == 'countHousing':
                 continue
             s0 = shapely.geometry.geo.shape(f0['geometry'])
-            s1 = shapely.ops.transform(remap, s0)
+            s1 = projector.transform_geometry(s0)
             id = f0['properties']['id']
-            tap_index.insert(0, s1.bounds, id)
             tap_shape_list[id] = s1
+tap_ids = list(tap_shape_list.keys())
+tap_index = build_index([tap_shape_list[id].bounds for id in tap_ids], objects=tap_ids)
 
 
 # Get rid of any polygons that have less than the minimum number of points.
@@ -242,18 +229,13 @@ for label in tbr:
 
 
 
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
-outfile = area_dir + '/s_ba_shapes.shp'
+# The shapes are in the local system; "write_layer" re-maps them back to WGS84.
+outfile = layer_name(area_dir + '/s_ba_shapes')
 print('## Writing business area shapes to "%s"' % outfile)
+metrics.output(outfile)
 schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for label in poly_list:
-
-        shape = shapely.ops.transform(towgs, poly_list[label])
-        outFeature = {
-            'geometry': shapely.geometry.mapping(shape),
-            'properties': {'label': label}}
-        dest.write(outFeature)
+label_list = list(poly_list.keys())
+write_layer(outfile, [poly_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
+metrics.finish()
@@ -1,12 +1,12 @@
 #
 # This file is part of the "eero" package. It provides some simple utilities 
 
-import shapely.geometry
-import shapely.ops
+# Most of the eero scripts use this file just for reading tables, so shapely, fiona and pyproj are
+# only imported by the functions that need them.
 import csv
 import os
-import pyproj
-import fiona
+import numpy as np
+from e_table_support import load_table
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -25,6 +25,9 @@ def get_msa_shape(projected=False, msa_name=None):
     :param projected: If True, then return the shape in projected coordinates
     :return: A "shape" (in the sense of the "shapely" package.
     """
+    import fiona
+    import shapely.geometry
+
     if msa_name is None:
         fname = meta_dir + '/bounds.shp'
     else:
@@ -36,8 +39,7 @@ def get_msa_shape(projected=False, msa_name=None):
     s = shapely.geometry.geo.shape(f['geometry'])
 
     if projected == True:
-        remap = get_remap_function(msa_name)
-        s = shapely.ops.transform(remap, s)
+        s = get_projector(msa_name).transform_geometry(s)
 
     return s
 
@@ -59,26 +61,186 @@ def get_projection_string(msa_name=None):
     return p
 
 
+class Projector(object):
+    """
+    Re-maps coordinates between WGS84 and the local Coordinate Reference System (CRS) of an MSA.
+
+    A projector can be called just like a "pyproj.Proj" object, i.e. "(x, y) = projector(lon, lat)"
+    and "(lon, lat) = projector(x, y, inverse=True)", so it can be handed to code that expects one.
+    But the point of it is to re-map a whole batch of coordinates in one call: "forward" and
+    "inverse" take and return numpy arrays, and "transform_geometry" re-maps all the coordinates
+    of a shapely shape at once, rather than calling back into Python for every vertex the way
+    "shapely.ops.transform" does.
+    """
+
+    def __init__(self, projection_string):
+        import pyproj
+
+        self.projection_string = projection_string
+        self.proj = pyproj.Proj(projection_string)
+
+        # Newer versions of pyproj have "Transformer" objects, which keep the PROJ pipeline around
+        # between calls. These give exactly the same results as the "Proj" object, since both sides
+        # use the same ellipsoid and there is no datum shift. Older versions just use the "Proj".
+        self.forward_transformer = None
+        self.inverse_transformer = None
+        if hasattr(pyproj, 'Transformer') and hasattr(self.proj, 'crs'):
+            crs = self.proj.crs
+            self.forward_transformer = pyproj.Transformer.from_crs(crs.geodetic_crs, crs, always_xy=True)
+            self.inverse_transformer = pyproj.Transformer.from_crs(crs, crs.geodetic_crs, always_xy=True)
+
+    def __call__(self, x, y, inverse=False):
+        if inverse:
+            if self.inverse_transformer is None:
+                return self.proj(x, y, inverse=True)
+            return self.inverse_transformer.transform(x, y)
+        else:
+            if self.forward_transformer is None:
+                return self.proj(x, y)
+            return self.forward_transformer.transform(x, y)
+
+    def forward(self, lon, lat):
+        """
+        Re-maps arrays of WGS84 coordinates to the local CRS.
+
+        :param lon: array of longitudes
+        :param lat: array of latitudes
+        :return: (array of x, array of y)
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        if lon.size == 0:
+            # Some versions of pyproj don't accept empty arrays.
+            return lon.copy(), lat.copy()
+        (x, y) = self(lon, lat)
+        return np.asarray(x), np.asarray(y)
+
+    def inverse(self, x, y):
+        """
+        Re-maps arrays of local coordinates back to WGS84.
+
+        :param x: array of x coordinates
+        :param y: array of y coordinates
+        :return: (array of longitudes, array of latitudes)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.size == 0:
+            return x.copy(), y.copy()
+        (lon, lat) = self(x, y, inverse=True)
+        return np.asarray(lon), np.asarray(lat)
+
+    def transform_geometry(self, s, inverse=False):
+        """
+        Re-maps a shapely shape. This gives the same result as "shapely.ops.transform(projector, s)",
+        but gathers the coordinates of all the parts of the shape into one array and re-maps them
+        in a single call.
+
+        :param s: A "shape" (in the sense of the "shapely" package)
+        :param inverse: If True, re-map from the local CRS back to WGS84
+        :return: A new shape
+        """
+        if s.is_empty:
+            return s
+
+        coord_list = []
+        gather_coords(s, coord_list)
+        coords = np.concatenate(coord_list)
+        (x, y) = self(coords[:, 0], coords[:, 1], inverse=inverse)
+        coords = np.column_stack((x, y))
+
+        # Hand the re-mapped coordinates back out, in the same order that they were gathered.
+        parts = []
+        k = 0
+        for cc in coord_list:
+            parts.append(coords[k:k + len(cc)])
+            k += len(cc)
+        return rebuild_shape(s, iter(parts))
+
+
+def gather_coords(s, coord_list):
+    """
+    Appends the coordinate arrays for all the parts of a shape to a list; this is used by
+    "Projector.transform_geometry".
+    """
+    if s.is_empty:
+        return
+    if s.geom_type in ('Point', 'LineString', 'LinearRing'):
+        coord_list.append(np.asarray(s.coords)[:, 0:2])
+    elif s.geom_type == 'Polygon':
+        coord_list.append(np.asarray(s.exterior.coords)[:, 0:2])
+        for ring in s.interiors:
+            coord_list.append(np.asarray(ring.coords)[:, 0:2])
+    else:
+        for part in s.geoms:
+            gather_coords(part, coord_list)
+
+
+def rebuild_shape(s, parts):
+    """
+    Builds a copy of a shape using new coordinate arrays, taken in the order that "gather_coords"
+    produced them.
+    """
+    import shapely.geometry
+
+    if s.is_empty:
+        return s
+    if s.geom_type == 'Point':
+        return shapely.geometry.Point(next(parts)[0])
+    elif s.geom_type == 'LineString':
+        return shapely.geometry.LineString(next(parts))
+    elif s.geom_type == 'LinearRing':
+        return shapely.geometry.LinearRing(next(parts))
+    elif s.geom_type == 'Polygon':
+        exterior = next(parts)
+        interiors = [next(parts) for ring in s.interiors]
+        return shapely.geometry.Polygon(exterior, interiors)
+    else:
+        geoms = [rebuild_shape(part, parts) for part in s.geoms]
+        if s.geom_type == 'GeometryCollection':
+            return shapely.geometry.GeometryCollection(geoms)
+        return type(s)(geoms)
+
+
+# Projectors are cached by MSA name, so that each script only sets up the projection once.
+projector_cache = {}
+
+
+def get_projector(msa_name=None):
+    """
+    This function gets the projector for an MSA, which re-maps coordinates between WGS84 and the
+    local Coordinate Reference System (CRS). See "Projector".
+
+    :return: A "Projector" object.
+    """
+    if msa_name not in projector_cache:
+        projector_cache[msa_name] = Projector(get_projection_string(msa_name))
+    return projector_cache[msa_name]
+
+
 def get_remap_function(msa_name=None):
     """
     This function gets a function that re-maps coordinates between WGS84 and the local Coordinate
-    Reference System (CRS). This is basically a function from the "pyproj" library.
+    Reference System (CRS). This used to be a "pyproj.Proj" object; it is now the MSA's projector,
+    which can be called in the same way.
 
     :return: A function that re-maps coordinates.
     """
-
-    p = get_projection_string(msa_name)
-    remap = pyproj.Proj(p)
-    return remap
+    return get_projector(msa_name)
 
 
 def remap_feature(f0, remap):
+    import shapely.geometry
+    import shapely.ops
 
     # Make the feature in to a shape.
     s0 = shapely.geometry.geo.shape(f0['geometry'])
 
-    # Apply the remapping function to the shape
-    s1 = shapely.ops.transform(remap, s0)
+    # Apply the remapping function to the shape. Projectors can do the whole shape at once.
+    if isinstance(remap, Projector):
+        s1 = remap.transform_geometry(s0)
+    else:
+        s1 = shapely.ops.transform(remap, s0)
 
     # Build the new feature.
     f1 = {'geometry': shapely.geometry.mapping(s1),
@@ -118,6 +280,21 @@ def psvin(fname, key=None, filter=None):
     return rec_list
 
 
+def psvarray(fname, schema=None, cache=True):
+    """
+    This is the typed counterpart of "psvin". Rather than one dictionary of strings per row,
+    it returns the whole table as a numpy structured array, with column types given by a
+    schema for each pipeline table (see "e_table_support"). A binary copy of the table is
+    cached next to the PSV file, so that re-reading an unchanged table is nearly free.
+
+    :param fname: name of the input file
+    :param schema: list of (column, type, format) tuples; if None, look it up based on the file name
+    :param cache: if False, don't use the binary cache
+    :return: numpy structured array containing file rows
+    """
+    return load_table(fname, schema=schema, cache=cache)
+
+
 def plist(x, limit=20):
     """
     Print the contents of a list.
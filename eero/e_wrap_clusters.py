@@ -8,17 +8,21 @@ import shapely.geometry
 import shapely.ops
 from shapely.topology import TopologicalError
 from shapely.predicates import PredicateError
-import csv
 import fiona
-from rtree import index
+from e_spatial_index_support import build_index
+from e_export_support import layer_name
+from e_export_support import write_layer
 import os
-from e_utils import get_remap_function
+from e_utils import get_projector
+from e_utils import psvarray
 from e_gis_support import vpsplit
 from e_gis_support import ortho_merge
 from e_gis_support import poly_merge
+from e_metrics_support import StageMetrics
 
 
 print('# Wrapping business areas.')
+metrics = StageMetrics('wrap_clusters')
 
 
 msa_base = os.environ.get('MSA_BASE')
@@ -38,47 +42,36 @@ erosion_factor = -249.0
 trim_factor = 0.0
 
 # For remapping coordinates.
-remap = get_remap_function()
+projector = get_projector()
 
 
-# This will be an index for all business points. The index gives the BA label of the point.
-point_index = index.Index()
-
 # from e_gis_support import ortho_merge
 fname = '%s/ba_clusters.psv' % area_dir
 print('## Reading business area point labels from "%s"' % fname)
+metrics.input(fname)
 ba_points = {}
 ba_bounds = {}
 site_count_for_label = {}
-with open(fname) as infile:
-    reader = csv.DictReader(infile, delimiter='|')
-    for rec in reader:
-        sid = rec['siteId']
-        label = rec['label']
-        lon = float(rec['lon'])
-        lat = float(rec['lat'])
-        (xx, yy) = remap(lon, lat)
-
-        # Insert this point into our spatial index for all points.
-        point_index.insert(0, (xx, yy, xx, yy), label)
-
-        # Add this coordinate pair to the list for this site. Also expand the bounds given the new coords.
-        if label not in ba_points:
-            ba_points[label] = []
-            ba_bounds[label] = (xx, yy, xx, yy)
-        ba_points[label].append((xx, yy))
-        x0 = min(xx, ba_bounds[label][0])
-        y0 = min(yy, ba_bounds[label][1])
-        x1 = max(xx, ba_bounds[label][2])
-        y1 = max(yy, ba_bounds[label][3])
-        ba_bounds[label] = (x0, y0, x1, y1)
+ba_clusters = psvarray(fname)
+(xx_list, yy_list) = projector.forward(ba_clusters['lon'], ba_clusters['lat'])
+for (label, xx, yy) in zip(ba_clusters['label'].tolist(), xx_list.tolist(), yy_list.tolist()):
+
+    # Add this coordinate pair to the list for this site. Also expand the bounds given the new coords.
+    if label not in ba_points:
+        ba_points[label] = []
+        ba_bounds[label] = (xx, yy, xx, yy)
+    ba_points[label].append((xx, yy))
+    x0 = min(xx, ba_bounds[label][0])
+    y0 = min(yy, ba_bounds[label][1])
+    x1 = max(xx, ba_bounds[label][2])
+    y1 = max(yy, ba_bounds[label][3])
+    ba_bounds[label] = (x0, y0, x1, y1)
 
 
 # Make a set of polygons representing a closing of the point cloud for each BA.
 print('## Closing point clouds')
 blob_list = {}
 glob_list = {}
-blob_index = index.Index()
 k = 0
 for label in ba_points:
 
@@ -92,7 +85,8 @@ for label in ba_points:
     s2 = s1.buffer(erosion_factor)
     glob_list[label] = s1
     blob_list[label] = s2
-    blob_index.insert(0, s2.bounds, label)
+blob_labels = list(blob_list.keys())
+blob_index = build_index([blob_list[label].bounds for label in blob_labels], objects=blob_labels)
 
 
 # Go through all parcels. For each one, find any blob that it intersects, and add it to the
@@ -100,6 +94,7 @@ for label in ba_points:
 print('## Finding all parcels that touch any blob.')
 parcels_list = {}
 fn = parcel_dir + '/parcels.shp'
+metrics.input(fn)
 with fiona.open(fn) as source:
     parcel_count = len(source)
     k = 0
@@ -112,7 +107,7 @@ with fiona.open(fn) as source:
         #     break
 
         s0 = shapely.geometry.geo.shape(f0['geometry'])
-        s1 = shapely.ops.transform(remap, s0)
+        s1 = projector.transform_geometry(s0)
 
         # Get the ID for this parcel.
         parcel_id = f0['properties']['id']
@@ -121,7 +116,9 @@ with fiona.open(fn) as source:
         if nb == 0:
             continue
 
-        nearby = blob_index.intersection(s1.bounds, objects=True)
+        # Take the blobs in the order they were put in the index, which doesn't depend on how
+        # the index was built.
+        nearby = sorted(blob_index.intersection(s1.bounds, objects=True), key=lambda z: z.id)
         for x in nearby:
             label = x.object
             if s1.intersects(blob_list[label]):
@@ -186,86 +183,54 @@ for label in clob_list:
 #         chunk_list[label] = clob
 
 
-# This is used below to re-map coordinates from the local system back to WGS84.
-def towgs(xx, yy, zz=None):
-    return remap(xx, yy, inverse=True)
-
-
-crs = '+proj=longlat +ellps=WGS84 +datum=WGS84'
-driver = 'ESRI Shapefile'
-
-
-outfile = area_dir + '/s_ba_clusters.shp'
+# The shapes below are all in the local system; "write_layer" re-maps them back to WGS84.
+outfile = layer_name(area_dir + '/s_ba_clusters')
 print('## Writing business area clusters to "%s"' % outfile)
+metrics.output(outfile)
 schema = {'geometry': 'MultiPoint', 'properties': {'label': 'str'}}
-with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for label in ba_points:
-        pp = ba_points[label]
-        shape = shapely.ops.transform(towgs, shapely.geometry.MultiPoint(pp))
-        outFeature = {
-            'geometry': shapely.geometry.mapping(shape),
-            'properties': {'label': label}}
-        dest.write(outFeature)
+label_list = list(ba_points.keys())
+shapes = [shapely.geometry.MultiPoint(ba_points[label]) for label in label_list]
+write_layer(outfile, shapes, {'label': label_list}, schema, projector=projector)
 
 
-outfile = area_dir + '/s_ba_blobs.shp'
+outfile = layer_name(area_dir + '/s_ba_blobs')
 print('## Writing business area blobs to "%s"' % outfile)
+metrics.output(outfile)
 schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for label in blob_list:
-        shape = shapely.ops.transform(towgs, blob_list[label])
-        outFeature = {
-            'geometry': shapely.geometry.mapping(shape),
-            'properties': {'label': label}}
-        dest.write(outFeature)
+label_list = list(blob_list.keys())
+write_layer(outfile, [blob_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
-# outfile = area_dir + '/s_ba_globs.shp'
+# outfile = layer_name(area_dir + '/s_ba_globs')
 # print('## Writing business area globs to "%s"' % outfile)
 # schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-# with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-#     for label in glob_list:
-#         shape = shapely.ops.transform(towgs, glob_list[label])
-#         outFeature = {
-#             'geometry': shapely.geometry.mapping(shape),
-#             'properties': {'label': label}}
-#         dest.write(outFeature)
+# label_list = list(glob_list.keys())
+# write_layer(outfile, [glob_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
-# outfile = area_dir + '/s_ba_clobs.shp'
+# outfile = layer_name(area_dir + '/s_ba_clobs')
 # print('## Writing business area clobs to "%s"' % outfile)
 # schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-# with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-#     for label in clob_list:
-#         shape = shapely.ops.transform(towgs, clob_list[label])
-#         outFeature = {
-#             'geometry': shapely.geometry.mapping(shape),
-#             'properties': {'label': label}}
-#         dest.write(outFeature)
+# label_list = list(clob_list.keys())
+# write_layer(outfile, [clob_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
-outfile = area_dir + '/s_ba_ortho.shp'
+outfile = layer_name(area_dir + '/s_ba_ortho')
 print('## Writing ortho-merged areas to "%s"' % outfile)
+metrics.output(outfile)
 schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-    for label in ortho_list:
-        shape = shapely.ops.transform(towgs, ortho_list[label])
-        outFeature = {
-            'geometry': shapely.geometry.mapping(shape),
-            'properties': {'label': label}}
-        dest.write(outFeature)
+label_list = list(ortho_list.keys())
+write_layer(outfile, [ortho_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
 
 
-# outfile = area_dir + '/s_ba_chunks.shp'
+# outfile = layer_name(area_dir + '/s_ba_chunks')
 # print('## Writing business area chunks to "%s"' % outfile)
 # schema = {'geometry': 'Polygon', 'properties': {'label': 'str'}}
-# with fiona.open(outfile, 'w', driver=driver, crs=crs, schema=schema) as dest:
-#     for label in chunk_list:
-#         shape = shapely.ops.transform(towgs, chunk_list[label])
-#         outFeature = {
-#             'geometry': shapely.geometry.mapping(shape),
-#             'properties': {'label': label}}
-#         dest.write(outFeature)
+# label_list = list(chunk_list.keys())
+# write_layer(outfile, [chunk_list[label] for label in label_list], {'label': label_list}, schema, projector=projector)
+
+
+metrics.finish()
 
 
 print